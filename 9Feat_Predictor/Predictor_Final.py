@@ -22,7 +22,6 @@ FoG predicted     :  Data sent = 1
 from time import sleep
 from time import time
 from joblib import load
-from queue import Queue
 import numpy as np
 import pandas as pd
 import time
@@ -33,6 +32,7 @@ import time
 import math
 import config
 from lib.constants import *
+from lib.DataBuffer import DataBuffer
 import lib.utils as utils
 sys.path.append("..")
 
@@ -42,8 +42,8 @@ Test_Rate = config.TEST_RATE
 Sample_Rate = config.SAMPLE_RATE
 STEP_SIZE = int(Sample_Rate / Test_Rate)
 
-#Data Buffer for incoming sensor data
-buffer = Queue()
+#Data Buffer for incoming sensor data, one row per sample: 12 IMU values, ground truth
+buffer = DataBuffer(config.BUFFER_SIZE, 13, overflow=config.BUFFER_OVERFLOW)
 
 #Publisher function setup
 def setupPub(pubAddr: str) -> zmq.Socket:
@@ -68,9 +68,10 @@ class readThread(threading.Thread):
     def run(self):
         while not self.shutdown.isSet():
             string = self.sub.recv_string()
-            topic,lwx,lwy,lwz,lax,lay,laz,rwx,rwy,rwz,rax,ray,raz,gt = string.split()
+            # FULLPublisher appends the trace and sequence number (see common/tracing.py), unused here
+            topic,lwx,lwy,lwz,lax,lay,laz,rwx,rwy,rwz,rax,ray,raz,gt = string.split()[:14]
             #Inserts incoming IMU data into buffer
-            buffer.put((lwx,lwy,lwz,lax,lay,laz,rwx,rwy,rwz,rax,ray,raz,gt))
+            buffer.push([float(v) for v in (lwx,lwy,lwz,lax,lay,laz,rwx,rwy,rwz,rax,ray,raz,gt)])
 
 #FoG State Classification Thread (Predicts FoG state from IMU data)            
 class detectionThread(threading.Thread):
@@ -79,8 +80,8 @@ class detectionThread(threading.Thread):
         self.shutdown   = threading.Event()
         self.publisher  = setupPub(pubSock)
         self.pubTopic   = pubTopic
-        # Container for gait observation window
-        self.window     = []
+        # Container for gait observation window, the oldest step is dropped as a new one comes in
+        self.window     = DataBuffer(Win_Size, 12)
         # Staging offline trained classifier and scaler function 
         self.scl_D    = load(config.SCL_D_JOBLIB_PATH)
         self.clf_D    = load(config.MLP_D_JOBLIB_PATH)
@@ -92,20 +93,18 @@ class detectionThread(threading.Thread):
         t = time.time()
         #Repeating prediction code
         while not self.shutdown.isSet():
-            #Running Prediction Cycle at 10Hz
-            if time.time() >= t and buffer.qsize() >= STEP_SIZE:
+            #Running Prediction Cycle at 10Hz, blocking (rather than spinning) until a step of new samples is in
+            delay = t - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if buffer.wait(STEP_SIZE, 0.1):
                 #obtain start time of prediction cycle
                 k1 = time.time()
 
                 #Updating window with new values from buffer
-                for i in range(STEP_SIZE):
-                    lwx,lwy,lwz,lax,lay,laz,rwx,rwy,rwz,rax,ray,raz,gt = buffer.get()
-                    self.window.append([float(lwx),float(lwy),float(lwz),
-                                        float(lax),float(lay),float(laz),
-                                        float(rwx),float(rwy),float(rwz),
-                                        float(rax),float(ray),float(raz)])
-                    if i == (STEP_SIZE-1):
-                        truth = gt
+                step = buffer.pop_many(STEP_SIZE)
+                self.window.push_many(step[:, :12])
+                truth = step[-1, 12]
 
                 #Running Feature extraction and state prediction
                 if len(self.window) >= Win_Size:
@@ -113,7 +112,7 @@ class detectionThread(threading.Thread):
                     #Feature Extraction Step
                     Dect_features = []
                     Pred_features = []
-                    Pred_features, Dect_features = utils.extract_sepfeat(self.window)
+                    Pred_features, Dect_features = utils.extract_sepfeat(self.window.peek(Win_Size))
 
                     #Predicting Pre-FoG state
                     sample = np.empty(shape=(1, 18))
@@ -140,9 +139,6 @@ class detectionThread(threading.Thread):
                     #Sending Predicted output to Feedback Module
                     self.publisher.send_string("%s %f" % (self.pubTopic, predicted_label))
 
-                    #Cleaning up window for next computation cycle
-                    del self.window[:STEP_SIZE]
-
                     # Obtaining computational time performance  
                     Total_time = time.time() - k1
                     # Print output and total computational time of prediction cycle                                    
@@ -0,0 +1,313 @@
+#!/usr/bin/python3
+
+#
+#   BLE manager
+#   Owns the BLE adapter and keeps the connections to the peripherals of BLE_DEVICES (the remote IMU and the wrist device),
+#   so the components never scan or connect concurrently.
+#   Binds a PUB socket to BLE_NOTIFY_SOCK, publishing the notifications and connection state of each peripheral under its role,
+#   and a PULL socket to BLE_WRITE_SOCK, taking the writes to the peripherals (see common/bleclient.py for the formats)
+#
+
+from bluepy.btle import Peripheral, DefaultDelegate, BTLEException, BTLEDisconnectError
+import zmq
+import sys
+import threading
+import logging
+import time
+sys.path.append("..")
+import config
+from common.log import setupLogging
+from common.tracing import now
+from common.metrics import registry, startMetrics
+from common.profiler import installProfiler
+from common.heartbeat import startHeartbeat, setReady, beat
+from common.bleconnect import BleConnector, PeripheralCache
+from common.bleclient import NOTIFICATION, STATE
+from Feedback.BleCommandQueue import BleCommandQueue, MockPeripheral, MOCK_HANDLES, PROP_WRITE_NO_RESP
+
+POLL_TIMEOUT = 100 # ms
+
+# BLE specfifications default values
+UUID_CCCD = "00002902"
+NOTIF_ON = b"\x01\x00" # Also turns off indication
+
+# Notifications closer than this are taken to arrive in the same connection event
+EVENT_GAP = 0.001 # seconds
+
+log = logging.getLogger("BleManager")
+
+class LinkDelegate(DefaultDelegate):
+    def __init__(self, link):
+        DefaultDelegate.__init__(self)
+        self.link = link
+
+    def handleNotification(self, cHandle, data):
+        self.link.onNotification(data)
+
+class PeripheralLink(threading.Thread):
+    """
+    The connection to one peripheral, in a thread of its own as each bluepy Peripheral must only be used by one thread.
+
+    The thread connects through the manager's adapter lock, then writes the commands queued for the peripheral between short waits
+    for its notifications, which it publishes as they arrive.
+    Per peripheral metrics: "<role>.notifications", "<role>.notify_bytes", the "<role>.notify_interval" histogram of the time
+    between notifications, and the "<role>.throughput" (bytes/s) and "<role>.conn_interval_est" gauges over the last stats interval.
+    Notifications only arrive at connection events, so the smallest time between them that is not within one event is an
+    upper bound of the connection interval, and close to it for a peripheral that notifies at every event.
+    """
+    def __init__(self, manager, device: dict):
+        """
+        Initialises PeripheralLink
+
+        Args:
+            manager (BleManager): Owner of the adapter lock and of the PUB socket.
+            device (dict): Entry of BLE_DEVICES.
+        """
+        threading.Thread.__init__(self)
+        self.manager = manager
+        self.spec = device
+        self.role = device["role"]
+        self.shutdown = threading.Event()
+        self.log = logging.getLogger("BleManager." + self.role)
+        self.connector = BleConnector(self.role, device["name"], manager.cache, config.BLE_SCAN_TIMEOUT, config.BLE_CONN_ATTEMPTS,
+            config.BLE_RECONN_INTS)
+        self.commands = BleCommandQueue(self.role, device.get("keepAlive"))
+        self.device = None
+        self.handles = None
+        self.withResponse = {}
+        self.disconnectedAt = None
+        self.lastNotification = None
+        # Totals since the start, and the smallest time between notifications since the last stats interval
+        self.statsLock = threading.Lock()
+        self.bytesIn = 0
+        self.minGap = None
+        self.lastStats = (time.monotonic(), 0)
+        self.notifications = registry.counter(self.role + ".notifications")
+        self.notifyBytes = registry.counter(self.role + ".notify_bytes")
+        self.notifyInterval = registry.histogram(self.role + ".notify_interval")
+        self.adapterWait = registry.histogram(self.role + ".adapter_wait")
+        self.reconnectTime = registry.histogram(self.role + ".reconnect_time")
+        self.reconnects = registry.counter(self.role + ".reconnects")
+        self.writes = registry.counter(self.role + ".writes")
+        self.throughput = registry.gauge(self.role + ".throughput")
+        self.connInterval = registry.gauge(self.role + ".conn_interval_est")
+        registry.gauge(self.role + ".connected", lambda: int(self.device is not None))
+
+    def run(self):
+        while not self.shutdown.isSet():
+            if self.device is None:
+                if not self.connect():
+                    self.shutdown.wait(config.BLE_RESCAN_INTS)
+                continue
+            try:
+                for command in self.commands.take():
+                    self.writeCommand(command)
+                # Bounds how long a queued command waits, bluepy cannot be woken up from waiting for notifications
+                self.device.waitForNotifications(config.BLE_POLL_INTERVAL)
+            except BTLEException as e:
+                self.log.info("Disconnected (%s)", e)
+                self.disconnected()
+
+        self.log.info("Command stats: %s", self.commands.getStats())
+        if self.device is not None:
+            self.device.disconnect()
+            self.manager.publish([self.role.encode(), STATE, b"0"])
+
+    def connect(self) -> bool:
+        t0 = time.monotonic()
+        # One scan or connection attempt on the adapter at a time, the others wait for it
+        with self.manager.adapter:
+            self.adapterWait.record(time.monotonic() - t0)
+            try:
+                if self.spec.get("mock"):
+                    device, handles = MockPeripheral(disconnectError=BTLEDisconnectError), MOCK_HANDLES
+                    self.subscribe(device, handles)
+                else:
+                    # Straight to the last known address and handles, scanning for the device only if that fails
+                    device, handles = self.connector.connect(self.discoverHandles, self.subscribe)
+            except BTLEException as e:
+                self.log.info("Connection failed: %s", e)
+                return False
+        if device is None:
+            self.log.info("Cannot find %s, is it turned on and receiving connections?", self.spec["name"])
+            return False
+
+        self.device, self.handles = device, handles
+        # Write without response skips waiting for the device's acknowledgement, where the characteristic allows it
+        self.withResponse = {key: not (self.spec.get("writeNoResponse") and handles[key + "Props"] & PROP_WRITE_NO_RESP)
+            for key in self.spec["write"]}
+        # The device forgets the states written on disconnection
+        self.commands.reset()
+        if self.disconnectedAt is not None:
+            self.reconnectTime.record(time.monotonic() - self.disconnectedAt)
+            self.disconnectedAt = None
+        self.publishState()
+        return True
+
+    def disconnected(self):
+        try:
+            self.device.disconnect()
+        except BTLEException:
+            pass
+        self.device = None
+        self.lastNotification = None
+        self.disconnectedAt = time.monotonic()
+        self.reconnects.inc()
+        self.publishState()
+
+    def discoverHandles(self, device: Peripheral) -> dict:
+        """
+        Returns:
+            dict: Handle and properties ("<key>Props") of each characteristic written, the handle of the characteristic notified
+                  under its key, and its CCCD ("cccd"). The keys match those cached by the components connecting on their own.
+        """
+        device.getServiceByUUID(self.spec["service"])
+        handles = {}
+        for key, uuid in self.spec["write"].items():
+            chars = device.getCharacteristics(uuid=uuid)
+            if len(chars) == 0:
+                raise BTLEException("Characteristic %s (%s) can't be found" % (key, uuid))
+            handles[key] = chars[0].getHandle()
+            handles[key + "Props"] = chars[0].properties
+        (key, uuid), = self.spec["notify"].items()
+        chars = device.getCharacteristics(uuid=uuid)
+        if len(chars) == 0:
+            raise BTLEException("Characteristic %s (%s) can't be found" % (key, uuid))
+        handles[key] = chars[0].getHandle()
+
+        # The first Client Charactertistic Configuration Descriptor (CCCD) after the characteristic is its own
+        charFound = False
+        for d in device.getDescriptors():
+            if d.uuid == chars[0].uuid:
+                charFound = True
+            elif charFound and UUID_CCCD in str(d.uuid):
+                handles["cccd"] = d.handle
+                return handles
+        raise BTLEException("Can't find Client Charactertistic Configuration Descriptor for %s" % key)
+
+    def subscribe(self, device: Peripheral, handles: dict):
+        # Turn on the notification, straight through the (possibly cached) CCCD handle
+        device.writeCharacteristic(handles["cccd"], NOTIF_ON, withResponse=True)
+        device.withDelegate(LinkDelegate(self))
+
+    def onNotification(self, data: bytes):
+        tRecv = now()
+        t = time.monotonic()
+        self.manager.publish([self.role.encode(), NOTIFICATION, data, b"%.6f" % tRecv])
+        self.notifications.inc()
+        self.notifyBytes.inc(len(data))
+        with self.statsLock:
+            self.bytesIn += len(data)
+            if self.lastNotification is not None:
+                gap = t - self.lastNotification
+                self.notifyInterval.record(gap)
+                if gap > EVENT_GAP and (self.minGap is None or gap < self.minGap):
+                    self.minGap = gap
+            self.lastNotification = t
+
+    def writeCommand(self, command):
+        try:
+            self.device.writeCharacteristic(self.handles[command.key], command.value, withResponse=self.withResponse[command.key])
+        except BTLEException:
+            self.commands.failed(command)
+            raise
+        # Returns once the write is acknowledged, or sent if without response
+        self.commands.sent(command, now())
+        self.writes.inc()
+
+    def put(self, key: str, value: bytes):
+        if key not in self.spec["write"]:
+            self.log.warning("Write to unknown characteristic %s dropped", key)
+            return
+        self.commands.put(key, value)
+
+    def publishState(self):
+        self.manager.publish([self.role.encode(), STATE, b"1" if self.device is not None else b"0"])
+
+    def updateStats(self):
+        """
+        Updates the throughput and connection interval gauges over the time since the last call.
+        """
+        t = time.monotonic()
+        with self.statsLock:
+            t0, bytes0 = self.lastStats
+            self.throughput.set((self.bytesIn - bytes0) / (t - t0))
+            if self.minGap is not None:
+                self.connInterval.set(self.minGap)
+            self.minGap = None
+            self.lastStats = (t, self.bytesIn)
+
+class BleManager():
+    """
+    Routes the notifications and writes of the peripherals of BLE_DEVICES between their PeripheralLinks and the components.
+    """
+    def __init__(self, devices: list, notifyAddr: str, writeAddr: str):
+        """
+        Initialises BleManager
+
+        Args:
+            devices (list): Entries of BLE_DEVICES.
+            notifyAddr (str): Address to bind the PUB socket of the notifications and connection states to.
+            writeAddr (str): Address to bind the PULL socket of the writes to.
+        """
+        self.shutdown = threading.Event()
+        # Held for each scan and connection attempt: the controller handles one at a time, concurrent ones make connections fail
+        self.adapter = threading.Lock()
+        self.cache = PeripheralCache(config.BLE_CACHE_PATH)
+        self.context = zmq.Context()
+        self.pub = self.context.socket(zmq.PUB)
+        self.pub.bind(notifyAddr)
+        # The links publish from their own threads
+        self.pubLock = threading.Lock()
+        self.pull = self.context.socket(zmq.PULL)
+        self.pull.bind(writeAddr)
+        self.links = {d["role"]: PeripheralLink(self, d) for d in devices}
+        self.msgsIn = registry.counter("msgs_in.ble_writes")
+
+    def publish(self, frames: list):
+        with self.pubLock:
+            self.pub.send_multipart(frames)
+
+    def run(self):
+        for link in self.links.values():
+            link.start()
+        setReady()
+        try:
+            nextStats = time.monotonic() + config.BLE_STATS_INTERVAL
+            while not self.shutdown.isSet():
+                beat("writes")
+                if self.pull.poll(POLL_TIMEOUT, zmq.POLLIN) != 0:
+                    role, key, value = self.pull.recv_multipart()
+                    self.msgsIn.inc()
+                    link = self.links.get(role.decode())
+                    if link is None:
+                        log.warning("Write to unknown device %s dropped", role.decode())
+                    else:
+                        link.put(key.decode(), value)
+
+                if time.monotonic() >= nextStats:
+                    nextStats += config.BLE_STATS_INTERVAL
+                    for link in self.links.values():
+                        link.updateStats()
+                        # Again every interval, for the components that subscribed after the last change
+                        link.publishState()
+        finally:
+            for link in self.links.values():
+                link.shutdown.set()
+            for link in self.links.values():
+                link.join()
+            self.pub.close()
+            self.pull.close()
+            self.context.term()
+
+if __name__ == "__main__":
+    setupLogging("BleManager")
+    startMetrics("BleManager")
+    installProfiler("BleManager")
+    startHeartbeat("BleManager")
+
+    manager = BleManager(config.BLE_DEVICES, config.BLE_NOTIFY_SOCK, config.BLE_WRITE_SOCK)
+    try:
+        manager.run()
+    except KeyboardInterrupt:
+        pass
@@ -14,15 +14,23 @@ import config
 from DataProvider.lib.lsm6ds33 import LSM6DS33
 from DataProvider.lib.lis3mdl import LIS3MDL
 from DataProvider.lib.MedianFilter import MedianFilter
+from DataProvider.lib.IMUValue import IMUValue, IMU_DTYPE, toBlock, encodeBlock
+from DataProvider.lib.ReplaySource import ReplaySource
+from common.log import setupLogging, SampledLogger
+from common.tracing import now, formatSampleTail
+from common.metrics import registry, startMetrics
+from common.profiler import installProfiler
+from common.heartbeat import startHeartbeat, setReady, beat
+
+log = logging.getLogger("DataProvider")
+sampledLog = SampledLogger(log)
 
 def setupLog():
     if not os.path.isdir(config.LOG_FOLDER):
         os.makedirs(config.LOG_FOLDER) 
 
     now = datetime.datetime.now()
-    logging.basicConfig(
-        filename=config.LOG_FILE_PREFIX 
-        + now.strftime("%d%m%Y_%H%M%S%f"))
+    setupLogging("DataProvider", config.LOG_FILE_PREFIX + now.strftime("%d%m%Y_%H%M%S%f"))
 
 def setupPub(pubAddr: str) -> zmq.Socket:
     context = zmq.Context()
@@ -31,7 +39,48 @@ def setupPub(pubAddr: str) -> zmq.Socket:
 
     return publisher
 
+def publishValue(publisher: zmq.Socket, topic: str, value: IMUValue):
+    """
+    Publishes one sample in the DATA_MSG_FORMAT set in config:
+    text    : "<topic> ax ay az gx gy gz mx my mz" followed by the trace timestamps and the sequence number
+    binary  : multipart [topic, IMU_DTYPE record] (see lib/IMUValue.py)
+    """
+    if config.DATA_MSG_FORMAT == "binary":
+        publisher.send_multipart([topic.encode(), encodeBlock(toBlock([value]))])
+    else:
+        publisher.send_string("%s %i %i %i %i %i %i %i %i %i" % ((topic,) + value.values()) + formatSampleTail(value.timestamp, now(), value.seq))
+
+def publishRecords(publisher: zmq.Socket, topic: str, block):
+    """
+    Publishes a block of IMU_DTYPE records in the DATA_MSG_FORMAT set in config: one binary message for the whole block, or one text message per record.
+    """
+    if config.DATA_MSG_FORMAT == "binary":
+        publisher.send_multipart([topic.encode(), encodeBlock(block)])
+    else:
+        tPub = now()
+        for r in block.tolist():
+            publisher.send_string(("%s" + " %i" * 9) % ((topic,) + r[:9]) + formatSampleTail(r[9], tPub, r[10]))
+
+def pubReplay(publisher: zmq.Socket, topic: str, path: str):
+    msgsOut = registry.counter("msgs_out." + topic)
+    source = ReplaySource(path)
+    if source.dtype != IMU_DTYPE:
+        log.error("%s does not hold samples of a single IMU (IMU_DTYPE)", path)
+        return
+    log.info("Replaying %d samples from %s", len(source), path)
+    if config.REPLAY_START is not None:
+        source.seekTime(config.REPLAY_START)
+
+    try:
+        for block in source.blocks(config.REPLAY_BLOCK_SIZE, config.SAMPLE_RATE):
+            publishRecords(publisher, topic, block)
+            msgsOut.inc(len(block))
+            beat("publish")
+    except KeyboardInterrupt:
+        pass
+
 def pubData(publisher: zmq.Socket, topic: str):
+    msgsOut = registry.counter("msgs_out." + topic)
     # Create IMU objects
     accGyro = LSM6DS33()
     accGyro.enableLSM()
@@ -50,9 +99,11 @@ def pubData(publisher: zmq.Socket, topic: str):
         myF = MedianFilter(config.MF_WINDOW_SIZE)
         mzF = MedianFilter(config.MF_WINDOW_SIZE)
 
+    seq = 0
     while True:
         try:
             # Read IMU values
+            tAcq = now()
             ax, ay, az = accGyro.getAccelerometerRaw()
             gx, gy, gz = accGyro.getGyroscopeRaw()
             mx, my, mz = mag.getMagnetometerRaw()
@@ -70,14 +121,18 @@ def pubData(publisher: zmq.Socket, topic: str):
                 mz = int(mzF.filt(mz))
 
             # Publish onto topic
-            publisher.send_string("%s %i %i %i %i %i %i %i %i %i" % (topic, ax, ay, az, gx, gy ,gz, mx, my, mz))
-            print("'%s': %i %i %i %i %i %i %i %i %i" % (topic, ax, ay, az, gx, gy ,gz, mx, my, mz))
+            publishValue(publisher, topic, IMUValue(ax, ay, az, gx, gy, gz, mx, my, mz, tAcq, seq))
+            msgsOut.inc()
+            seq += 1
+            beat("publish")
+            sampledLog.debug("'%s': %i %i %i %i %i %i %i %i %i", topic, ax, ay, az, gx, gy ,gz, mx, my, mz)
 
             time.sleep(0.020) # 50hz
         except KeyboardInterrupt:
             break
 
 def pubMock(publisher: zmq.Socket, topic: str, filePath: str):
+    msgsOut = registry.counter("msgs_out." + topic)
     #set working directory
     os.chdir(config.MOCK_DATA_FOLDER)
     
@@ -87,7 +142,7 @@ def pubMock(publisher: zmq.Socket, topic: str, filePath: str):
     for f in config.MOCK_DATA_PATHS:
         if f in dir_files:
             all_filenames.append(f)
-    print(all_filenames)
+    log.info("Using mock data: %s", all_filenames)
 
     #combine all files in the list
     ## Note: Xavier the dataset files all have header so will need to account for that. I removed the header in the
@@ -112,19 +167,15 @@ def pubMock(publisher: zmq.Socket, topic: str, filePath: str):
         myF = MedianFilter(config.MF_WINDOW_SIZE)
         mzF = MedianFilter(config.MF_WINDOW_SIZE)
 
+    seq = 0
     while True:
         try:
             # Read IMU values
             r = next(csvFile)
-            ax = float(r[1])
-            ay = float(r[2])
-            az = float(r[3])
-            gx = float(r[4])
-            gy = float(r[5])
-            gz = float(r[6])
-            mx = float(r[7])
-            my = float(r[8])
-            mz = float(r[9])
+            tAcq = now()
+            # Columns 1-9 are published in the order of the file, as consumers of the mock stream expect, not reordered by
+            # IMUValue.fromCsvRow()
+            ax, ay, az, gx, gy, gz, mx, my, mz = (float(v) for v in r[1:10])
 
             if config.USE_MEDIAN_FILTER:
                 # Go through median filters
@@ -139,8 +190,11 @@ def pubMock(publisher: zmq.Socket, topic: str, filePath: str):
                 mz = int(mzF.filt(mz))
 
             # Publish onto topic
-            publisher.send_string("%s %i %i %i %i %i %i %i %i %i" % (topic, ax, ay, az, gx, gy ,gz, mx, my, mz))
-            print("'%s': %i %i %i %i %i %i %i %i %i" % (topic, ax, ay, az, gx, gy ,gz, mx, my, mz))
+            publishValue(publisher, topic, IMUValue(ax, ay, az, gx, gy, gz, mx, my, mz, tAcq, seq))
+            msgsOut.inc()
+            seq += 1
+            beat("publish")
+            sampledLog.debug("'%s': %i %i %i %i %i %i %i %i %i", topic, ax, ay, az, gx, gy ,gz, mx, my, mz)
 
             time.sleep(0.020) # 50hz
         except (KeyboardInterrupt, StopIteration) as e:
@@ -151,12 +205,19 @@ def pubMock(publisher: zmq.Socket, topic: str, filePath: str):
 
 if __name__ == "__main__":
     setupLog()
+    startMetrics("DataProvider")
+    installProfiler("DataProvider")
+    startHeartbeat("DataProvider")
     publisher = setupPub(config.DATA_SOCK)
-    if config.USE_MOCK_DATA:
-        logging.info("Using MOCK data")
+    setReady()
+    if config.REPLAY_PATH is not None:
+        log.info("Using REPLAY data")
+        pubReplay(publisher, config.LOCAL_IMU_TOPIC, config.REPLAY_PATH)
+    elif config.USE_MOCK_DATA:
+        log.info("Using MOCK data")
         pubMock(publisher, config.LOCAL_IMU_TOPIC, config.MOCK_DATA_PATHS)
     else:
-        logging.info("Using REAL data")
+        log.info("Using REAL data")
         pubData(publisher, config.LOCAL_IMU_TOPIC)
 
     # Clean up
@@ -5,24 +5,31 @@ import time
 import datetime
 import sys
 import logging
-import csv
 import os
 import glob
-import pandas as pd
 sys.path.append("..")
 import config
 from DataProvider.lib.lsm6ds33 import LSM6DS33
 from DataProvider.lib.lis3mdl import LIS3MDL
 from DataProvider.lib.MedianFilter import MedianFilter
+from DataProvider.lib.IMUValue import IMUValue, GAIT_DTYPE, gaitRecord, encodeBlock
+from DataProvider.lib.ReplaySource import ReplaySource
+from DataProvider.lib.DatasetCache import DatasetCache, findTrials
+from common.log import setupLogging, SampledLogger
+from common.tracing import now, formatSampleTail
+from common.metrics import registry, startMetrics
+from common.profiler import installProfiler
+from common.heartbeat import startHeartbeat, setReady, beat, idle
+
+log = logging.getLogger("DataProvider")
+sampledLog = SampledLogger(log)
 
 def setupLog():
     if not os.path.isdir(config.LOG_FOLDER):
         os.makedirs(config.LOG_FOLDER) 
 
     now = datetime.datetime.now()
-    logging.basicConfig(
-        filename=config.LOG_FILE_PREFIX 
-        + now.strftime("%d%m%Y_%H%M%S%f"))
+    setupLogging("DataProvider", config.LOG_FILE_PREFIX + now.strftime("%d%m%Y_%H%M%S%f"))
 
 def setupPub(pubAddr: str) -> zmq.Socket:
     context = zmq.Context()
@@ -31,7 +38,81 @@ def setupPub(pubAddr: str) -> zmq.Socket:
 
     return publisher
 
+def publishGait(publisher: zmq.Socket, topic: str, left: IMUValue, right: IMUValue, gt: float):
+    """
+    Publishes one sample of both feet in the DATA_MSG_FORMAT set in config:
+    text    : "<topic> lwx lwy lwz lax lay laz rwx rwy rwz rax ray raz gt" followed by the trace timestamps and the sequence number
+    binary  : multipart [topic, GAIT_DTYPE record] (see lib/IMUValue.py)
+    """
+    if config.DATA_MSG_FORMAT == "binary":
+        publisher.send_multipart([topic.encode(), encodeBlock(gaitRecord(left, right, gt, left.timestamp, now(), left.seq))])
+    else:
+        publisher.send_string("%s %i %i %i %i %i %i %i %i %i %i %i %i %i" % (topic, left.gx, left.gy, left.gz, left.ax, left.ay, left.az,
+            right.gx, right.gy, right.gz, right.ax, right.ay, right.az, gt) + formatSampleTail(left.timestamp, now(), left.seq))
+
+def publishRecords(publisher: zmq.Socket, topic: str, block):
+    """
+    Publishes a block of GAIT_DTYPE records in the DATA_MSG_FORMAT set in config: one binary message for the whole block, or one text message per record.
+    """
+    tPub = now()
+    if config.DATA_MSG_FORMAT == "binary":
+        block["tPub"] = tPub
+        publisher.send_multipart([topic.encode(), encodeBlock(block)])
+    else:
+        for r in block.tolist():
+            publisher.send_string(("%s" + " %i" * 13) % ((topic,) + r[:13]) + formatSampleTail(r[13], tPub, r[15]))
+
+def waitForPredictor():
+    # Wait for Predictor to be ready for data
+    context = zmq.Context()
+    request = "Ready?".encode()
+    log.info("Waiting for Predictor to be ready...")
+    while True:
+        client = context.socket(zmq.REQ)
+        client.setsockopt(zmq.LINGER, 0)
+        client.connect(config.PREDICT_READY_SOCK)
+        client.send(request)
+
+        # A request sent to a Predictor that then restarts is lost, so ask again on a new socket after a timeout
+        if (client.poll(int(config.READY_RETRY_INTERVAL * 1000)) & zmq.POLLIN) != 0:
+            reply = client.recv().decode()
+            client.close()
+            if reply == "Yes":
+                log.info("Predictor is ready!")
+                break
+        else:
+            client.close()
+            log.debug("No reply from Predictor, asking again")
+    context.term()
+    setReady()
+
+    if config.WAIT_FOR_USER:
+        userInput = input("Press something to start...")
+
+def pubReplay(publisher: zmq.Socket, topic: str, path: str):
+    msgsOut = registry.counter("msgs_out." + topic)
+    source = ReplaySource(path)
+    if source.dtype != GAIT_DTYPE:
+        log.error("%s does not hold samples of both feet (GAIT_DTYPE)", path)
+        return
+    log.info("Replaying %d samples from %s", len(source), path)
+    if config.REPLAY_START is not None:
+        source.seekTime(config.REPLAY_START)
+
+    waitForPredictor()
+
+    log.info("Publishing data")
+    try:
+        for block in source.blocks(config.REPLAY_BLOCK_SIZE, config.SAMPLE_RATE):
+            publishRecords(publisher, topic, block)
+            msgsOut.inc(len(block))
+            beat("publish")
+    except KeyboardInterrupt:
+        pass
+
 def pubData(publisher: zmq.Socket, topic: str):
+    msgsOut = registry.counter("msgs_out." + topic)
+    setReady()
     # Create IMU objects
     accGyro = LSM6DS33()
     accGyro.enableLSM()
@@ -50,9 +131,11 @@ def pubData(publisher: zmq.Socket, topic: str):
         myF = MedianFilter(config.MF_WINDOW_SIZE)
         mzF = MedianFilter(config.MF_WINDOW_SIZE)
 
+    seq = 0
     while True:
         try:
             # Read IMU values
+            tAcq = now()
             ax, ay, az = accGyro.getAccelerometerRaw()
             gx, gy, gz = accGyro.getGyroscopeRaw()
             mx, my, mz = mag.getMagnetometerRaw()
@@ -71,99 +154,64 @@ def pubData(publisher: zmq.Socket, topic: str):
 
             # Publish onto topic
             #publisher.send_string("%s %i %i %i %i %i %i %i %i %i" % (topic, ax, ay, az, gx, gy ,gz, mx, my, mz))
-            publisher.send_string("%s %i %i %i %i %i %i %i %i %i %i %i %i %i" % (topic, gx, gy, gz, ax, ay, az, gx, gy, gz, ax, ay, az, 0))
-            print("'%s': %i %i %i %i %i %i %i %i %i" % (topic, ax, ay, az, gx, gy ,gz, mx, my, mz))
+            value = IMUValue(ax, ay, az, gx, gy, gz, mx, my, mz, tAcq, seq)
+            publishGait(publisher, topic, value, value, 0)
+            msgsOut.inc()
+            seq += 1
+            beat("publish")
+            sampledLog.debug("'%s': %i %i %i %i %i %i %i %i %i", topic, ax, ay, az, gx, gy ,gz, mx, my, mz)
 
             time.sleep(0.020) # 50hz
         except KeyboardInterrupt:
             break
 
 def pubMock(publisher: zmq.Socket, topic: str, filePath: str):
+    msgsOut = registry.counter("msgs_out." + topic)
+    cache = DatasetCache(config.DATASET_CACHE_FOLDER, config.DATASET_CACHE_HASH)
 
-    left_data = []
-    right_data = []
-    
     for root, dirs, files in os.walk(config.MOCK_DATA_FOLDER, topdown=False):
         for folder in dirs:
-            cwd = os.getcwd() + "/"
-            os.chdir(cwd + os.path.join(root, folder))
-            print(os.getcwd())
-            print("Testing on trial data:", folder)
-
-            #Getting left and right data readings
-            for file in os.listdir():
-                if 's2.csv' in file:
-                    left_data.append(file)
-                if 's3.csv' in file:
-                    right_data.append(file)
-
-            #combine all files in the list
-            left_csv = pd.concat([pd.read_csv(f, header=None, skiprows = 1) for f in left_data])
-            right_csv = pd.concat([pd.read_csv(f, header=None, skiprows = 1) for f in right_data])
-            #export to csv
-            if os.path.isfile("left_data.csv"):
-                os.remove("left_data.csv")
-            if os.path.isfile("right_data.csv"):
-                os.remove("right_data.csv")            
-            left_csv.to_csv("left_data.csv", index=False, encoding='utf-8-sig', header=None)
-            right_csv.to_csv("right_data.csv", index=False, encoding='utf-8-sig', header=None)
-
-            #Creating L and R feet data streams        
-            L_stream = open("left_data.csv", newline='')
-            L_csvFile = csv.reader(L_stream, delimiter=',')
-
-            R_stream = open("right_data.csv", newline='')
-            R_csvFile = csv.reader(R_stream, delimiter=',')
-           
-
-            # Wait for Predictor to be ready for data
-            context = zmq.Context()
-            client = context.socket(zmq.REQ)
-            client.connect(config.PREDICT_READY_SOCK)
-            request = "Ready?".encode()
-            print("Waiting for Predictor to be ready...")
-            client.send(request)
-            
-            if (client.poll() & zmq.POLLIN) != 0:
-                reply = client.recv().decode()
-                if reply == "Yes":
-                    print("Predictor is ready!")
-                
-            if config.WAIT_FOR_USER:
-                userInput = input("Press something to start...")
-
-            print("Publishing data")
-            while True:
-                try:
-                    # Read IMU values from left and right data stream from CSV files
-                    l = next(L_csvFile)
-                    r = next(R_csvFile)
-                    lwx = float(l[1]); lwy = float(l[2]); lwz = float(l[3])
-                    lax = float(l[4]); lay = float(l[5]); laz = float(l[6])
-                    rwx = float(r[1]); rwy = float(r[2]); rwz = float(r[3])
-                    rax = float(r[4]); ray = float(r[5]); raz = float(r[6])
-                    gt = float(r[10])
-
-                    # Publish onto topic
-                    publisher.send_string("%s %i %i %i %i %i %i %i %i %i %i %i %i %i" % (topic, lwx,lwy,lwz,lax,lay,laz, rwx,rwy,rwz,rax,ray,raz, gt))
-                    #print("%s %i %i %i %i %i %i %i %i %i %i %i %i %i" % (topic, lwx,lwy,lwz,lax,lay,laz, rwx,rwy,rwz,rax,ray,raz, gt))
-
-                    time.sleep(0.020) # 50hz
-                except (KeyboardInterrupt, StopIteration) as e:
-                    break
-
-            # Clean up
-            os.remove("left_data.csv")
-            os.remove("right_data.csv")
+            log.info("Testing on trial data: %s (%s)", folder, os.path.join(root, folder))
+
+            # Left and right data readings of every trial, parsed once and memory-mapped from the dataset cache
+            trials = findTrials(os.path.join(root, folder))
+            sources = []
+            for name, leftPath, rightPath in trials:
+                sources.append(ReplaySource(cache.loadTrial(leftPath, rightPath)))
+                log.info("Trial %s: %d samples", name, len(sources[-1]))
+            log.debug("Dataset cache: %d hits, %d misses", cache.hits, cache.misses)
+            if len(sources) == 0:
+                continue
+
+            waitForPredictor()
+
+            log.info("Publishing data")
+            try:
+                for source in sources:
+                    for block in source.blocks(1, config.SAMPLE_RATE):
+                        # Publish onto topic
+                        publishRecords(publisher, topic, block)
+                        msgsOut.inc()
+                        beat("publish")
+            except KeyboardInterrupt:
+                return
+            # Not publishing while waiting for the Predictor before the next folder
+            idle("publish")
 
 if __name__ == "__main__":
     setupLog()
+    startMetrics("DataProvider")
+    installProfiler("DataProvider")
+    startHeartbeat("DataProvider")
     publisher = setupPub(config.DATA_SOCK)
-    if config.USE_MOCK_DATA:
-        logging.info("Using MOCK data")
+    if config.REPLAY_PATH is not None:
+        log.info("Using REPLAY data")
+        pubReplay(publisher, config.LOCAL_IMU_TOPIC, config.REPLAY_PATH)
+    elif config.USE_MOCK_DATA:
+        log.info("Using MOCK data")
         pubMock(publisher, config.LOCAL_IMU_TOPIC, config.MOCK_DATA_PATHS)
     else:
-        logging.info("Using REAL data")
+        log.info("Using REAL data")
         pubData(publisher, config.LOCAL_IMU_TOPIC)
 
     # Clean up
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+#
+#   Foot merge stage
+#   Subscribes to the left foot (LEFT_FOOT_TOPIC) and right foot (RIGHT_FOOT_TOPIC) IMU streams on DATA_SOCK and REMOTE_DATA_SOCK,
+#   aligns them by timestamp (see lib/FootAligner.py) and publishes the combined 12 channel samples onto GAIT_TOPIC on GAIT_SOCK,
+#   in the same format as FULLPublisher.py, once the Predictor is ready. Set USE_FOOT_MERGE in config.py for the Predictor to read them.
+#
+
+import zmq
+import sys
+import logging
+import numpy as np
+sys.path.append("..")
+import config
+from DataProvider.lib.IMUValue import IMU_DTYPE, decodeBlock
+from DataProvider.lib.FootAligner import FootAligner
+from DataProvider.FULLPublisher import setupPub, publishRecords, waitForPredictor
+from common.log import setupLogging, SampledLogger
+from common.tracing import now, parseSampleTail
+from common.metrics import registry, startMetrics
+from common.profiler import installProfiler
+from common.heartbeat import startHeartbeat, beat
+
+log = logging.getLogger("FootMerger")
+sampledLog = SampledLogger(log)
+
+def parseSample(line: str, tRecv: float) -> tuple:
+    # "ax ay az gx gy gz mx my mz", followed by the trace timestamps if any and the sequence number
+    fields = line.split()
+    tAcq, tPub, seq = parseSampleTail(fields[9:])
+    return tuple(float(f) for f in fields[:9]) + (tRecv if tAcq is None else tAcq, 0 if seq is None else seq)
+
+def parseImu(frames: list, tRecv: float) -> tuple:
+    """
+    Converts a single IMU topic message to IMU_DTYPE records, in either DATA_MSG_FORMAT:
+    text    : "<topic> <values...>" (DataPublisher.py), or multipart [topic, sample, sample, ...] (RemoteIMU.py)
+    binary  : multipart [topic, IMU_DTYPE records]
+
+    Returns:
+        tuple: (topic, records)
+    """
+    if config.DATA_MSG_FORMAT == "binary":
+        return frames[0].decode(), decodeBlock(frames[1], IMU_DTYPE)
+    if len(frames) == 1:
+        topic, line = frames[0].decode().split(" ", 1)
+        return topic, np.array([parseSample(line, tRecv)], dtype=IMU_DTYPE)
+    return frames[0].decode(), np.array([parseSample(f.decode(), tRecv) for f in frames[1:]], dtype=IMU_DTYPE)
+
+def merge(aligner: FootAligner, publisher: zmq.Socket):
+    context = zmq.Context()
+    sub = context.socket(zmq.SUB)
+    # A SUB socket can connect to both publishers, the left and right foot may come from either
+    for addr in set((config.DATA_SOCK, config.REMOTE_DATA_SOCK)):
+        sub.connect(addr)
+    sub.setsockopt_string(zmq.SUBSCRIBE, config.LEFT_FOOT_TOPIC)
+    sub.setsockopt_string(zmq.SUBSCRIBE, config.RIGHT_FOOT_TOPIC)
+
+    msgsIn = registry.counter("msgs_in.foot_merge")
+    msgsOut = registry.counter("msgs_out." + config.GAIT_TOPIC)
+    skewTime = registry.histogram("foot_merge.skew")
+    # Time a frame spent waiting in the merge stage: from its left foot sample being received to the frame being published
+    mergeTime = registry.histogram("foot_merge.latency")
+    for name in ("held", "interpolated", "stale", "droppedLeft", "droppedRight", "bufferedLeft", "bufferedRight"):
+        registry.gauge("foot_merge." + name, lambda name=name: aligner.getStats()[name])
+
+    # Receive time of the left foot samples, to measure mergeTime
+    received = {}
+    # Poll often enough to publish a held frame soon after maxDelay runs out
+    pollTimeout = max(1, int(aligner.maxDelay * 1000 / 4))
+    log.info("Merging '%s' (left) and '%s' (right) onto '%s'", config.LEFT_FOOT_TOPIC, config.RIGHT_FOOT_TOPIC, config.GAIT_TOPIC)
+    try:
+        while True:
+            beat("merge")
+            if sub.poll(pollTimeout) & zmq.POLLIN:
+                frames = sub.recv_multipart()
+                tRecv = now()
+                try:
+                    topic, records = parseImu(frames, tRecv)
+                except (ValueError, IndexError) as e:
+                    log.warning("Dropped malformed message %s: %s", frames[:2], e)
+                    continue
+                msgsIn.inc(len(records))
+                if topic == config.LEFT_FOOT_TOPIC:
+                    aligner.pushLeft(records)
+                    for t in records["timestamp"].tolist():
+                        received[t] = tRecv
+                else:
+                    aligner.pushRight(records)
+
+            block = aligner.pop(now())
+            if len(block) == 0:
+                continue
+            publishRecords(publisher, config.GAIT_TOPIC, block)
+            tPub = now()
+            msgsOut.inc(len(block))
+            for t, skew in zip(block["tAcq"].tolist(), aligner.lastSkew):
+                skewTime.record(skew)
+                tRecv = received.pop(t, None)
+                if tRecv is not None:
+                    mergeTime.record(tPub - tRecv)
+            # Samples dropped by the aligner never come out, do not let their receive times pile up
+            if len(received) > 2 * aligner.left.maxlen:
+                received.clear()
+            sampledLog.debug("Merged %s", aligner.getStats())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log.info("Merge stats: %s", aligner.getStats())
+        context.destroy()
+
+if __name__ == "__main__":
+    setupLogging("FootMerger")
+    startMetrics("FootMerger")
+    installProfiler("FootMerger")
+    startHeartbeat("FootMerger")
+    publisher = setupPub(config.GAIT_SOCK)
+    aligner = FootAligner(config.MERGE_MAX_DELAY, config.MERGE_BUFFER_SIZE, config.MERGE_MODE, config.MERGE_MAX_HOLD)
+    waitForPredictor()
+    merge(aligner, publisher)
@@ -3,7 +3,7 @@ from bluepy.btle import *
 from queue import Queue, Empty
 import zmq
 import threading
-import builtins
+import logging
 import traceback
 import sys
 import csv
@@ -13,7 +13,15 @@ import pandas as pd
 import time
 sys.path.append("..")
 import config
-from DataProvider.lib.crc8 import crc8
+from DataProvider.lib.FrameDecoder import FrameDecoder
+from DataProvider.lib.IMUValue import IMUValue, toBlock, encodeBlock
+from common.log import setupLogging
+from common.tracing import now, formatSampleTail
+from common.metrics import registry, startMetrics
+from common.profiler import installProfiler
+from common.heartbeat import startHeartbeat, setReady, beat
+from common.bleconnect import BleConnector, PeripheralCache
+from common.bleclient import BleClient
 
 # User Configurations
 FEATHER_NAME = config.BLE_DEV_NAME
@@ -28,15 +36,13 @@ CONNECT_ATTEMPTS = config.BLE_CONN_ATTEMPTS
 RESCAN_INTERVAL = config.BLE_RESCAN_INTS
 
 # BLE specfifications default values
-ADT_COMPLETE_NAME = 0x09
 UUID_CCCD = "00002902"
 NOTIF_ON = b"\x01\x00" # Also turns off indication
 NOTIF_OFF = b"\x00\x00" # Also turns off indication
 
 # Message values
 START_BYTE = b"\xff"
-MSG_LEN = 38
-FIELD_LEN = 4 # Float is 4 bytes
+MSG_LEN = FrameDecoder.PAYLOAD.size + 2 # START_BYTE + 9 floats + CRC byte
 
 # Exit codes
 SUCCESS = 0
@@ -45,6 +51,10 @@ DATA_SERVICE_NOT_FOUND = 2
 DATA_CHARACTERISTIC_NOT_FOUND = 3
 CCCD_NOT_FOUND = 4
 
+# Publisher values
+QUEUE_TIMEOUT = 0.5 # seconds
+SAMPLE_FMT = "%0.2f %0.2f %0.2f %0.2f %0.2f %0.2f %0.2f %0.2f %0.2f"
+
 SEPARATOR = "----------"
 COMBINED_DATA_FILE = "remote_combined.csv"
 
@@ -59,8 +69,13 @@ class NotificationHandler(DefaultDelegate):
 
         """
         DefaultDelegate.__init__(self)
-        self.buffer = bytes()
+        self.decoder = FrameDecoder(START_BYTE[0])
         self.queue = Queue()
+        self.notifications = registry.counter("ble.notifications")
+        registry.gauge("remote_imu.queue_depth", self.queue.qsize)
+        registry.gauge("remote_imu.crc_errors", lambda: self.decoder.crcErrors)
+        registry.gauge("remote_imu.frames_lost", lambda: self.decoder.framesLost)
+        registry.gauge("remote_imu.bytes_dropped", lambda: self.decoder.bytesDropped)
                                                   
     def handleNotification(self, cHandle, data):  
         """
@@ -72,63 +87,67 @@ class NotificationHandler(DefaultDelegate):
         """
         self.processData(data)
 
-    def processData(self, data: bytes):
+    def processData(self, data: bytes, tAcq: float = None):
         """
         Processes any new incoming data into the buffer.
 
-        If a complete message has been received, the data in the message will be extracted and place in the queue.
+        Every complete message that passes its CRC check will have its data extracted and placed in the queue as an IMUValue, along with the time the data arrived and its sequence number.
+        Leading bytes that do not belong to any message and messages that fail the CRC check are dropped, and skipped in the sequence numbers (see FrameDecoder).
 
         Args:
             data (bytes): New incoming data.
+            tAcq (float, optional): Time the data arrived, if received through the BLE manager. Defaults to now.
         """
-        self.buffer += data
-
-        # If this is true, it means that we are seeing the start of a FULL message.
-        if (self.buffer.startswith(START_BYTE)) and (len(self.buffer) >= MSG_LEN):
-            while (self.buffer.startswith(START_BYTE)) and (len(self.buffer) >= MSG_LEN):
-                msg = self.buffer[0:MSG_LEN] # Retrieve the rest of the full message.
-                self.buffer = self.buffer[MSG_LEN:] # Keep the rest of the buffer.
-                self.processMsg(msg) # Process message.
-
-        # If we reached here, it means that either there are leading bytes at the front that does not belong to any message 
-        # (there was no START_BYTE or we have never received the START_BYTE, only received some parts of that message)
-        # OR we have seen the START_BYTE but the full message hasn't arrived completely yet. So we wait for more data to come in.
-        else:
-            sPos = self.buffer.find(START_BYTE) # Find the index position of the FIRST START_BYTE
-            if sPos > 0:
-                self.buffer = self.buffer[sPos:] # Keep the buffer, starting from the first START_BYTE until the end. Essentially removing leading bytes if there are any.
-
-    def processMsg(self, msg: bytes):
+        if tAcq is None:
+            tAcq = now()
+        self.notifications.inc()
+        seqs = []
+        frames = self.decoder.feed(data, seqs)
+        for values, seq in zip(frames, seqs):
+            self.queue.put(IMUValue.fromFrame(values, tAcq, seq))
+
+    def getStats(self) -> dict:
         """
-        Processes the message to extract it's contents (data).
+        Retrieves the message decoding statistics.
 
-        Args:
-            msg (bytes): Message to extract data from.
+        Returns:
+            dict: Counts of decoded messages, messages counted as lost, CRC errors and bytes dropped.
         """
-        crc = crc8(msg[:MSG_LEN-1])
-        if crc != msg[MSG_LEN-1]:
-            return # Error in bytes, disregard this data set
-
-        values = []
-        # Disregard the START_BYTE
-        for i in range(1, MSG_LEN-1, FIELD_LEN):
-            value = msg[i:i+FIELD_LEN]
-            value = struct.unpack('f', value)[0]
-            values.append(value)
-        self.queue.put(values)
-
-    def getValue(self) -> list:
+        return self.decoder.getStats()
+
+    def getValue(self) -> IMUValue:
         """
         Retrieves a single value from the queue buffer.
 
         Returns:
-            list: List containing IMU values: [ax, ay, az, gx, gy, gz, mx, my, mz]
+            IMUValue: IMU values, with their arrival time as timestamp. None if the queue is empty.
         """
         try:
             return self.queue.get(block=False)
         except Empty:
             return None
 
+    def getValues(self, timeout: float) -> list:
+        """
+        Waits for at least one value to arrive, then retrieves every value that is currently queued.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait for the first value.
+
+        Returns:
+            list: Queued IMU values (see getValue), oldest first. Empty if nothing arrived within the timeout.
+        """
+        try:
+            values = [self.queue.get(timeout=timeout)]
+        except Empty:
+            return []
+
+        while True:
+            try:
+                values.append(self.queue.get_nowait())
+            except Empty:
+                return values
+
     
 
 class ReceiveThread(threading.Thread):
@@ -149,12 +168,13 @@ class ReceiveThread(threading.Thread):
         """
         threading.Thread.__init__(self)
         self.bleDev = None
-        self.bleAddr = None
-        self.bleAddrType = None
         self.notifHandler = notifHandler
+        # Reconnects straight to the last known address and handles, scanning only if that fails
+        self.connector = BleConnector("remote_imu", FEATHER_NAME, PeripheralCache(config.BLE_CACHE_PATH), SCAN_TIMEOUT,
+            CONNECT_ATTEMPTS, RECONNECT_INTERVAL)
         self.shutdown = threading.Event()
         self.connectedEvent = connectedEvent
-        self.printPrefix = "[" + self.__class__.__name__ + "]:\t"
+        self.log = logging.getLogger("RemoteIMU." + self.__class__.__name__)
 
     def run(self):
         # Establish connection first.
@@ -170,90 +190,57 @@ class ReceiveThread(threading.Thread):
                 # If it ever disconnects midway, attempt to reconnect.
                 self.connectedEvent.clear()
                 self.print("BLE disconnected, will attempt to reconnect...")
+                registry.counter("ble.reconnects").inc()
+                self.printStats()
+                t0 = time.monotonic()
                 self.makeConnection() # Establish connection again.
+                # The Predictor gets no data from this foot for that long
+                registry.histogram("remote_imu.reconnect_time").record(time.monotonic() - t0)
 
         # Cleanup
-        self.bleDev.disconnect()
+        self.printStats()
+        if self.bleDev is not None:
+            self.bleDev.disconnect()
+
+    def printStats(self):
+        stats = self.notifHandler.getStats()
+        self.print("Messages decoded: %i, lost: %i, CRC errors: %i, bytes dropped: %i" % (stats["framesDecoded"], stats["framesLost"],
+            stats["crcErrors"], stats["bytesDropped"]))
 
     def makeConnection(self):
-        success = False
-        while not success:
+        while not self.shutdown.isSet():
             try:
-                if self.bleScan():  # Scan for our device first.
-                    self.bleConnect() # Connect once we found it. This will block until a connection can be made.
-                    success = True
-                else:
-                    self.print("Cannot scan and find device, retrying in %.2f seconds..." % RESCAN_INTERVAL)
-                    time.sleep(RESCAN_INTERVAL)
+                self.bleDev, handles = self.connector.connect(self.discoverHandles, self.subNotification)
+                if self.bleDev is not None:
+                    self.connectedEvent.set()
+                    return
+                self.print("Cannot find device, is it turned on and receiving connections?")
             except Exception as e:
-                self.print("UNKNOWN ERROR")
-                self.print(e)
-
-    def bleScan(self) -> bool:
-        # Scan for the device name we are interested in.
-        scanEntry = self.scanDevice(FEATHER_NAME)
-        if scanEntry is None:
-            self.print("Cannot find device, is it turned on and receiving connections?")
-            return False
-        else:
-            self.bleAddr = scanEntry.addr
-            self.bleAddrType = scanEntry.addrType
-            return True
-
-    def bleConnect(self):
-        count = 0
-        while count < CONNECT_ATTEMPTS + 1:
-            count += 1
-            try:
-                self.print("Attempt #%i connection to address: %s" %(count, self.bleAddr))
-                self.bleDev = Peripheral(self.bleAddr, self.bleAddrType)
-                self.print("Connection success to address:", self.bleAddr)
-                break
-            except (BTLEException, Exception):
-                self.print("Connection unsuccessful, reconnecting in %0.2f seconds..." % RECONNECT_INTERVAL)
-                time.sleep(RECONNECT_INTERVAL)
-                continue
+                self.print("Connection failed:", e)
+            self.print("Retrying in %.2f seconds..." % RESCAN_INTERVAL)
+            time.sleep(RESCAN_INTERVAL)
 
-        self.subNotification(self.bleDev, DATA_SVC_UUID, DATA_CHAR_UUID, self.notifHandler)
-        self.connectedEvent.set()
-
-    def scanDevice(self, targetName: str) -> ScanEntry:
-        self.print("Scanning for", targetName)
-        scanner = Scanner()
-        scanner.scan(SCAN_TIMEOUT)
-        for d in scanner.getDevices():
-            if d.getValueText(ADT_COMPLETE_NAME) == targetName:
-                self.print("Found", targetName)
-                self.print("Address:", d.addr)
-                return d
-        self.print(SEPARATOR)
-        return None
-
-    def subNotification(self, device: Peripheral, svcUuid: str, charUuid: str, notifHandler: NotificationHandler):
+    def discoverHandles(self, device: Peripheral) -> dict:
         # First check that the data stream service exists
         self.print("Finding IMU data stream service with UUID:", DATA_SVC_UUID)
         try:
-            svc = device.getServiceByUUID(svcUuid)
+            svc = device.getServiceByUUID(DATA_SVC_UUID)
         except BTLEException as e:
-            self.print("Data stream service can't be found. Exiting.")
+            self.print("Data stream service can't be found.")
             raise e from None
         self.print("Found IMU data stream service!")
         self.print(SEPARATOR)
         
         # Check that the charactertistic we are interested in exists.
         self.print("Finding IMU data characteristic with UUID:", DATA_CHAR_UUID)
-        try:
-            chars = device.getCharacteristics(uuid=charUuid)
-            if len(chars) == 0:
-                raise Exception
-        except Exception as e:
-            self.print("Error finding data stream characteristic, can't be found.")
-            raise e from None
+        chars = device.getCharacteristics(uuid=DATA_CHAR_UUID)
+        if len(chars) == 0:
+            raise BTLEException("Data stream characteristic can't be found")
 
         self.print("Found IMU data stream characteristic!")
         self.print(SEPARATOR)
 
-        # Now that we are sure both the service and characteristics exists, we subscribe to receive notifications whenever there is new data.
+        # Then the handle to subscribe to notifications through.
         self.print("Finding CCCD handle to subscribe to notifications:", DATA_CHAR_UUID)
         ch = chars[0] # Assuming the characteristic is the only element.
         charFound = False
@@ -269,19 +256,20 @@ class ReceiveThread(threading.Thread):
                     break
 
         if cccd is None:
-            self.print("Can't find Client Charactertistic Configuration Descriptor for data stream charateristic. Exiting.")
-            exit(CCCD_NOT_FOUND)
-        
-        # Turn on the notification
-        cccd.write(NOTIF_ON, withResponse=True)
+            raise BTLEException("Can't find Client Charactertistic Configuration Descriptor for data stream charateristic")
+        return {"data": ch.getHandle(), "cccd": cccd.handle}
+
+    def subNotification(self, device: Peripheral, handles: dict):
+        # Turn on the notification, straight through the (possibly cached) CCCD handle
+        device.writeCharacteristic(handles["cccd"], NOTIF_ON, withResponse=True)
 
         # Set notification handler 
-        device.withDelegate(notifHandler)
+        device.withDelegate(self.notifHandler)
         self.print("Successfully subscribed!")
         self.print(SEPARATOR)
 
-    def print(self, *objs, **kwargs):
-        builtins.print(self.printPrefix, *objs, **kwargs)
+    def print(self, *objs):
+        self.log.info(" ".join(str(o) for o in objs))
 
 class PublishThread(threading.Thread):
     def __init__(self, notifHandler: NotificationHandler, publishAddr: str, pubTopic: str, useMock: bool):
@@ -289,12 +277,14 @@ class PublishThread(threading.Thread):
         self.shutdown = threading.Event()
         self.bleConnected = threading.Event()
         self.notifHandler = notifHandler
-        self.printPrefix = "[" + self.__class__.__name__ + "]:\t"
+        self.log = logging.getLogger("RemoteIMU." + self.__class__.__name__)
         self.pubAddr = publishAddr
         self.pubTopic = pubTopic
         self.publisher = None
         self.useMock = useMock
         self.mockReader = None
+        self.msgsOut = registry.counter("msgs_out." + pubTopic)
+        self.batchSize = registry.histogram("remote_imu.batch_size", unit=1)
 
     def run(self):
         self.setupPub()
@@ -310,23 +300,37 @@ class PublishThread(threading.Thread):
             connected = self.bleConnected.wait(0.5)
             if connected:
                 self.print("BLE connected!")
+                setReady()
                 break
 
         while not self.shutdown.isSet():
-            value = self.notifHandler.getValue()
-            
-            if value is not None:
-                if self.useMock:
-                    try:
-                        value = next(self.mockReader)
-                    except StopIteration:
-                        self.print("Reached end of data")
-                        break
-                    s = "%s %s %s %s %s %s %s %s %s %s" % (self.pubTopic, value[1], value[2], value[3], value[4], value[5], value[6], value[7], value[8], value[9])
-                else:
-                    s = "%s %0.2f %0.2f %0.2f %0.2f %0.2f %0.2f %0.2f %0.2f %0.2f" % (self.pubTopic, value[0], value[1], value[2], value[3], value[4], value[5], value[6], value[7], value[8])
-                self.publisher.send_string(s)
-                self.print(s)
+            beat("publish")
+            # Block until data arrives, the timeout only bounds how long a shutdown request can go unnoticed.
+            values = self.notifHandler.getValues(QUEUE_TIMEOUT)
+            if len(values) == 0:
+                continue
+
+            tPub = now()
+            if self.useMock:
+                try:
+                    if config.DATA_MSG_FORMAT == "binary":
+                        values = [IMUValue.fromCsvRow(next(self.mockReader), v.timestamp, v.seq) for v in values]
+                    else:
+                        lines = [self.formatMock(next(self.mockReader), v.timestamp, tPub, v.seq) for v in values]
+                except StopIteration:
+                    self.print("Reached end of data")
+                    break
+            elif config.DATA_MSG_FORMAT != "binary":
+                lines = [self.formatValue(v, tPub) for v in values]
+
+            # Everything that piled up since the last wake up goes out as one multipart message:
+            # [topic, sample, sample, ...] in text format, [topic, IMU_DTYPE records] in binary format
+            if config.DATA_MSG_FORMAT == "binary":
+                self.publisher.send_multipart([self.pubTopic.encode(), encodeBlock(toBlock(values))])
+            else:
+                self.publisher.send_multipart([self.pubTopic.encode()] + lines)
+            self.msgsOut.inc(len(values))
+            self.batchSize.record(len(values))
 
         self.print("Cleaning up publisher")
 
@@ -338,6 +342,12 @@ class PublishThread(threading.Thread):
         self.print("Closed publisher")
         self.shutdown.set()
     
+    def formatValue(self, value: IMUValue, tPub: float) -> bytes:
+        return (SAMPLE_FMT % value.values() + formatSampleTail(value.timestamp, tPub, value.seq)).encode()
+
+    def formatMock(self, row: list, tAcq: float, tPub: float, seq: int) -> bytes:
+        return (" ".join(row[1:10]) + formatSampleTail(tAcq, tPub, seq)).encode()
+
     def concatData(self) -> csv.reader:
         #set working directory
         os.chdir(config.REMOTE_MOCK_FOLDER)
@@ -369,15 +379,23 @@ class PublishThread(threading.Thread):
         self.publisher = context.socket(zmq.PUB)
         self.publisher.bind(self.pubAddr)
 
-    def print(self, *objs, **kwargs):
-        builtins.print(self.printPrefix, *objs, **kwargs)
+    def print(self, *objs):
+        self.log.info(" ".join(str(o) for o in objs))
 
 if __name__ == "__main__":
+    setupLogging("RemoteIMU")
+    startMetrics("RemoteIMU")
+    installProfiler("RemoteIMU")
+    startHeartbeat("RemoteIMU")
     notifHandler = NotificationHandler()
 
-    pubData = PublishThread(notifHandler, config.DATA_SOCK, config.REMOTE_IMU_TOPIC, config.REMOTE_USE_MOCK)
+    pubData = PublishThread(notifHandler, config.REMOTE_DATA_SOCK, config.REMOTE_IMU_TOPIC, config.REMOTE_USE_MOCK)
     pubData.start()
-    recvData = ReceiveThread(notifHandler, pubData.bleConnected)
+    if config.BLE_USE_MANAGER:
+        # The BLE manager owns the connection and forwards the notifications
+        recvData = BleClient("remote_imu", notifHandler.processData, pubData.bleConnected)
+    else:
+        recvData = ReceiveThread(notifHandler, pubData.bleConnected)
     recvData.start()
 
     while threading.activeCount() > 0:
@@ -0,0 +1,24 @@
+#!/usr/bin/python3
+
+#
+#   Converts recorded trial CSVs to .npy replay files (see lib/ReplaySource.py)
+#
+#   Usage (from the DataProvider folder):
+#       python3 convertReplay.py gait <left foot s2.csv> <right foot s3.csv> <out.npy>    for FULLPublisher.py
+#       python3 convertReplay.py imu <trial.csv> <out.npy>                                for DataPublisher.py
+#
+
+import sys
+sys.path.append("..")
+import config
+from DataProvider.lib.ReplaySource import convertTrial, convertImu
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "gait":
+        records = convertTrial(sys.argv[2], sys.argv[3], sys.argv[4])
+    elif len(sys.argv) == 4 and sys.argv[1] == "imu":
+        records = convertImu(sys.argv[2], sys.argv[3])
+    else:
+        print("Usage: convertReplay.py gait <left foot s2.csv> <right foot s3.csv> <out.npy> | imu <trial.csv> <out.npy>")
+        sys.exit(1)
+    print("Wrote %d samples (%.1f s) to %s" % (len(records), len(records) / config.SAMPLE_RATE, sys.argv[-1]))
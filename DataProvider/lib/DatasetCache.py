@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import os
+import re
+import time
+import numpy as np
+from DataProvider.lib.ReplaySource import TIME_FIELD, convertTrial, convertImu
+
+MANIFEST = "manifest.json"
+# Left (s2) and right (s3) foot files of a recorded trial, e.g. FoG-T-141_2_t1_s2.csv
+TRIAL_PATTERN = re.compile(r"^(.*)_s([23])\.csv$")
+
+def findTrials(folder: str) -> list:
+    """
+    Finds the recorded trials of a folder that have both a left (s2) and a right (s3) foot file.
+
+    Returns:
+        list: (name, left path, right path) tuples, sorted by name.
+    """
+    sides = {}
+    for f in os.listdir(folder):
+        m = TRIAL_PATTERN.match(f)
+        if m is not None:
+            sides.setdefault(m.group(1), {})[m.group(2)] = os.path.join(folder, f)
+    return [(name, s["2"], s["3"]) for name, s in sorted(sides.items()) if "2" in s and "3" in s]
+
+def gtSpans(records: np.ndarray) -> list:
+    """
+    Returns:
+        list: [start, end] recorded times of every run of consecutive samples whose ground truth is FoG.
+    """
+    if "gt" not in records.dtype.names or len(records) == 0:
+        return []
+    t = records[TIME_FIELD[records.dtype]]
+    fog = np.concatenate(([0], (records["gt"] > 0).astype(np.int8), [0]))
+    edges = np.diff(fog)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    return [[float(t[s]), float(t[e])] for s, e in zip(starts, ends)]
+
+class DatasetCache():
+    """
+    Cache of recorded trials converted from CSV to .npy record files (see ReplaySource.py).
+
+    A trial is parsed once; later loads memory-map the converted file, which takes milliseconds whatever the size of the trial.
+    Entries are keyed on the path, modification time and size of their source files (or on their content, see 'contentHash'),
+    so editing or replacing a CSV converts it again on its next load. The manifest lists every entry with its number of
+    samples, duration and ground truth FoG spans, and can be read without loading any data.
+    """
+    def __init__(self, folder: str, contentHash: bool = False):
+        """
+        Initialises DatasetCache
+
+        Args:
+            folder (str): Folder holding the converted files and the manifest, created if needed.
+            contentHash (bool, optional): Key entries on a SHA-1 of the source files instead of their modification time and size.
+                                          Survives copies and checkouts that touch the files, but reads every source file on every load. Defaults to False.
+        """
+        self.folder = folder
+        self.contentHash = contentHash
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(folder, exist_ok=True)
+        self.manifestPath = os.path.join(folder, MANIFEST)
+        self.manifest = self._readManifest()
+
+    def _readManifest(self) -> dict:
+        try:
+            with open(self.manifestPath) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _writeManifest(self):
+        tmp = self.manifestPath + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifestPath)
+
+    def key(self, kind: str, paths: list) -> str:
+        """
+        Returns:
+            str: Cache key of the conversion 'kind' ("gait" or "imu") of the source files in 'paths'.
+        """
+        h = hashlib.sha1(kind.encode())
+        for path in paths:
+            if self.contentHash:
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(2**20), b""):
+                        h.update(block)
+            else:
+                st = os.stat(path)
+                h.update(("%s|%d|%d" % (os.path.abspath(path), st.st_mtime_ns, st.st_size)).encode())
+        return h.hexdigest()[:16]
+
+    def _load(self, kind: str, paths: list, convert) -> np.ndarray:
+        key = self.key(kind, paths)
+        entry = self.manifest.get(key)
+        if entry is not None:
+            path = os.path.join(self.folder, entry["file"])
+            if os.path.isfile(path):
+                self.hits += 1
+                return np.load(path, mmap_mode="r")
+
+        self.misses += 1
+        sources = [os.path.abspath(p) for p in paths]
+        # Drop the stale entries of the same sources
+        for old in [k for k, e in self.manifest.items() if e["sources"] == sources and e["kind"] == kind]:
+            try:
+                os.remove(os.path.join(self.folder, self.manifest[old]["file"]))
+            except OSError:
+                pass
+            del self.manifest[old]
+
+        name = "%s_%s.npy" % (os.path.splitext(os.path.basename(paths[0]))[0], key)
+        path = os.path.join(self.folder, name)
+        tmp = path + ".tmp.npy"
+        records = convert(*paths, tmp)
+        os.replace(tmp, path)
+
+        t = records[TIME_FIELD[records.dtype]]
+        self.manifest[key] = {
+            "kind": kind,
+            "sources": sources,
+            "file": name,
+            "rows": len(records),
+            "duration": float(t[-1] - t[0]) if len(records) > 0 else 0.0,
+            "gtSpans": gtSpans(records),
+            "created": time.time(),
+        }
+        self._writeManifest()
+        return np.load(path, mmap_mode="r")
+
+    def loadTrial(self, leftPath: str, rightPath: str) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Read-only memory-mapped GAIT_DTYPE records of the trial, see convertTrial().
+        """
+        return self._load("gait", [leftPath, rightPath], convertTrial)
+
+    def loadImu(self, path: str) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Read-only memory-mapped IMU_DTYPE records of a single IMU file, see convertImu().
+        """
+        return self._load("imu", [path], convertImu)
+
+    def entry(self, kind: str, paths: list) -> dict:
+        """
+        Returns:
+            dict: Manifest entry of the sources if they are cached and up to date, otherwise None.
+        """
+        return self.manifest.get(self.key(kind, paths))
+
+    def clear(self):
+        """
+        Removes every converted file and empties the manifest.
+        """
+        for e in self.manifest.values():
+            try:
+                os.remove(os.path.join(self.folder, e["file"]))
+            except OSError:
+                pass
+        self.manifest = {}
+        self._writeManifest()
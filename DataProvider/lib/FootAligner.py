@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+import collections
+import numpy as np
+from DataProvider.lib.IMUValue import GAIT_DTYPE
+
+# Interpolation of the right foot at the time of a left foot sample
+LINEAR = "linear"
+NEAREST = "nearest"
+
+# Positions in the tuples of IMU_DTYPE records (see IMUValue.py): ax ay az gx gy gz mx my mz timestamp seq
+_GYRO = slice(3, 6)
+_ACC = slice(0, 3)
+_TIME = 9
+
+class FootAligner():
+    """
+    Aligns the samples of the left and right foot IMUs by timestamp and combines them into GAIT_DTYPE frames.
+
+    The left foot is the reference: one frame is made per left foot sample, with the right foot values at the same time,
+    linearly interpolated between the two right foot samples around it, or taken from the nearest of them.
+    A left foot sample waits until the right foot sample following it has arrived, but no longer than 'maxDelay' seconds:
+    past that, the newest right foot sample is held (or, if there is none yet, the left foot sample is dropped),
+    so the added latency is bounded whatever the right foot stream does.
+    A right foot sample is held for at most 'maxHold' seconds: when the right foot stream stops (e.g. a BLE dropout), the left foot
+    samples are dropped rather than merged with stale values. The frames carry the sequence number of their left foot sample,
+    so every sample dropped leaves a gap in the sequence numbers for the Predictor to see.
+    Both buffers hold at most 'maxSamples' samples, the oldest are dropped beyond that.
+
+    Timestamps must come from the same clock as the 'now' passed to pop(), e.g. the tAcq of the samples (common/tracing.py).
+    """
+    def __init__(self, maxDelay: float = 0.1, maxSamples: int = 50, mode: str = LINEAR, maxHold: float = 0.2):
+        """
+        Initialises FootAligner
+
+        Args:
+            maxDelay (float, optional): Seconds a left foot sample waits for the right foot. Defaults to 0.1.
+            maxSamples (int, optional): Samples buffered per foot. Defaults to 50.
+            mode (str, optional): LINEAR or NEAREST. Defaults to LINEAR.
+            maxHold (float, optional): Seconds a right foot sample is held for at most. Defaults to 0.2.
+        """
+        if mode not in (LINEAR, NEAREST):
+            raise ValueError("Unknown alignment mode: %s" % mode)
+        self.maxDelay = maxDelay
+        self.maxHold = maxHold
+        self.mode = mode
+        self.left = collections.deque(maxlen=maxSamples)
+        self.right = collections.deque(maxlen=maxSamples)
+        self.seq = 0
+        # Statistics
+        self.pushedLeft = 0
+        self.pushedRight = 0
+        self.merged = 0
+        self.interpolated = 0
+        self.held = 0
+        self.droppedLeft = 0
+        self.droppedRight = 0
+        self.stale = 0
+        self.lastSkew = [] # Per frame returned by the last pop(): seconds between its left foot sample and the nearest right foot sample
+
+    def _push(self, buffer: collections.deque, records: np.ndarray) -> int:
+        dropped = 0
+        for r in records.tolist():
+            # Out of order samples cannot be aligned, drop them
+            if len(buffer) > 0 and r[_TIME] < buffer[-1][_TIME]:
+                dropped += 1
+                continue
+            if len(buffer) == buffer.maxlen:
+                dropped += 1
+            buffer.append(r)
+        return dropped
+
+    def pushLeft(self, records: np.ndarray):
+        """
+        Args:
+            records (np.ndarray): IMU_DTYPE records of the left foot.
+        """
+        self.pushedLeft += len(records)
+        self.droppedLeft += self._push(self.left, records)
+
+    def pushRight(self, records: np.ndarray):
+        """
+        Args:
+            records (np.ndarray): IMU_DTYPE records of the right foot.
+        """
+        self.pushedRight += len(records)
+        self.droppedRight += self._push(self.right, records)
+
+    def _rightAt(self, t: float, before: tuple, after: tuple) -> tuple:
+        if before is None:
+            return after[_GYRO] + after[_ACC], abs(after[_TIME] - t)
+        if after is None:
+            return before[_GYRO] + before[_ACC], abs(t - before[_TIME])
+        dt = after[_TIME] - before[_TIME]
+        if self.mode == NEAREST or dt <= 0:
+            nearest = before if t - before[_TIME] <= after[_TIME] - t else after
+            return nearest[_GYRO] + nearest[_ACC], abs(nearest[_TIME] - t)
+        self.interpolated += 1
+        w = (t - before[_TIME]) / dt
+        values = tuple(b + w * (a - b) for b, a in zip(before[_GYRO] + before[_ACC], after[_GYRO] + after[_ACC]))
+        return values, min(t - before[_TIME], after[_TIME] - t)
+
+    def pop(self, now: float) -> np.ndarray:
+        """
+        Makes the frames of every left foot sample that can be aligned, or has waited 'maxDelay'.
+
+        Args:
+            now (float): Current time, on the clock of the timestamps.
+
+        Returns:
+            np.ndarray: GAIT_DTYPE frames (possibly none), oldest first. tAcq is the time of the left foot sample, gt is 0.
+        """
+        frames = []
+        skews = []
+        while len(self.left) > 0:
+            l = self.left[0]
+            t = l[_TIME]
+            # Keep a single right foot sample at or before t, the older ones are not needed anymore
+            while len(self.right) >= 2 and self.right[1][_TIME] <= t:
+                self.right.popleft()
+            if len(self.right) == 0:
+                before = after = None
+            elif self.right[0][_TIME] >= t:
+                before, after = None, self.right[0]
+            else:
+                before = self.right[0]
+                after = self.right[1] if len(self.right) >= 2 else None
+
+            if after is None:
+                # Wait for the right foot, up to maxDelay
+                if now - t < self.maxDelay:
+                    break
+                self.left.popleft()
+                if before is None:
+                    self.droppedLeft += 1
+                    self.seq += 1
+                    continue
+                if t - before[_TIME] > self.maxHold:
+                    self.stale += 1
+                    self.seq += 1
+                    continue
+                self.held += 1
+            else:
+                self.left.popleft()
+
+            right, skew = self._rightAt(t, before, after)
+            frames.append(l[_GYRO] + l[_ACC] + right + (0.0, t, 0.0, self.seq))
+            skews.append(skew)
+            self.seq += 1
+        self.merged += len(frames)
+        self.lastSkew = skews
+        return np.array(frames, dtype=GAIT_DTYPE)
+
+    def getStats(self) -> dict:
+        return {
+            "pushedLeft": self.pushedLeft,
+            "pushedRight": self.pushedRight,
+            "merged": self.merged,
+            "interpolated": self.interpolated,
+            "held": self.held,
+            "droppedLeft": self.droppedLeft,
+            "droppedRight": self.droppedRight,
+            "stale": self.stale,
+            "bufferedLeft": len(self.left),
+            "bufferedRight": len(self.right),
+        }
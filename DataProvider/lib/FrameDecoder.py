@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+import struct
+from DataProvider.lib.crc8 import crc8
+
+class FrameDecoder():
+    """
+    Incremental decoder for the framed IMU messages sent by the remote IMU over BLE.
+
+    Each frame is laid out as: START_BYTE | 9 little-endian floats (ax, ay, az, gx, gy, gz, mx, my, mz) | CRC8.
+
+    Incoming bytes are copied once into a preallocated bytearray. Frames are located with a read cursor and decoded in place,
+    so no intermediate bytes objects are created per frame. The buffer is only compacted when the write position reaches the end.
+
+    If a frame fails its CRC check, the decoder resynchronises by searching for the next START_BYTE after the failed one.
+
+    The frames carry no sequence number, so the decoder numbers them, counting the frames lost in the bytes dropped between two
+    good frames (at least one, else one per frame length). Frames lost whole, with no byte of them received, leave no trace in
+    the byte stream and cannot be counted: they only show as a pause in the arrivals.
+    """
+    PAYLOAD = struct.Struct("<9f")
+
+    def __init__(self, startByte: int = 0xff, capacity: int = 1024):
+        """
+        Initialises FrameDecoder
+
+        Args:
+            startByte (int, optional): Value of the byte marking the start of a frame. Defaults to 0xff.
+            capacity (int, optional): Initial size of the receive buffer in bytes. Grows if a single chunk of data does not fit. Defaults to 1024.
+        """
+        self.startByte = startByte
+        self.msgLen = self.PAYLOAD.size + 2 # START_BYTE + payload + CRC
+        self.buffer = bytearray(max(capacity, self.msgLen))
+        self.view = memoryview(self.buffer)
+        self.head = 0 # Read cursor, position of the oldest unprocessed byte.
+        self.tail = 0 # Write cursor, position after the newest received byte.
+
+        self.seq = 0 # Sequence number of the next frame.
+        self.skipped = 0 # Bytes dropped since the last good frame.
+
+        # Statistics
+        self.framesDecoded = 0
+        self.framesLost = 0
+        self.crcErrors = 0
+        self.bytesDropped = 0
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def feed(self, data: bytes, seqs: list = None) -> list:
+        """
+        Appends new incoming data and decodes every complete frame found.
+
+        Args:
+            data (bytes): New incoming data.
+            seqs (list, optional): If given, the sequence number of each decoded frame is appended to it.
+
+        Returns:
+            list: Decoded frames, oldest first. Each frame is a tuple of 9 floats: (ax, ay, az, gx, gy, gz, mx, my, mz).
+        """
+        self._write(data)
+
+        frames = []
+        buf = self.buffer
+        msgLen = self.msgLen
+        while self.head < self.tail:
+            # Discard leading bytes that do not belong to any frame.
+            if buf[self.head] != self.startByte:
+                sPos = buf.find(self.startByte, self.head, self.tail)
+                if sPos < 0:
+                    sPos = self.tail
+                self.bytesDropped += sPos - self.head
+                self.skipped += sPos - self.head
+                self.head = sPos
+                continue
+
+            # We have seen the START_BYTE but the full frame hasn't arrived yet, wait for more data.
+            if self.tail - self.head < msgLen:
+                break
+
+            end = self.head + msgLen
+            if crc8(self.view[self.head:end - 1]) != buf[end - 1]:
+                # Either a corrupted frame or a START_BYTE value inside some other frame's payload. Skip it and look for the next one.
+                self.crcErrors += 1
+                self.bytesDropped += 1
+                self.skipped += 1
+                self.head += 1
+                continue
+
+            if self.skipped > 0 and self.framesDecoded > 0:
+                # Bytes dropped before the first frame are the tail of a frame sent before we listened, not a loss.
+                lost = max(1, round(self.skipped / msgLen))
+                self.seq += lost
+                self.framesLost += lost
+            self.skipped = 0
+            frames.append(self.PAYLOAD.unpack_from(buf, self.head + 1))
+            if seqs is not None:
+                seqs.append(self.seq)
+            self.seq += 1
+            self.framesDecoded += 1
+            self.head = end
+
+        if self.head == self.tail:
+            self.head = self.tail = 0
+
+        return frames
+
+    def getStats(self) -> dict:
+        """
+        Retrieves the decoding statistics.
+
+        Returns:
+            dict: Counts of decoded frames, frames counted as lost, CRC errors and bytes dropped while resynchronising.
+        """
+        return {
+            "framesDecoded": self.framesDecoded,
+            "framesLost": self.framesLost,
+            "crcErrors": self.crcErrors,
+            "bytesDropped": self.bytesDropped,
+        }
+
+    def _write(self, data: bytes):
+        n = len(data)
+        if self.tail + n > len(self.buffer):
+            pending = self.tail - self.head
+            if pending + n > len(self.buffer):
+                # Grow, the memoryview must be released before the bytearray can be resized.
+                self.view.release()
+                newBuffer = bytearray(max(2 * len(self.buffer), pending + n))
+                newBuffer[0:pending] = self.buffer[self.head:self.tail]
+                self.buffer = newBuffer
+                self.view = memoryview(self.buffer)
+            else:
+                # Compact, only the unprocessed bytes (less than one frame in steady state) are moved.
+                self.buffer[0:pending] = self.buffer[self.head:self.tail]
+            self.head = 0
+            self.tail = pending
+
+        self.buffer[self.tail:self.tail + n] = data
+        self.tail += n
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+
+import struct
+import numpy as np
+
+# Order of the 9 values of an IMU sample, as read from the sensors and sent in the BLE frames.
+IMU_FIELDS = ("ax", "ay", "az", "gx", "gy", "gz", "mx", "my", "mz")
+# Order of the same values in the recorded trials, columns 1 to 9 (column 0 is the time).
+CSV_FIELDS = ("gx", "gy", "gz", "ax", "ay", "az", "mx", "my", "mz")
+CSV_GT_COLUMN = 10
+
+# Block of samples of one IMU, 48 bytes per sample.
+IMU_DTYPE = np.dtype([(f, "<f4") for f in IMU_FIELDS] + [("timestamp", "<f8"), ("seq", "<u4")])
+
+# Block of samples of both feet, as used by the Predictor: angular velocity and acceleration of the left then the right foot,
+# ground truth (if available) and the trace timestamps (see common/tracing.py).
+GAIT_FIELDS = ("lwx", "lwy", "lwz", "lax", "lay", "laz", "rwx", "rwy", "rwz", "rax", "ray", "raz")
+GAIT_DTYPE = np.dtype([(f, "<f4") for f in GAIT_FIELDS] + [("gt", "<f4"), ("tAcq", "<f8"), ("tPub", "<f8"), ("seq", "<u4")])
+# Columns of the rows returned by gaitToRows().
+GAIT_ROW_FIELDS = GAIT_FIELDS + ("gt", "tAcq", "tPub", "seq")
+
+# Payload of a binary BLE frame (see FrameDecoder.py).
+FRAME_PAYLOAD = struct.Struct("<9f")
+
+class IMUValue():
+    """
+    Single IMU sample: accelerometer, gyroscope and magnetometer values, the time it was acquired and its sequence number.
+
+    __slots__ saves the per-instance __dict__, but every value is still a Python float object.
+    Blocks of samples (buffers, files, binary messages) are held as NumPy arrays of IMU_DTYPE instead, 48 bytes per sample, see toBlock().
+    """
+    __slots__ = IMU_FIELDS + ("timestamp", "seq")
+
+    def __init__(self, ax: float, ay: float, az: float, gx: float, gy: float, gz: float, mx: float, my: float, mz: float,
+            timestamp: float = 0.0, seq: int = 0):
+        self.ax = ax
+        self.ay = ay
+        self.az = az
+        self.gx = gx
+        self.gy = gy
+        self.gz = gz
+        self.mx = mx
+        self.my = my
+        self.mz = mz
+        self.timestamp = timestamp
+        self.seq = seq
+
+    @classmethod
+    def fromFrame(cls, values: tuple, timestamp: float = 0.0, seq: int = 0) -> "IMUValue":
+        """
+        Args:
+            values (tuple): 9 values in IMU_FIELDS order, e.g. as returned by FrameDecoder.feed().
+        """
+        return cls(*values, timestamp=timestamp, seq=seq)
+
+    @classmethod
+    def fromBytes(cls, data: bytes, offset: int = 0, timestamp: float = 0.0, seq: int = 0) -> "IMUValue":
+        """
+        Args:
+            data (bytes): Binary wire format, 9 little-endian floats in IMU_FIELDS order starting at 'offset'.
+        """
+        return cls(*FRAME_PAYLOAD.unpack_from(data, offset), timestamp=timestamp, seq=seq)
+
+    @classmethod
+    def fromCsvRow(cls, row: list, timestamp: float = 0.0, seq: int = 0) -> "IMUValue":
+        """
+        Args:
+            row (list): Row of a recorded trial: time, then the 9 values in CSV_FIELDS order, as strings or numbers.
+        """
+        gx, gy, gz, ax, ay, az, mx, my, mz = (float(v) for v in row[1:10])
+        return cls(ax, ay, az, gx, gy, gz, mx, my, mz, timestamp, seq)
+
+    def values(self) -> tuple:
+        """
+        Returns:
+            tuple: The 9 values in IMU_FIELDS order.
+        """
+        return (self.ax, self.ay, self.az, self.gx, self.gy, self.gz, self.mx, self.my, self.mz)
+
+    def __repr__(self):
+        return "IMUValue(%s, timestamp=%f, seq=%i)" % (", ".join("%s=%g" % (f, getattr(self, f)) for f in IMU_FIELDS), self.timestamp, self.seq)
+
+def toBlock(samples: list) -> np.ndarray:
+    """
+    Args:
+        samples (list): IMUValue objects.
+
+    Returns:
+        np.ndarray: Samples as an IMU_DTYPE array.
+    """
+    return np.array([s.values() + (s.timestamp, s.seq) for s in samples], dtype=IMU_DTYPE)
+
+def gaitRecord(left: IMUValue, right: IMUValue, gt: float, tAcq: float, tPub: float, seq: int = 0) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: GAIT_DTYPE array holding the one sample of both feet.
+    """
+    return np.array([(left.gx, left.gy, left.gz, left.ax, left.ay, left.az,
+                      right.gx, right.gy, right.gz, right.ax, right.ay, right.az,
+                      gt, tAcq, tPub, seq)], dtype=GAIT_DTYPE)
+
+def gaitToRows(block: np.ndarray) -> np.ndarray:
+    """
+    Args:
+        block (np.ndarray): GAIT_DTYPE array.
+
+    Returns:
+        np.ndarray: (n x 16) float array with the GAIT_ROW_FIELDS columns.
+    """
+    rows = np.empty((len(block), len(GAIT_ROW_FIELDS)))
+    for i, f in enumerate(GAIT_ROW_FIELDS):
+        rows[:, i] = block[f]
+    return rows
+
+def encodeBlock(block: np.ndarray) -> bytes:
+    """
+    Binary message format: the records of an IMU_DTYPE or GAIT_DTYPE array, back to back, little-endian.
+    """
+    return block.tobytes()
+
+def decodeBlock(data: bytes, dtype: np.dtype = IMU_DTYPE) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: Read-only array of 'dtype' records over 'data', without copying.
+    """
+    return np.frombuffer(data, dtype=dtype)
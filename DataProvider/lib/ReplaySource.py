@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+
+import time
+import numpy as np
+from DataProvider.lib.IMUValue import IMU_DTYPE, GAIT_DTYPE, CSV_FIELDS, CSV_GT_COLUMN
+
+# Field holding the acquisition time of a record, per record type.
+TIME_FIELD = {IMU_DTYPE: "timestamp", GAIT_DTYPE: "tAcq"}
+
+class ReplaySource():
+    """
+    Replays recorded samples from a .npy file of IMU_DTYPE or GAIT_DTYPE records (see convertTrial() / convertImu()).
+
+    The file is memory-mapped, so opening it only reads its header: replay starts at once and only the pages being
+    replayed are ever loaded, whatever the size of the dataset. Records are handed out in fixed-size blocks of raw records,
+    ready to be sent as binary messages or formatted as text, without any parsing.
+    """
+    def __init__(self, path):
+        """
+        Initialises ReplaySource
+
+        Args:
+            path (str or np.ndarray): .npy file of IMU_DTYPE or GAIT_DTYPE records, or the records themselves (e.g. from DatasetCache).
+        """
+        self.path = path if isinstance(path, str) else "<records>"
+        self.records = np.load(path, mmap_mode="r") if isinstance(path, str) else path
+        if self.records.dtype not in TIME_FIELD:
+            raise ValueError("%s does not hold IMU_DTYPE or GAIT_DTYPE records" % self.path)
+        self.timeField = TIME_FIELD[self.records.dtype]
+        self.position = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.records.dtype
+
+    def seekIndex(self, index: int):
+        """
+        Continues the replay from a sample index. Negative indices count from the end.
+        """
+        if index < 0:
+            index += len(self.records)
+        self.position = min(max(0, index), len(self.records))
+
+    def seekTime(self, t: float):
+        """
+        Continues the replay from the first sample recorded at or after 't' (same clock as the recording, e.g. seconds into the trial).
+        The recorded times are assumed to increase.
+        """
+        self.position = int(np.searchsorted(self.records[self.timeField], t, side="left"))
+
+    def read(self, n: int) -> np.ndarray:
+        """
+        Reads the next 'n' records (fewer at the end).
+
+        Returns:
+            np.ndarray: Read-only view into the mapped file. Empty at the end of the recording.
+        """
+        block = self.records[self.position:self.position + n]
+        self.position += len(block)
+        return block
+
+    def blocks(self, blockSize: int = 1, rate: float = None, restamp: bool = True):
+        """
+        Generator of the remaining records in blocks of 'blockSize', released at the sample rate.
+
+        Args:
+            blockSize (int, optional): Records per block. Defaults to 1.
+            rate (float, optional): Samples per second to replay at, from the first block on (absolute deadlines, so pacing errors do not add up).
+                                    None or 0 releases blocks as fast as they are consumed. Defaults to None.
+            restamp (bool, optional): Replace the acquisition time of the records with the time the block is released,
+                                      as if acquired live. Defaults to True.
+
+        Yields:
+            np.ndarray: Block of records. A writable copy if 'restamp' is set, otherwise a view into the mapped file.
+        """
+        start = time.time()
+        released = 0
+        while self.position < len(self.records):
+            if rate:
+                delay = start + released / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            block = self.read(blockSize)
+            released += len(block)
+            if restamp:
+                block = np.array(block)
+                block[self.timeField] = time.time()
+            yield block
+
+def loadTrialCsv(path: str) -> np.ndarray:
+    """
+    Loads a recorded trial (time, 9 values in CSV_FIELDS order, ground truth; quoted numbers, one header line).
+    """
+    return np.loadtxt(path, delimiter=",", skiprows=1, converters=lambda s: float(s.strip().strip('"')), ndmin=2)
+
+def convertTrial(leftPath: str, rightPath: str, outPath: str = None) -> np.ndarray:
+    """
+    Converts the left and right foot CSVs of a trial to GAIT_DTYPE records: tAcq is the time column, gt the ground truth of the right foot.
+
+    Args:
+        outPath (str, optional): Also save the records to this .npy file. Defaults to None.
+
+    Returns:
+        np.ndarray: GAIT_DTYPE records, as many as the shorter of the two files.
+    """
+    left = loadTrialCsv(leftPath)
+    right = loadTrialCsv(rightPath)
+    rows = min(len(left), len(right))
+    records = np.zeros(rows, dtype=GAIT_DTYPE)
+    for side, data in (("l", left), ("r", right)):
+        col = {f: data[:rows, 1 + i] for i, f in enumerate(CSV_FIELDS)}
+        for axis in "xyz":
+            records[side + "w" + axis] = col["g" + axis]
+            records[side + "a" + axis] = col["a" + axis]
+    records["gt"] = right[:rows, CSV_GT_COLUMN]
+    records["tAcq"] = right[:rows, 0]
+    records["tPub"] = right[:rows, 0]
+    records["seq"] = np.arange(rows)
+    if outPath is not None:
+        np.save(outPath, records)
+    return records
+
+def convertImu(path: str, outPath: str = None) -> np.ndarray:
+    """
+    Converts the CSV of a single IMU of a trial to IMU_DTYPE records, timestamped with the time column.
+
+    Args:
+        outPath (str, optional): Also save the records to this .npy file. Defaults to None.
+
+    Returns:
+        np.ndarray: IMU_DTYPE records.
+    """
+    data = loadTrialCsv(path)
+    records = np.zeros(len(data), dtype=IMU_DTYPE)
+    for i, f in enumerate(CSV_FIELDS):
+        records[f] = data[:, 1 + i]
+    records["timestamp"] = data[:, 0]
+    records["seq"] = np.arange(len(data))
+    if outPath is not None:
+        np.save(outPath, records)
+    return records
@@ -1,26 +1,43 @@
 #!/bin/usr/python3
-def crc8(data: bytes) -> int:
+def _crc8Byte(crc: int, byte: int) -> int:
     """
-    Calculates a 8-bits width CRC byte from given bytes.
+    Shifts a single byte into the running CRC, one bit at a time.
 
     Code is taken from: https://stackoverflow.com/questions/51731313/cross-platform-crc8-function-c-and-python-parity-check
     Credited to: "Triz"
 
     Args:
-        data (bytes): Bytes used to calculate the CRC byte.
+        crc (int): Running CRC value.
+        byte (int): Byte to shift in.
+
+    Returns:
+        int: Updated CRC value.
+    """
+    for b in range(8):
+        fb_bit = (crc ^ byte) & 0x01
+        if fb_bit == 0x01:
+            crc = crc ^ 0x18
+        crc = (crc >> 1) & 0x7f
+        if fb_bit == 0x01:
+            crc = crc | 0x80
+        byte = byte >> 1
+    return crc
+
+# The CRC register is only ever XOR-ed with the incoming byte, so the result for every (crc ^ byte) pair can be precomputed once.
+CRC8_TABLE = bytes(_crc8Byte(0, i) for i in range(256))
+
+def crc8(data: bytes) -> int:
+    """
+    Calculates a 8-bits width CRC byte from given bytes.
+
+    Args:
+        data (bytes): Bytes used to calculate the CRC byte. Any object supporting the buffer protocol (bytearray, memoryview) is accepted.
 
     Returns:
         int: Integer representing the byte value.
     """
     crc = 0
-    for i in range(len(data)):
-        byte = data[i]
-        for b in range(8):
-            fb_bit = (crc ^ byte) & 0x01
-            if fb_bit == 0x01:
-                crc = crc ^ 0x18
-            crc = (crc >> 1) & 0x7f
-            if fb_bit == 0x01:
-                crc = crc | 0x80
-            byte = byte >> 1
+    table = CRC8_TABLE
+    for byte in data:
+        crc = table[crc ^ byte]
     return crc
@@ -0,0 +1,331 @@
+#!/usr/bin/python3
+
+import logging
+import subprocess
+import sys
+import threading
+import time
+import wave
+import numpy as np
+from Metronome import Metronome, MIX_DTYPES, makeClick
+sys.path.append("..")
+from common.metrics import registry
+
+# aplay -f names of the WAV sample widths
+SAMPLE_FORMATS = {1: "U8", 2: "S16_LE", 3: "S24_3LE", 4: "S32_LE"}
+
+class AudioFormat():
+    def __init__(self, channels: int, sampleWidth: int, rate: int):
+        self.channels = channels
+        self.sampleWidth = sampleWidth
+        self.rate = rate
+        self.frameSize = channels * sampleWidth
+
+    def __eq__(self, other):
+        return (self.channels, self.sampleWidth, self.rate) == (other.channels, other.sampleWidth, other.rate)
+
+    def __repr__(self):
+        return "%d ch %s %d Hz" % (self.channels, SAMPLE_FORMATS[self.sampleWidth], self.rate)
+
+def loadWav(path: str) -> tuple:
+    """
+    Returns:
+        tuple: (AudioFormat, PCM data) of a WAV file, read into memory.
+    """
+    with wave.open(path, "rb") as w:
+        return AudioFormat(w.getnchannels(), w.getsampwidth(), w.getframerate()), w.readframes(w.getnframes())
+
+class NullSink():
+    """
+    Discards the audio, for running without audio hardware. Counts what it was given.
+    """
+    def open(self, fmt: AudioFormat):
+        self.bytesWritten = 0
+
+    def write(self, data: bytes):
+        self.bytesWritten += len(data)
+
+    def close(self):
+        pass
+
+class FileSink():
+    """
+    Writes the audio stream, silence included, to a WAV file, e.g. to check the timing of the cues without audio hardware.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def open(self, fmt: AudioFormat):
+        self.file = wave.open(self.path, "wb")
+        self.file.setnchannels(fmt.channels)
+        self.file.setsampwidth(fmt.sampleWidth)
+        self.file.setframerate(fmt.rate)
+
+    def write(self, data: bytes):
+        self.file.writeframesraw(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class AplaySink():
+    """
+    Plays the audio through one long-lived aplay process reading raw PCM from a pipe, so the device is opened once rather than per cue.
+    """
+    def __init__(self, device: str = None, bufferTime: float = 0.1):
+        """
+        Args:
+            device (str, optional): ALSA device, e.g. "bluealsa:DEV=<mac>". Defaults to the default device.
+            bufferTime (float, optional): ALSA buffer length (s), which bounds how long a stopped cue keeps playing. Defaults to 0.1.
+        """
+        self.device = device
+        self.bufferTime = bufferTime
+        self.process = None
+
+    def open(self, fmt: AudioFormat):
+        cmd = ["aplay", "-q", "-t", "raw", "-f", SAMPLE_FORMATS[fmt.sampleWidth], "-c", str(fmt.channels), "-r", str(fmt.rate),
+            "--buffer-time=%d" % int(self.bufferTime * 1e6)]
+        if self.device is not None:
+            cmd += ["-D", self.device]
+        self.process = subprocess.Popen(cmd + ["-"], stdin=subprocess.PIPE)
+
+    def write(self, data: bytes):
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+class CueEngine(threading.Thread):
+    """
+    Plays preloaded audio cues on a continuously running output stream.
+
+    The stream is fed one 'period' of audio at a time, paced by absolute deadlines and kept 'lead' periods ahead of the output,
+    silence when no cue is playing. So a cue starts, or is cut off, at most about lead periods after play() or stop(),
+    whatever the length of the cue, and nothing is opened, read or spawned per cue.
+    A metronome (startMetronome()) can be mixed over the cues, its ticks placed at exact frames of the stream.
+    All cues must have the same format, the format of the stream.
+    """
+    def __init__(self, sink, period: float = 0.02, lead: int = 2):
+        """
+        Initialises CueEngine
+
+        Args:
+            sink: AplaySink, NullSink or FileSink.
+            period (float, optional): Seconds of audio written at a time. Defaults to 0.02.
+            lead (int, optional): Periods written ahead of real time, against scheduling jitter. Defaults to 2.
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.shutdown = threading.Event()
+        self.log = logging.getLogger("Feedback." + self.__class__.__name__)
+        self.sink = sink
+        self.period = period
+        self.lead = lead
+        self.format = None
+        self.cues = {}
+        self.lock = threading.Lock()
+        # Cue being played: name, position (bytes), repeat interval (s, None to play once), start callback
+        self.current = None
+        self.position = 0
+        self.repeat = None
+        self.metronome = None
+        # Called with the time the next period is written, to time the actuation of play(), stop() and the metronome
+        self.callbacks = []
+        self.requested = None
+        self.newSink = None
+        # Frames written to the stream
+        self.frame = 0
+        self.onset = registry.histogram("feedback.cue_onset")
+        self.lateness = registry.histogram("feedback.audio_lateness")
+        self.cuesPlayed = registry.counter("feedback.cues_played")
+        self.ticksPlayed = registry.counter("feedback.metronome_ticks")
+        self.underruns = registry.counter("feedback.audio_underruns")
+
+    def load(self, name: str, path: str):
+        """
+        Reads a WAV file into memory as the cue 'name'.
+        """
+        fmt, data = loadWav(path)
+        if self.format is None:
+            self.format = fmt
+        elif fmt != self.format:
+            raise ValueError("%s is %s, the cues are %s" % (path, fmt, self.format))
+        self.cues[name] = data
+        self.log.info("Loaded cue '%s' from %s (%.2f s, %s)", name, path, len(data) / fmt.frameSize / fmt.rate, fmt)
+
+    def loadClick(self, name: str, frequency: float = 1500.0, duration: float = 0.03):
+        """
+        Synthesises a metronome tick as the cue 'name', in the format of the cues already loaded.
+        """
+        if self.format is None:
+            raise ValueError("No cue loaded, the click takes the format of the cues")
+        self.cues[name] = makeClick(self.format, frequency, duration)
+
+    def play(self, name: str, repeat: float = None, onStart=None):
+        """
+        Starts playing a cue, cutting off the one playing if any.
+
+        Args:
+            name (str): Cue loaded with load().
+            repeat (float, optional): Play the cue again after this many seconds of silence, until stop(). Defaults to None (once).
+            onStart (callable, optional): Called with the time the first period of the cue was written to the sink.
+        """
+        with self.lock:
+            self.current = name
+            self.position = 0
+            self.repeat = repeat
+            self.requested = time.time()
+            if onStart is not None:
+                self.callbacks.append(onStart)
+
+    def stop(self, onStop=None):
+        """
+        Cuts off the cue being played, if any, at the next period.
+
+        Args:
+            onStop (callable, optional): Called with the time the first period of silence was written to the sink.
+        """
+        with self.lock:
+            self.current = None
+            self.requested = None
+            if onStop is not None:
+                self.callbacks.append(onStop)
+
+    def startMetronome(self, name: str, tempo: float, onStart=None):
+        """
+        Starts ticking with the cue 'name', from the next period on, over any cue being played.
+
+        Args:
+            name (str): Tick, loaded with load() or loadClick().
+            tempo (float): Beats per minute.
+            onStart (callable, optional): Called with the time the first tick was written to the sink.
+        """
+        if self.format.sampleWidth not in MIX_DTYPES:
+            raise ValueError("Cannot mix %s audio" % self.format)
+        tick = np.frombuffer(self.cues[name], dtype=MIX_DTYPES[self.format.sampleWidth]).reshape(-1, self.format.channels)
+        with self.lock:
+            self.metronome = Metronome(tick, self.format.rate, tempo, self.frame)
+            self.requested = time.time()
+            if onStart is not None:
+                self.callbacks.append(onStart)
+
+    def setTempo(self, tempo: float):
+        with self.lock:
+            if self.metronome is not None:
+                self.metronome.setTempo(tempo)
+
+    def stopMetronome(self, onStop=None):
+        """
+        Stops ticking at the next period, cutting off the tick sounding if any.
+
+        Args:
+            onStop (callable, optional): Called with the time the first period without ticks was written to the sink.
+        """
+        with self.lock:
+            self.metronome = None
+            if onStop is not None:
+                self.callbacks.append(onStop)
+
+    def isPlaying(self) -> bool:
+        return self.current is not None
+
+    def setSink(self, sink):
+        """
+        Switches to another sink (e.g. another audio device) at the next period.
+        """
+        self.newSink = sink
+
+    def nextChunk(self, size: int) -> bytes:
+        with self.lock:
+            tStart = time.time()
+            # Onset of what play() or startMetronome() requested, not of repetitions or later ticks
+            if self.requested is not None:
+                self.onset.record(tStart - self.requested)
+                self.requested = None
+            callbacks, self.callbacks = self.callbacks, []
+            chunk = self.cueChunk(size)
+            if self.metronome is not None:
+                chunk = self.mixMetronome(chunk)
+            self.frame += size // self.format.frameSize
+        for callback in callbacks:
+            callback(tStart)
+        return chunk
+
+    def cueChunk(self, size: int) -> bytes:
+        # Next period of the cue being played, silence if none
+        if self.current is None:
+            return bytes(size)
+        data = self.cues[self.current]
+        if self.position == 0:
+            self.cuesPlayed.inc()
+        if self.position >= len(data):
+            # In the silence between repetitions
+            chunk = bytes(size)
+        else:
+            chunk = data[self.position:self.position + size]
+            chunk += bytes(size - len(chunk))
+        self.position += size
+        if self.position >= len(data):
+            if self.repeat is None:
+                self.current = None
+            elif self.position >= len(data) + int(self.repeat * self.format.rate) * self.format.frameSize:
+                self.position = 0
+        return chunk
+
+    def mixMetronome(self, chunk: bytes) -> bytes:
+        dtype = MIX_DTYPES[self.format.sampleWidth]
+        mixed = np.frombuffer(chunk, dtype=dtype).reshape(-1, self.format.channels).astype(np.int64)
+        self.ticksPlayed.inc(len(self.metronome.mix(mixed, self.frame)))
+        info = np.iinfo(dtype)
+        return np.clip(mixed, info.min, info.max).astype(dtype).tobytes()
+
+    def run(self):
+        if self.format is None:
+            self.log.error("No cue loaded")
+            return
+        size = int(self.period * self.format.rate) * self.format.frameSize
+        self.sink.open(self.format)
+        start = time.monotonic()
+        written = 0
+        while not self.shutdown.is_set():
+            if self.newSink is not None:
+                self.sink.close()
+                self.sink, self.newSink = self.newSink, None
+                self.sink.open(self.format)
+                start = time.monotonic()
+                written = 0
+            # Write once the output is less than 'lead' periods ahead
+            deadline = start + (written - self.lead) * self.period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            # How late the period is written, the output runs dry past 'lead' periods. The first 'lead' periods fill the output
+            # at once, their deadlines are before the start
+            if written >= self.lead:
+                self.lateness.record(time.monotonic() - deadline)
+            if delay < -self.period and written > self.lead:
+                # Fell behind, the output ran dry: restart the schedule rather than catching up in a burst
+                self.underruns.inc()
+                start = time.monotonic()
+                written = 0
+            try:
+                self.sink.write(self.nextChunk(size))
+            except (OSError, ValueError) as e:
+                self.log.warning("Audio output failed (%s), reopening it", e)
+                self.sink.close()
+                time.sleep(1)
+                self.sink.open(self.format)
+                start = time.monotonic()
+                written = 0
+                continue
+            written += 1
+        self.sink.close()
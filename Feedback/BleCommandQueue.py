@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+
+import queue
+import threading
+import time
+import sys
+sys.path.append("..")
+from common.metrics import registry
+
+# Characteristic properties, as the bits of bluepy's Characteristic.props
+PROP_WRITE_NO_RESP = 0b00000100
+PROP_WRITE = 0b00001000
+PROP_NOTIFY = 0b00010000
+
+# GATT handles of the mock wrist device, as cached by common/bleconnect.py for the real one
+MOCK_HANDLES = {"vib": 0x0e, "vibProps": PROP_WRITE | PROP_WRITE_NO_RESP, "button": 0x11, "cccd": 0x12}
+
+class BleCommand():
+    def __init__(self, key: str, value: bytes, queuedAt: float, onSent=None, keepAlive: bool = False):
+        self.key = key
+        self.value = value
+        self.queuedAt = queuedAt
+        self.onSent = onSent
+        self.keepAlive = keepAlive
+
+class BleCommandQueue():
+    """
+    Commands to a BLE peripheral, written by the thread that owns the connection (bluepy is not thread safe).
+
+    Each key (e.g. a characteristic) holds a state: put() sets the state wanted, take() returns the commands needed to reach it.
+    A state put while an older one is still waiting replaces it (coalesced), and a state the peripheral already has is not
+    written again (redundant), except as a keep-alive refresh every 'keepAlive' seconds.
+    The latency from put() to the write being acknowledged goes to the "<name>.command_latency" histogram.
+    """
+    def __init__(self, name: str, keepAlive: float = None):
+        """
+        Initialises BleCommandQueue
+
+        Args:
+            name (str): Prefix of the metrics, e.g. "wrist".
+            keepAlive (float, optional): Seconds after which the last state written is written again. Defaults to None (never).
+        """
+        self.lock = threading.Lock()
+        self.keepAlive = keepAlive
+        self.pending = {} # Key -> BleCommand waiting to be written
+        self.acked = {}   # Key -> (value, time) of the last write acknowledged
+        self.inflight = {} # Key -> value being written
+        self.stats = {"queued": 0, "coalesced": 0, "redundant": 0, "written": 0, "keepalives": 0, "failed": 0}
+        self.latency = registry.histogram(name + ".command_latency")
+        for stat in self.stats:
+            registry.gauge("%s.commands_%s" % (name, stat), lambda stat=stat: self.stats[stat])
+
+    def put(self, key: str, value: bytes, onSent=None):
+        """
+        Sets the state wanted for 'key'.
+
+        Args:
+            onSent (callable, optional): Called with the time the write was acknowledged, if it is written.
+        """
+        with self.lock:
+            self.stats["queued"] += 1
+            if key in self.pending:
+                self.stats["coalesced"] += 1
+                # The command waiting keeps its queue time and callback if it already sets this state
+                if self.pending[key].value == value:
+                    return
+                del self.pending[key]
+            # The state the peripheral has, or will have once the write in progress is acknowledged
+            current = self.inflight[key] if key in self.inflight else self.acked.get(key, (None,))[0]
+            if current == value:
+                self.stats["redundant"] += 1
+                return
+            self.pending[key] = BleCommand(key, value, time.time(), onSent)
+
+    def take(self) -> list:
+        """
+        Returns:
+            list: BleCommands to write now, the states waiting and the keep-alive refreshes due.
+        """
+        t = time.time()
+        with self.lock:
+            commands = list(self.pending.values())
+            self.pending.clear()
+            if self.keepAlive:
+                for key, (value, tAck) in self.acked.items():
+                    if t - tAck >= self.keepAlive and not any(c.key == key for c in commands):
+                        commands.append(BleCommand(key, value, t, keepAlive=True))
+            for c in commands:
+                self.inflight[c.key] = c.value
+            return commands
+
+    def sent(self, command: BleCommand, tAck: float):
+        """
+        Records that a command taken with take() was written and acknowledged at 'tAck'.
+        """
+        with self.lock:
+            self.inflight.pop(command.key, None)
+            self.acked[command.key] = (command.value, tAck)
+            self.stats["keepalives" if command.keepAlive else "written"] += 1
+        if not command.keepAlive:
+            self.latency.record(tAck - command.queuedAt)
+        if command.onSent is not None:
+            command.onSent(tAck)
+
+    def failed(self, command: BleCommand):
+        """
+        Puts back a command that could not be written, unless a newer state has been put since.
+        """
+        with self.lock:
+            self.inflight.pop(command.key, None)
+            self.stats["failed"] += 1
+            if not command.keepAlive and command.key not in self.pending:
+                self.pending[command.key] = command
+
+    def reset(self):
+        """
+        Forgets the states acknowledged, e.g. on reconnection as the peripheral has reset them, so the states wanted are written again.
+        """
+        with self.lock:
+            for key, (value, tAck) in self.acked.items():
+                if key not in self.pending:
+                    self.pending[key] = BleCommand(key, value, time.time())
+            self.acked.clear()
+            self.inflight.clear()
+
+    def getStats(self) -> dict:
+        with self.lock:
+            return dict(self.stats)
+
+class MockCharacteristic():
+    def __init__(self, peripheral, properties: int, ackDelay: float):
+        self.peripheral = peripheral
+        self.properties = properties
+        self.ackDelay = ackDelay
+        self.value = None
+        self.writes = [] # (time, value, withResponse)
+
+    def write(self, val: bytes, withResponse: bool = False):
+        self.peripheral.check()
+        if withResponse:
+            # Waits for the peripheral's write response, a couple of connection intervals
+            time.sleep(self.ackDelay)
+        self.value = val
+        self.writes.append((time.time(), val, withResponse))
+
+class MockPeripheral():
+    """
+    Stand-in for the bluepy Peripheral of the wrist device, for running without BLE hardware.
+    Tests can press the button with press() and break the connection with drop().
+    """
+    def __init__(self, writeNoResponse: bool = True, ackDelay: float = 0.03, disconnectError=ConnectionError):
+        """
+        Args:
+            writeNoResponse (bool, optional): Whether the vibration characteristic allows write without response. Defaults to True.
+            ackDelay (float, optional): Seconds a write with response takes to be acknowledged. Defaults to 0.03.
+            disconnectError (optional): Exception raised once the connection is dropped, e.g. bluepy's BTLEDisconnectError.
+        """
+        properties = PROP_WRITE | (PROP_WRITE_NO_RESP if writeNoResponse else 0)
+        self.vibChar = MockCharacteristic(self, properties, ackDelay)
+        self.disconnectError = disconnectError
+        self.delegate = None
+        self.presses = queue.Queue()
+        self.connected = True
+
+    def check(self):
+        if not self.connected:
+            raise self.disconnectError("Device disconnected")
+
+    def writeCharacteristic(self, handle: int, val: bytes, withResponse: bool = False):
+        if handle == MOCK_HANDLES["vib"]:
+            self.vibChar.write(val, withResponse)
+        else:
+            self.check()
+
+    def withDelegate(self, delegate):
+        self.delegate = delegate
+        return self
+
+    def press(self, presses: int):
+        self.presses.put(presses)
+
+    def drop(self):
+        self.connected = False
+
+    def waitForNotifications(self, timeout: float) -> bool:
+        self.check()
+        try:
+            presses = self.presses.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        if self.delegate is not None:
+            self.delegate.handleNotification(0, presses.to_bytes(4, "little", signed=True))
+        return True
+
+    def disconnect(self):
+        self.connected = False
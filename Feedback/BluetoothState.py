@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+
+import collections
+import logging
+import pexpect
+import queue
+import re
+import subprocess
+import threading
+import time
+
+# Colour codes and prompts bluetoothctl mixes into its output, e.g. "\x1b[0;93m[CHG]\x1b[0m" or "[JBL Go 3]# "
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]|\x01|\x02|\r")
+PROMPT = re.compile(r"^\[[^\]]*\]# ")
+# "[CHG] Device D8:37:3B:1C:74:AD Connected: yes", "[NEW] Device D8:37:3B:1C:74:AD JBL Go 3", "[DEL] Device ..."
+EVENT = re.compile(r"^\[(CHG|NEW|DEL)\] Device ([0-9A-F:]{17}) ?(.*)$")
+# Output of "info <mac>": "Device D8:37:3B:1C:74:AD (public)" then "\tName: JBL Go 3", "\tConnected: yes", ...
+INFO_HEADER = re.compile(r"^Device ([0-9A-F:]{17})")
+INFO_ATTRIBUTE = re.compile(r"^\s+(\w+): (.*)$")
+# Replies to a "connect" command that failed, which do not name the device: "Failed to connect: org.bluez.Error.Failed ...",
+# or a bare "org.bluez.Error.<...>" line. "Device D8:37:3B:1C:74:AD not available" does.
+CONNECT_FAILED = re.compile(r"^(?:Failed to connect: )?(org\.bluez\.Error\.\S+.*)$|^Failed to connect: (.*)$")
+NOT_AVAILABLE = re.compile(r"^Device ([0-9A-F:]{17}) not available")
+
+def parseLine(line: str, current: str = None) -> tuple:
+    """
+    Parses a line of bluetoothctl output.
+
+    Args:
+        line (str): Line, as read from bluetoothctl.
+        current (str, optional): Device of the "info" output being read, if any.
+
+    Returns:
+        tuple: (event, mac, attribute, value), or None if the line carries no device state. 'event' is "CHG", "NEW", "DEL", "INFO"
+               or "FAILED". For "NEW" and "DEL" the attribute is "Name". For "FAILED" (a connection attempt failed) the value is the
+               error, and the mac None unless the line names the device.
+    """
+    line = PROMPT.sub("", ANSI_ESCAPE.sub("", line)).rstrip("\n")
+    m = CONNECT_FAILED.match(line)
+    if m is not None:
+        return "FAILED", None, None, m.group(1) or m.group(2)
+    m = NOT_AVAILABLE.match(line)
+    if m is not None:
+        return "FAILED", m.group(1), None, "not available"
+    m = EVENT.match(line)
+    if m is not None:
+        event, mac, rest = m.groups()
+        if event == "CHG":
+            if ": " not in rest:
+                return None
+            attribute, value = rest.split(": ", 1)
+            return event, mac, attribute, value
+        return event, mac, "Name", rest
+    m = INFO_HEADER.match(line)
+    if m is not None:
+        return "INFO", m.group(1), None, None
+    m = INFO_ATTRIBUTE.match(line)
+    if m is not None and current is not None:
+        return "INFO", current, m.group(1), m.group(2)
+    return None
+
+class BluetoothctlSession():
+    """
+    Long-lived bluetoothctl process. BlueZ reports every change of a device's state on it as an asynchronous [CHG] line.
+    It runs on a pseudo-terminal, as in BluetoothctlWrapper.py: writing to a pipe, bluetoothctl would buffer those lines for as long
+    as its buffer is not full.
+    """
+    def __init__(self):
+        subprocess.call("rfkill unblock bluetooth", shell=True)
+        self.child = pexpect.spawn("bluetoothctl", echo=False, encoding="utf-8", timeout=None)
+
+    def send(self, command: str):
+        self.child.sendline(command)
+
+    def readline(self) -> str:
+        """
+        Returns:
+            str: Next line of output, empty once bluetoothctl has exited.
+        """
+        return self.child.readline()
+
+    def close(self):
+        self.child.terminate(force=True)
+
+class MockBluetoothctlSession():
+    """
+    Stand-in for BluetoothctlSession without Bluetooth hardware: known devices, and connections that succeed after 'connectDelay',
+    or fail then for the devices turned off. Tests can inject any bluetoothctl output with emit().
+    """
+    def __init__(self, devices: dict, connectDelay: float = 0.5, off: list = ()):
+        """
+        Args:
+            devices (dict): MAC -> name of the devices it knows, all disconnected.
+            off (list, optional): Devices whose connections fail.
+        """
+        self.devices = dict(devices)
+        self.connectDelay = connectDelay
+        self.off = set(off)
+        self.lines = queue.Queue()
+
+    def emit(self, line: str):
+        self.lines.put(line + "\n")
+
+    def send(self, command: str):
+        cmd, _, mac = command.partition(" ")
+        if cmd == "info" and mac in self.devices:
+            self.emit("Device %s (public)" % mac)
+            self.emit("\tName: %s" % self.devices[mac])
+            self.emit("\tConnected: no")
+        elif cmd == "connect" and mac in self.off:
+            threading.Timer(self.connectDelay, self.emit, ("Failed to connect: org.bluez.Error.Failed br-connection-page-timeout",)).start()
+        elif cmd in ("connect", "disconnect") and mac in self.devices:
+            state = "yes" if cmd == "connect" else "no"
+            threading.Timer(self.connectDelay, self.emit, ("\x1b[0;93m[CHG]\x1b[0m Device %s Connected: %s" % (mac, state),)).start()
+
+    def readline(self) -> str:
+        return self.lines.get()
+
+    def close(self):
+        self.lines.put("")
+
+class BluetoothState(threading.Thread):
+    """
+    Cached connection state of Bluetooth devices, kept up to date from the events of a single bluetoothctl session.
+
+    Reading the state (isConnected(), firstConnected(), getName()) only takes a lock, nothing is sent to bluetoothctl.
+    Listeners added with addListener() are called with (mac, connected) from this thread whenever a device connects or disconnects.
+    """
+    def __init__(self, macs: list, session=None):
+        """
+        Initialises BluetoothState
+
+        Args:
+            macs (list): Devices to report the state of from the start (others are added as their events come in).
+            session (optional): BluetoothctlSession (default) or MockBluetoothctlSession.
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.macs = list(macs)
+        self.session = session if session is not None else BluetoothctlSession()
+        self.log = logging.getLogger("Feedback." + self.__class__.__name__)
+        self.devices = {} # MAC -> {"name": str, "connected": bool}
+        self.changed = threading.Condition()
+        self.listeners = []
+        self.events = 0
+        # Devices with a "connect" command awaiting its reply, oldest first: bluetoothctl answers in order, its failure replies
+        # mostly do not name the device
+        self.pending = collections.deque()
+        self.failed = set()
+
+    def run(self):
+        for mac in self.macs:
+            self.session.send("info " + mac)
+        current = None
+        while True:
+            line = self.session.readline()
+            if line == "":
+                self.log.warning("bluetoothctl exited")
+                break
+            parsed = parseLine(line, current)
+            if parsed is None:
+                # Any other line ends the "info" output
+                current = None
+                continue
+            event, mac, attribute, value = parsed
+            if event == "FAILED":
+                self.connectFailed(mac, value)
+                continue
+            if event == "INFO":
+                current = mac
+                if attribute is None:
+                    continue
+            self.update(event, mac, attribute, value)
+
+    def update(self, event: str, mac: str, attribute: str, value: str):
+        changedTo = None
+        with self.changed:
+            if event == "DEL":
+                self.devices.pop(mac, None)
+            else:
+                device = self.devices.setdefault(mac, {"name": None, "connected": False})
+                if attribute in ("Name", "Alias") and value:
+                    device["name"] = value
+                elif attribute == "Connected":
+                    connected = value == "yes"
+                    if connected != device["connected"]:
+                        device["connected"] = connected
+                        changedTo = connected
+            self.events += 1
+            self.changed.notify_all()
+        if changedTo is not None:
+            self.log.info("%s (%s) %s", mac, self.getName(mac), "connected" if changedTo else "disconnected")
+            for listener in self.listeners:
+                listener(mac, changedTo)
+
+    def connectFailed(self, mac: str, error: str):
+        with self.changed:
+            if mac is None:
+                if len(self.pending) == 0:
+                    return
+                mac = self.pending[0]
+            if mac in self.pending:
+                self.pending.remove(mac)
+            self.failed.add(mac)
+            self.changed.notify_all()
+        self.log.info("Connecting to %s failed: %s", mac, error)
+
+    def addListener(self, listener):
+        """
+        Args:
+            listener (callable): Called with (mac, connected) on every connection change.
+        """
+        self.listeners.append(listener)
+
+    def isConnected(self, mac: str) -> bool:
+        with self.changed:
+            return mac in self.devices and self.devices[mac]["connected"]
+
+    def firstConnected(self, macs: list) -> str:
+        """
+        Returns:
+            str: First of 'macs' that is connected, None if none is.
+        """
+        with self.changed:
+            for mac in macs:
+                if mac in self.devices and self.devices[mac]["connected"]:
+                    return mac
+        return None
+
+    def getName(self, mac: str) -> str:
+        with self.changed:
+            return self.devices[mac]["name"] if mac in self.devices else None
+
+    def connect(self, mac: str, timeout: float = 10.0) -> bool:
+        """
+        Asks bluetoothctl to connect to a device and waits for the connection, or the failure, to be reported.
+
+        Returns:
+            bool: True if the device is connected within 'timeout' seconds, False as soon as bluetoothctl reports a failure.
+        """
+        if self.isConnected(mac):
+            return True
+        deadline = time.monotonic() + timeout
+        with self.changed:
+            self.failed.discard(mac)
+            self.pending.append(mac)
+            self.session.send("connect " + mac)
+            try:
+                while not (mac in self.devices and self.devices[mac]["connected"]):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or mac in self.failed:
+                        return False
+                    self.changed.wait(remaining)
+            finally:
+                if mac in self.pending:
+                    self.pending.remove(mac)
+                self.failed.discard(mac)
+        return True
+
+    def close(self):
+        self.session.close()
@@ -6,16 +6,22 @@ import threading
 import time
 import sys
 import os
-import builtins
-from BluetoothctlWrapper import Bluetoothctl
+import logging
+from BluetoothState import BluetoothState, MockBluetoothctlSession
+from AudioCue import CueEngine, AplaySink, NullSink, FileSink
+from FogState import FogState
+from Metronome import TempoTracker
 sys.path.append("..")
 import config
+from common.log import setupLogging
+from common.tracing import now, parsePredictTrace, LatencyCollector
+from common.metrics import registry, startMetrics
+from common.profiler import installProfiler
+from common.heartbeat import startHeartbeat, setReady, beat, idle
 
 # Constants
 POLL_TIMEOUT = 100 # milliseconds
-
-# State flag to indicate if FoG is occuring.
-isFog = False
+STATE_WAIT_TIMEOUT = 0.5 # seconds, between checks of the audio connection while the FoG state does not change
 
 class ReadStateTh(threading.Thread):
     """
@@ -25,16 +31,20 @@ class ReadStateTh(threading.Thread):
         threading (Thread): threading.Thread object.
     """
 
-    def __init__(self, subAddr: str, topic: str):
+    def __init__(self, subAddr: str, topic: str, fogState: FogState, tempo: TempoTracker):
         """
         Initialization.
 
         Args:
             subAddr (str): Socket address for subscription.
             topic (str): Topic to subscribe to.
+            fogState (FogState): State updated with the predictions.
+            tempo (TempoTracker): Metronome tempo, updated with the walking cadence (CADENCE_TOPIC).
         """
 
         threading.Thread.__init__(self)
+        self.fogState = fogState
+        self.tempo = tempo
 
         self.shutdown = threading.Event()
 
@@ -45,21 +55,24 @@ class ReadStateTh(threading.Thread):
 
         # Set socket options to subscribe to IMU topic
         self.sub.setsockopt_string(zmq.SUBSCRIBE, topic)
+        self.sub.setsockopt_string(zmq.SUBSCRIBE, config.CADENCE_TOPIC)
+        self.msgsIn = registry.counter("msgs_in." + topic)
 
     def run(self):
-        global isFog
-
         while not self.shutdown.isSet():
+            beat("read_state")
             sockEvents = self.sub.poll(POLL_TIMEOUT, zmq.POLLIN)
 
             if (sockEvents & zmq.POLLIN) > 0:
                 string = self.sub.recv_string()
-                t, state = string.split()
-                state = float(state)
-                if state == 0.0:
-                    isFog = False
-                else:
-                    isFog = True
+                t, state, *fields = string.split()
+                if t == config.CADENCE_TOPIC:
+                    self.tempo.update(float(state))
+                    continue
+                self.msgsIn.inc()
+                isFog = float(state) != 0.0
+                # The trace is only parsed for the prediction that starts a FoG state
+                self.fogState.update(isFog, parsePredictTrace(fields) if isFog and not self.fogState.isFog else None)
 
         # Clean up
         context = zmq.Context.instance()
@@ -74,83 +87,144 @@ class PlayAudioTh(threading.Thread):
     """
     LED_PIN = 23 # Broadcom pin 23 is pin 16 on RPi pinout
 
-    def __init__(self):
+    def __init__(self, btState: BluetoothState, fogState: FogState, tempo: TempoTracker):
         threading.Thread.__init__(self)
         self.shutdown = threading.Event()
-        self.bctl = Bluetoothctl()
-        self.printPrefix = "[" + self.__class__.__name__ + "]:\t"
+        self.fogState = fogState
+        self.tempo = tempo
+        registry.gauge("feedback.metronome_tempo", lambda: self.tempo.tempo)
+        self.btState = btState
+        self.btState.addListener(self.onConnectionChange)
+        self.log = logging.getLogger("Feedback." + self.__class__.__name__)
         self.connectedAudioMac = None
         self.connectedAudioName = None
+        self.latency = LatencyCollector("Feedback")
+        # From a transition of the predicted state to the cue starting, or being cut off, on the output
+        self.cueOnLatency = registry.histogram("feedback.actuation.fog_on")
+        self.cueOffLatency = registry.histogram("feedback.actuation.fog_off")
+        # Audio cues, played on a persistent output stream, silent until an audio device is connected
+        self.cues = CueEngine(NullSink() if config.AUDIO_SINK == "aplay" else self.makeSink(), config.AUDIO_PERIOD, config.AUDIO_LEAD)
         # GPIO.setmode(GPIO.BCM)
         # GPIO.setup(self.LED_PIN, GPIO.OUT) 
         # GPIO.output(self.LED_PIN, GPIO.LOW)
 
     def run(self):
-        global isFog
-        currIsFog = False
-        prevIsFog = False
+        version = 0
+        isCueing = False
         stopSoundPath = os.getcwd() + "/" + config.SOUNDS_FOLDER + config.STOP_SOUND_PATH
+        self.cues.load("stop", stopSoundPath)
+        if config.METRONOME_SOUND_PATH is None:
+            self.cues.loadClick("tick")
+        else:
+            self.cues.load("tick", os.getcwd() + "/" + config.SOUNDS_FOLDER + config.METRONOME_SOUND_PATH)
+        self.cues.start()
         
-        stopCmd = ""
         if self.isAudioConnected():
             self.print("Audio device %s (%s) is connected" % (self.connectedAudioMac, self.connectedAudioName))
-            stopCmd = "aplay -D bluealsa:DEV=" + self.connectedAudioMac + " " + stopSoundPath # Play on connected audio
+            self.useAudioDevice() # Play on connected audio
 
         while not self.shutdown.isSet():
+            beat("audio")
             try:
                 # Check if the headphone is connected, if not attempt to connect until it can connected.
                 if not self.isAudioConnected():
                     self.print("Audio is disconnected")
+                    registry.counter("bt.audio_reconnects").inc()
+                    # Connection attempts take up to BT_CONNECT_TIMEOUT per device
+                    idle("audio")
                     if self.connectAudio():
-                        stopCmd = "aplay -D bluealsa:DEV=" + self.connectedAudioMac + " " + stopSoundPath # Play on connected audio
+                        self.useAudioDevice() # Play on connected audio
+                    beat("audio")
                     
-                currIsFog = isFog
+                # Woken as soon as the predicted state changes
+                version, isFog, trace, changedAt = self.fogState.wait(version, STATE_WAIT_TIMEOUT)
                 #if isFog and not GPIO.input(self.LED_PIN):
-                if currIsFog and not prevIsFog:
+                if isFog and not isCueing:
                     self.print("On")
-                    
-                if currIsFog:
-                    # Turn LED for 1 second and turn off again.
+                    # Repeat the cue and/or tick at the recent walking cadence while FoG lasts, the latencies are recorded when the cues actually start
                     #GPIO.output(self.LED_PIN, GPIO.HIGH)
-                    os.system(stopCmd)
-                    time.sleep(1)
+                    onStart = lambda t, trace=trace, changedAt=changedAt: self.onCueStart(trace, changedAt, t)
+                    if "stop" in config.FOG_CUES:
+                        self.cues.play("stop", config.CUE_REPEAT_INTERVAL, onStart)
+                        onStart = None
+                    if "metronome" in config.FOG_CUES:
+                        self.print("Metronome at %.1f beats per minute" % self.tempo.tempo)
+                        self.cues.startMetronome("tick", self.tempo.tempo, onStart)
+                    isCueing = True
                 
                 #if not isFog and GPIO.input(self.LED_PIN):
-                if not currIsFog and prevIsFog:
+                if not isFog and isCueing:
                     # GPIO.output(self.LED_PIN, GPIO.LOW)
+                    # Preempts the cues, even in the middle of playing them
+                    self.cues.stopMetronome()
+                    self.cues.stop(lambda t, changedAt=changedAt: self.cueOffLatency.record(t - changedAt))
+                    isCueing = False
                     self.print("Off")
-                
-                prevIsFog = currIsFog
-                time.sleep(0.1)
             except KeyboardInterrupt:
                 break
 
+        self.cues.shutdown.set()
+        self.cues.join()
+
+    def onCueStart(self, trace: tuple, changedAt: float, tStart: float):
+        self.cueOnLatency.record(tStart - changedAt)
+        if trace is not None:
+            self.latency.record(trace, tStart)
+
+    def makeSink(self):
+        if config.AUDIO_SINK == "aplay":
+            return AplaySink("bluealsa:DEV=" + self.connectedAudioMac, config.AUDIO_BUFFER_TIME)
+        if config.AUDIO_SINK == "null":
+            return NullSink()
+        return FileSink(config.AUDIO_SINK)
+
+    def useAudioDevice(self):
+        if config.AUDIO_SINK == "aplay":
+            self.cues.setSink(self.makeSink())
+
     def connectAudio(self) -> bool:
         for dev in config.AUDIO_MACS:
-            if self.bctl.connect(dev):
+            if self.btState.connect(dev, config.BT_CONNECT_TIMEOUT):
                 self.connectedAudioMac = dev
-                self.connectedAudioName = self.bctl.getDeviceName(dev)
+                self.connectedAudioName = self.btState.getName(dev)
                 self.print("Connected to %s (%s)" % (dev, self.connectedAudioName))
                 return True
         return False
 
     def isAudioConnected(self) -> bool:
-        for dev in config.AUDIO_MACS:
-            if self.bctl.isConnected(dev):
-                self.connectedAudioMac = dev
-                self.connectedAudioName = self.bctl.getDeviceName(dev)
-                return True
-        return False
+        # Answered from the cached state, nothing is sent to bluetoothctl
+        dev = self.btState.firstConnected(config.AUDIO_MACS)
+        if dev is None:
+            return False
+        self.connectedAudioMac = dev
+        self.connectedAudioName = self.btState.getName(dev)
+        return True
+
+    def onConnectionChange(self, mac: str, connected: bool):
+        registry.counter("bt.connection_changes").inc()
 
-    def print(self, *objs, **kwargs):
-        builtins.print(self.printPrefix, *objs, **kwargs)
+    def print(self, *objs):
+        self.log.info(" ".join(str(o) for o in objs))
 
 if __name__ == "__main__":
+    setupLogging("Feedback")
+    startMetrics("Feedback")
+    installProfiler("Feedback")
+    startHeartbeat("Feedback")
     try:
-        readState = ReadStateTh(config.PREDICT_SOCK, config.PREDICT_TOPIC)
-        audio = PlayAudioTh()
+        fogState = FogState()
+        tempo = TempoTracker(config.METRONOME_TEMPO, config.METRONOME_TEMPO_SCALE, config.METRONOME_MIN_TEMPO, config.METRONOME_MAX_TEMPO,
+            config.METRONOME_ADAPT)
+        readState = ReadStateTh(config.PREDICT_SOCK, config.PREDICT_TOPIC, fogState, tempo)
+        session = None
+        if config.BT_USE_MOCK:
+            session = MockBluetoothctlSession({mac: "Mock audio %d" % i for i, mac in enumerate(config.AUDIO_MACS)})
+        btState = BluetoothState(config.AUDIO_MACS, session)
+        btState.start()
+        audio = PlayAudioTh(btState, fogState, tempo)
         readState.start()
         audio.start()
+        setReady()
 
         # Let's keep the main thread running to catch ctrl-c terminations.
         while threading.activeCount() > 0:
@@ -159,6 +233,8 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         readState.shutdown.set()
         audio.shutdown.set()
+        fogState.close()
         readState.join()
         audio.join()
+        btState.close()
         
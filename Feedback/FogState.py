@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+
+import threading
+import sys
+sys.path.append("..")
+from common.tracing import now
+from common.metrics import registry
+
+class FogState():
+    """
+    Predicted FoG state, shared by the thread reading the predictions and the actuators.
+
+    Every transition (Walk -> FoG or FoG -> Walk) bumps a version number and wakes the actuators waiting in wait() at once,
+    so they act on it without polling. Repeated predictions of the same state are not transitions and wake nobody.
+    """
+    def __init__(self):
+        self.changed = threading.Condition()
+        self.isFog = False
+        self.version = 0
+        self.closed = False
+        # Trace of the prediction that started the current FoG state, None in Walk
+        self.trace = None
+        # Time of the last transition
+        self.changedAt = None
+        self.transitions = registry.counter("feedback.fog_transitions")
+
+    def update(self, isFog: bool, trace: tuple = None) -> bool:
+        """
+        Sets the predicted state.
+
+        Args:
+            isFog (bool): Whether the prediction is FoG.
+            trace (tuple, optional): Trace of the prediction, parsed with parsePredictTrace().
+
+        Returns:
+            bool: True if the state changed.
+        """
+        with self.changed:
+            if isFog == self.isFog:
+                return False
+            self.isFog = isFog
+            self.trace = trace if isFog else None
+            self.changedAt = now()
+            self.version += 1
+            self.changed.notify_all()
+        self.transitions.inc()
+        return True
+
+    def wait(self, version: int, timeout: float = None) -> tuple:
+        """
+        Waits for a transition after 'version'.
+
+        Args:
+            version (int): Version the caller has acted on, as returned by the previous call (0 at first).
+            timeout (float, optional): Seconds to wait at most. Defaults to None (until a transition or close()).
+
+        Returns:
+            tuple: (version, isFog, trace, changedAt) of the current state. The version is unchanged on timeout or close().
+        """
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version or self.closed, timeout)
+            return self.version, self.isFog, self.trace, self.changedAt
+
+    def close(self):
+        """
+        Wakes the threads waiting in wait(), e.g. to let them see they are being shut down.
+        """
+        with self.changed:
+            self.closed = True
+            self.changed.notify_all()
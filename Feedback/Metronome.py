@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+
+import threading
+import numpy as np
+
+# numpy types of the WAV sample widths that can be mixed
+MIX_DTYPES = {2: np.dtype("<i2"), 4: np.dtype("<i4")}
+
+def makeClick(fmt, frequency: float = 1500.0, duration: float = 0.03, amplitude: float = 0.5) -> bytes:
+    """
+    Synthesises a metronome tick: a short tone with an exponential decay.
+
+    Args:
+        fmt (AudioFormat): Format of the tick, the format of the stream it is mixed into.
+        frequency (float, optional): Pitch of the tone (Hz). Defaults to 1500.0.
+        duration (float, optional): Length of the tick (s). Defaults to 0.03.
+        amplitude (float, optional): Peak level, as a share of full scale. Defaults to 0.5.
+
+    Returns:
+        bytes: PCM data of the tick.
+    """
+    dtype = MIX_DTYPES[fmt.sampleWidth]
+    t = np.arange(int(duration * fmt.rate)) / fmt.rate
+    tone = np.sin(2 * np.pi * frequency * t) * np.exp(-5 * t / duration) * amplitude * np.iinfo(dtype).max
+    return np.repeat(tone.astype(dtype)[:, None], fmt.channels, axis=1).tobytes()
+
+class Metronome():
+    """
+    Ticks at a tempo, mixed into an audio stream at exact frame positions.
+
+    The position of each tick is the position of the previous one plus the beat interval, kept in fractional frames,
+    so the ticks are played at the tempo of the audio clock whenever the stream is written, and do not drift.
+    """
+    def __init__(self, tick: np.ndarray, rate: int, tempo: float, startFrame: int):
+        """
+        Initialises Metronome
+
+        Args:
+            tick (np.ndarray): Samples of a tick, frames x channels.
+            rate (int): Frame rate of the stream.
+            tempo (float): Beats per minute.
+            startFrame (int): Stream frame of the first tick.
+        """
+        self.tick = tick
+        self.rate = rate
+        self.tempo = tempo
+        self.nextTick = float(startFrame)
+        # Start frames of the ticks still sounding
+        self.sounding = []
+        self.ticks = 0
+
+    def setTempo(self, tempo: float):
+        """
+        Changes the tempo from the next tick on, the tick already due is kept where it is.
+        """
+        self.tempo = tempo
+
+    def mix(self, buffer: np.ndarray, frame: int) -> list:
+        """
+        Adds the ticks falling in a chunk of the stream.
+
+        Args:
+            buffer (np.ndarray): Chunk of the stream, frames x channels, of a type wide enough not to overflow.
+            frame (int): Stream frame of the start of the chunk.
+
+        Returns:
+            list: Stream frames of the ticks starting in the chunk.
+        """
+        end = frame + len(buffer)
+        started = []
+        while round(self.nextTick) < end:
+            start = int(round(self.nextTick))
+            self.sounding.append(start)
+            started.append(start)
+            self.nextTick += 60.0 * self.rate / self.tempo
+            self.ticks += 1
+        for start in list(self.sounding):
+            a, b = max(start, frame), min(start + len(self.tick), end)
+            if a < b:
+                buffer[a - frame:b - frame] += self.tick[a - start:b - start]
+            if start + len(self.tick) <= end:
+                self.sounding.remove(start)
+        return started
+
+class TempoTracker():
+    """
+    Tempo of the metronome, following the walking cadence estimated by the Predictor.
+
+    The cadence is averaged over the recent estimates, and the tempo is a share of it within bounds, or the default tempo
+    until a cadence has been received.
+    """
+    def __init__(self, tempo: float, scale: float = 1.0, minTempo: float = 60.0, maxTempo: float = 150.0, adapt: float = 0.1):
+        """
+        Initialises TempoTracker
+
+        Args:
+            tempo (float): Default tempo (beats per minute).
+            scale (float, optional): Tempo as a share of the cadence. Defaults to 1.0.
+            minTempo (float, optional): Lower bound of the tempo. Defaults to 60.0.
+            maxTempo (float, optional): Upper bound of the tempo. Defaults to 150.0.
+            adapt (float, optional): Weight of each estimate in the averaged cadence. Defaults to 0.1.
+        """
+        self.lock = threading.Lock()
+        self.default = tempo
+        self.scale = scale
+        self.minTempo = minTempo
+        self.maxTempo = maxTempo
+        self.adapt = adapt
+        self.cadence = None
+
+    def update(self, cadence: float):
+        """
+        Args:
+            cadence (float): Cadence estimate (steps per minute).
+        """
+        with self.lock:
+            if self.cadence is None:
+                self.cadence = cadence
+            else:
+                self.cadence += self.adapt * (cadence - self.cadence)
+
+    @property
+    def tempo(self) -> float:
+        with self.lock:
+            if self.cadence is None:
+                return self.default
+            return min(self.maxTempo, max(self.minTempo, self.scale * self.cadence))
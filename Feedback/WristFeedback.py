@@ -3,12 +3,20 @@ import zmq
 from bluepy.btle import *
 from queue import Queue, Empty
 import threading
-import builtins
+import logging
 import traceback
 import sys
 sys.path.append("..")
 import config
 from DataProvider.lib.crc8 import crc8
+from common.log import setupLogging
+from common.tracing import now, parsePredictTrace, LatencyCollector
+from common.metrics import registry, startMetrics
+from common.profiler import installProfiler
+from common.heartbeat import startHeartbeat, setReady, beat
+from common.bleconnect import BleConnector, PeripheralCache
+from common.bleclient import BleClient
+from BleCommandQueue import BleCommandQueue, MockPeripheral, MOCK_HANDLES, PROP_WRITE_NO_RESP
 
 # Constants
 POLL_TIMEOUT = 100 # milliseconds
@@ -25,11 +33,15 @@ SCAN_TIMEOUT = 3 # seconds
 SCAN_INTERVAL = 3 # seconds
 
 # BLE specfifications default values
-ADT_COMPLETE_NAME = 0x09
 UUID_CCCD = "00002902"
 NOTIF_ON = b"\x01\x00" # Also turns off indication
 NOTIF_OFF = b"\x00\x00" # Also turns off indication
 
+# Vibration commands
+VIB_KEY = "vib"
+VIB_ON = b"1"
+VIB_OFF = b"2"
+
 # Message values
 START_BYTE = b"\xff"
 MSG_LEN = 38
@@ -109,111 +121,111 @@ class WristDeviceThread(threading.Thread):
         self.fogOff = threading.Event()
         self.fogOff.clear()
         self.connectedEvent = connectedEvent
-        self.printPrefix = "[" + self.__class__.__name__ + "]:\t"
-        self.vibChar = None
+        self.log = logging.getLogger("WristFeedback." + self.__class__.__name__)
+        self.vibHandle = None
+        self.withResponse = True
         self.device = None
-        self.lastTime = time.time()
+        self.connector = BleConnector("wrist", DEVICE_NAME, PeripheralCache(config.BLE_CACHE_PATH), SCAN_TIMEOUT)
+        self.latency = LatencyCollector("WristFeedback")
+        # Vibration commands, written as soon as the state changes rather than on a fixed cycle
+        self.commands = BleCommandQueue("wrist", config.WRIST_KEEPALIVE_INTERVAL)
 
     def run(self):
         deviceFound = False
+        disconnectedAt = None
         while not self.shutdown.isSet():
-            time.sleep(0.1) # 10 Hz loop
             try:
                 if deviceFound:
-                    self.device.waitForNotifications(0.1)
-                    currTime = time.time()    
-                    if currTime - self.lastTime > 1.0:
-                        self.lastTime = currTime
-                        if self.fogOn.isSet():
-                                self.print("Activate vibration")
-                                self.vibChar.write(bytes("1", encoding="utf-8"))
-                        else:
-                            self.print("Deactivate vibration")
-                            self.vibChar.write(bytes("2", encoding="utf-8"))
+                    for command in self.commands.take():
+                        self.writeCommand(command)
+                    # Bounds how long a queued command waits, bluepy cannot be woken up from waiting for notifications
+                    self.device.waitForNotifications(config.WRIST_POLL_INTERVAL)
                 else:
                     if self.setupDevice(DEVICE_NAME):
                         self.print("Device setup success.")
                         deviceFound = True
+                        if disconnectedAt is not None:
+                            registry.histogram("wrist.reconnect_time").record(time.monotonic() - disconnectedAt)
+                            disconnectedAt = None
+                        # The device forgets the vibration state on disconnection
+                        self.commands.reset()
                     else:
                        self.print("Cannot set up device. Trying again in %d seconds." % SCAN_INTERVAL)
                        time.sleep(SCAN_INTERVAL)
                        continue
             except BTLEDisconnectError:
                 self.print("Device disconnected.")
+                registry.counter("ble.reconnects").inc()
+                if deviceFound:
+                    disconnectedAt = time.monotonic()
                 deviceFound = False
+            except BTLEException as e:
+                self.print("Cannot set up device (%s). Trying again in %d seconds." % (e, SCAN_INTERVAL))
+                time.sleep(SCAN_INTERVAL)
             except KeyboardInterrupt:
                 break
 
         # Cleanup
+        self.print("Command stats: %s" % self.commands.getStats())
         if self.device is not None:
             self.device.disconnect()
 
+    def writeCommand(self, command):
+        try:
+            self.device.writeCharacteristic(self.vibHandle, command.value, withResponse=self.withResponse)
+        except BTLEDisconnectError:
+            self.commands.failed(command)
+            raise
+        # Returns once the write is acknowledged, or sent if without response
+        self.commands.sent(command, now())
+        registry.counter("wrist.vib_writes").inc()
+        if not command.keepAlive:
+            self.print("Activate vibration" if command.value == VIB_ON else "Deactivate vibration")
+
     def setupDevice(self, deviceName: str) -> bool:
-        scanEntry = self.scanDevice(deviceName)
-        if scanEntry is None:
-            return False
+        if config.WRIST_USE_MOCK:
+            self.device = MockPeripheral(disconnectError=BTLEDisconnectError)
+            handles = MOCK_HANDLES
+            self.subButtonPress(self.device, handles)
         else:
-            self.device = Peripheral(scanEntry.addr, scanEntry.addrType)
-            # Check that vibration service exists.
-            if not self.checkVibSvc(self.device, VIB_SVC_UUID):
-                return False
-            # Check that vibration charactertistics exists.
-            if not self.findVibChar(self.device, VIB_CHAR_UUID):
+            # Straight to the last known address and handles, scanning for the device only if that fails
+            self.device, handles = self.connector.connect(self.discoverHandles, self.subButtonPress)
+            if self.device is None:
                 return False
-            # Subscrbibe to button press notifications if the characteristics exists.
-            notifHandler = NotificationHandler()
-            if not self.subButtonPress(self.device, BTN_CHAR_UUID, self.notifHandler):
-                return False
-            self.connectedEvent.set()
-            return True
-
-    def scanDevice(self, targetName: str) -> ScanEntry:
-        self.print("Scanning for", targetName)
-        scanner = Scanner()
-        scanner.scan(SCAN_TIMEOUT)
-        for d in scanner.getDevices():
-            if d.getValueText(ADT_COMPLETE_NAME) == targetName:
-                self.print("Found", targetName)
-                self.print("Address:", d.addr)
-                return d
-        self.print(SEPARATOR)
-        return None
-    
-    def checkVibSvc(self, device: Peripheral, svcUuid: str) -> bool:
+        self.vibHandle = handles["vib"]
+        self.setWriteMode(handles["vibProps"])
+        self.connectedEvent.set()
+        return True
+
+    def discoverHandles(self, device: Peripheral) -> dict:
         # First check that the vibration service exists
         self.print("Finding wrist vibration service with UUID:", VIB_SVC_UUID)
         try:
-            svc = device.getServiceByUUID(svcUuid)
+            svc = device.getServiceByUUID(VIB_SVC_UUID)
         except BTLEException:
             self.print("Wrist vibration service can't be found.")
-            return False
+            raise
         self.print("Found wrist vibration service!")
         self.print(SEPARATOR)
-        return True
 
-    def findVibChar(self, device: Peripheral, vibCharUuid) -> bool:
         # Check that the charactertistic we are interested in exists.
-        self.print("Finding vibration characteristic with UUID:", vibCharUuid)
-        chars = device.getCharacteristics(uuid=vibCharUuid)
+        self.print("Finding vibration characteristic with UUID:", VIB_CHAR_UUID)
+        chars = device.getCharacteristics(uuid=VIB_CHAR_UUID)
         if len(chars) == 0:
-            self.print("Vibration characteristic can't be found. Exiting.")
-            return False
-        self.vibChar = chars[0]
+            raise BTLEException("Vibration characteristic can't be found")
+        vibChar = chars[0]
         self.print("Found vibration characteristic!")
         self.print(SEPARATOR)
-        return True
 
-    def subButtonPress(self, device: Peripheral, charUuid: str, notifHandler: NotificationHandler) -> bool:
-        # Check that the charactertistic we are interested in exists.
+        # Check that the button press charactertistic exists.
         self.print("Finding button press characteristic with UUID:", BTN_CHAR_UUID)
-        chars = device.getCharacteristics(uuid=charUuid)
+        chars = device.getCharacteristics(uuid=BTN_CHAR_UUID)
         if len(chars) == 0:
-            self.print("Button press characteristic can't be found. Exiting.")
-            return False
+            raise BTLEException("Button press characteristic can't be found")
         self.print("Found button press characteristic!")
         self.print(SEPARATOR)
 
-        # Now that we are sure both the service and characteristics exists, we subscribe to receive notifications whenever there is new data.
+        # Then the handle to subscribe to its notifications through.
         ch = chars[0] # Assuming the characteristic is the only element.
         self.print("Finding CCCD handle to subscribe to notifications:", BTN_CHAR_UUID)
         charFound = False
@@ -229,26 +241,54 @@ class WristDeviceThread(threading.Thread):
                     break
 
         if cccd is None:
-            self.print("Can't find Client Charactertistic Configuration Descriptor for button press charateristic. Exiting.")
-            return False
-        
-        # Turn on the notification
-        cccd.write(NOTIF_ON, withResponse=True)
+            raise BTLEException("Can't find Client Charactertistic Configuration Descriptor for button press charateristic")
+        return {"vib": vibChar.getHandle(), "vibProps": vibChar.properties, "button": ch.getHandle(), "cccd": cccd.handle}
+
+    def subButtonPress(self, device: Peripheral, handles: dict):
+        # Turn on the notification, straight through the (possibly cached) CCCD handle
+        device.writeCharacteristic(handles["cccd"], NOTIF_ON, withResponse=True)
 
         # Set notification handler 
-        device.withDelegate(notifHandler)
+        device.withDelegate(self.notifHandler)
         self.print("Successfully subscribed!")
         self.print(SEPARATOR)
-        return True
 
-    def activateVib(self):
+    def setWriteMode(self, properties: int):
+        # Write without response skips waiting for the device's acknowledgement, where the characteristic allows it
+        self.withResponse = not (config.WRIST_WRITE_NO_RESPONSE and properties & PROP_WRITE_NO_RESP)
+        self.print("Writing vibration commands %s response" % ("with" if self.withResponse else "without"))
+
+    def activateVib(self, trace: tuple = None):
         self.fogOn.set()
+        self.commands.put(VIB_KEY, VIB_ON, None if trace is None else lambda t: self.latency.record(trace, t))
 
     def deactivateVib(self):
         self.fogOn.clear()
+        self.commands.put(VIB_KEY, VIB_OFF)
+
+    def print(self, *objs):
+        self.log.info(" ".join(str(o) for o in objs))
+
+class ManagedWristDevice(BleClient):
+    """
+    The wrist device reached through the BLE manager (BLE_USE_MANAGER), in place of a WristDeviceThread.
+    The manager owns the connection, and queues and coalesces the vibration commands as WristDeviceThread does.
+    """
+    def __init__(self, notifHandler: NotificationHandler, connectedEvent: threading.Event):
+        BleClient.__init__(self, "wrist", lambda data, tRecv: notifHandler.handleNotification(None, data), connectedEvent)
+        self.fogOn = threading.Event()
+        self.latency = LatencyCollector("WristFeedback")
 
-    def print(self, *objs, **kwargs):
-        builtins.print(self.printPrefix, *objs, **kwargs)
+    def activateVib(self, trace: tuple = None):
+        self.fogOn.set()
+        self.write(VIB_KEY, VIB_ON)
+        # The write is acknowledged to the manager only, the latency is taken up to the command leaving this process
+        if trace is not None:
+            self.latency.record(trace, now())
+
+    def deactivateVib(self):
+        self.fogOn.clear()
+        self.write(VIB_KEY, VIB_OFF)
 
 class PublishThread(threading.Thread):
     def __init__(self, notifHandler: NotificationHandler, btnAddr: str, btnTopic: str):
@@ -256,7 +296,7 @@ class PublishThread(threading.Thread):
         self.shutdown = threading.Event()
         self.bleConnected = threading.Event()
         self.notifHandler = notifHandler
-        self.printPrefix = "[" + self.__class__.__name__ + "]:\t"
+        self.log = logging.getLogger("WristFeedback." + self.__class__.__name__)
         self.btnAddr = btnAddr
         self.btnTopic = btnTopic
         self.publisher = None
@@ -276,11 +316,13 @@ class PublishThread(threading.Thread):
                 break
 
         while not self.shutdown.isSet():
+            beat("buttons")
             time.sleep(0.1) # 10 Hz loop
             value = self.notifHandler.getValue()
             if value is not None:
                 self.print("Button pressed: %d" % value)
                 self.publisher.send_string("%s %d" % (self.btnTopic, value))
+                registry.counter("msgs_out." + self.btnTopic).inc()
 
     def setupPub(self):
         context = zmq.Context()
@@ -288,8 +330,8 @@ class PublishThread(threading.Thread):
         publisher.bind(self.btnAddr)
         self.publisher = publisher
 
-    def print(self, *objs, **kwargs):
-        builtins.print(self.printPrefix, *objs, **kwargs)
+    def print(self, *objs):
+        self.log.info(" ".join(str(o) for o in objs))
 
 class ReadStateThread(threading.Thread):
     """
@@ -319,20 +361,23 @@ class ReadStateThread(threading.Thread):
 
         # Set socket options to subscribe to IMU topic
         self.sub.setsockopt_string(zmq.SUBSCRIBE, topic)
+        self.msgsIn = registry.counter("msgs_in." + topic)
 
     def run(self):
         global wristDevice
         fogOn = False
         prevFogOn = False
         while not self.shutdown.isSet():
+            beat("read_state")
             sockEvents = self.sub.poll(POLL_TIMEOUT, zmq.POLLIN)
             if (sockEvents & zmq.POLLIN) > 0:
                 string = self.sub.recv_string()
-                t, state = string.split()
+                self.msgsIn.inc()
+                t, state, *fields = string.split()
                 fogOn = float(state) > 0.0
                 if wristDevice is not None:
                     if fogOn and not prevFogOn:
-                        wristDevice.activateVib()
+                        wristDevice.activateVib(parsePredictTrace(fields))
                     if not fogOn and prevFogOn:
                         wristDevice.deactivateVib()
                 prevFogOn = fogOn
@@ -342,15 +387,23 @@ class ReadStateThread(threading.Thread):
         context.destroy()
 
 if __name__ == "__main__":
+    setupLogging("WristFeedback")
+    startMetrics("WristFeedback")
+    installProfiler("WristFeedback")
+    startHeartbeat("WristFeedback")
     notifHandler = NotificationHandler()
 
     try:
         pubData = PublishThread(notifHandler, config.BTN_SOCK, config.BTN_TOPIC)
         pubData.start()
-        wristDevice = WristDeviceThread(notifHandler, pubData.bleConnected)
+        if config.BLE_USE_MANAGER:
+            wristDevice = ManagedWristDevice(notifHandler, pubData.bleConnected)
+        else:
+            wristDevice = WristDeviceThread(notifHandler, pubData.bleConnected)
         wristDevice.start()
         readFog = ReadStateThread(config.PREDICT_SOCK, config.PREDICT_TOPIC)
         readFog.start()
+        setReady()
 
         while threading.activeCount() > 0:
             time.sleep(0.01)
@@ -6,6 +6,7 @@ Updated on 04/04/2021
 Updated by Glen Goh
 == Inputs ==
 Recieves inputs from DataProvider Module via the IMU topic addressed in DATA_SOCK in the config File
+(or from the foot merge stage via GAIT_TOPIC on GAIT_SOCK if USE_FOOT_MERGE is set)
 Data Recieved from DataProvider: 
 Left_Foot_Ang_Vel (X/Y/Z) ; Left_Foot_Acceleration (X/Y/Z) ;
 Right_Foot_Ang_Vel (X/Y/Z) ; Right_Foot_Acceleration (X/Y/Z) ; 
@@ -16,13 +17,14 @@ Data sent to Feedback:
 Walk predicted    :  Data sent = 0
 Pre-FoG predicted :  Data sent = 0.5
 FoG predicted     :  Data sent = 1
+Each prediction is followed by the trace timestamps of the newest sample in its window (see common/tracing.py)
+Step cadence (steps/min) of the windows predicted as Walk, via CADENCE_TOPIC on PREDICT_SOCK, to set the tempo of the Feedback metronome
 '''
 
 #Importing Essential librarys
 from time import sleep
 from time import time
 from joblib import load
-from queue import Queue
 import numpy as np
 import pandas as pd
 import time
@@ -31,19 +33,46 @@ import zmq
 import threading
 import time
 import math
+import logging
 from lib.constants import *
+from lib.DataBuffer import DataBuffer
+from lib.GapDetector import GapDetector
+from lib.RateController import RateController, newest_rows
+from lib.CascadeGate import CascadeGate
+from lib.IMUValue import GAIT_DTYPE, decodeBlock, gaitToRows
 import lib.utils as utils
+from lib.cadence import estimate_cadence
 sys.path.append("..")
 import config
+from common.log import setupLogging, SampledLogger
+from common.tracing import now, formatTrace, parseSampleTail
+from common.metrics import registry, startMetrics
+from common.profiler import timed, installProfiler
+from common.heartbeat import startHeartbeat, setReady, beat
 
 # Obtaining constant values from Config File
 Win_Size = config.WIN_SIZE
 Test_Rate = config.TEST_RATE
 Sample_Rate = config.SAMPLE_RATE
-STEP_SIZE = int(Sample_Rate / Test_Rate)
 
-#Data Buffer for incoming sensor data
-buffer = Queue()
+#Data Buffer for incoming sensor data, one row per sample:
+#12 IMU values, ground truth, trace timestamps (acquired, published), sequence number (NaN if not sent)
+BUF_WIDTH = 16
+TACQ_COL = 13
+SEQ_COL = 15
+buffer = DataBuffer(config.BUFFER_SIZE, BUF_WIDTH, overflow=config.BUFFER_OVERFLOW)
+registry.gauge("predictor.buffer_depth", buffer.__len__)
+registry.gauge("predictor.buffer_high_water", lambda: buffer.highWater)
+registry.gauge("predictor.buffer_dropped", lambda: buffer.dropped)
+
+log = logging.getLogger("Predictor")
+
+#Feature extraction, timed per call (see common/profiler.py)
+extract_sepfeat = timed("predictor.extract_sepfeat")(utils.extract_sepfeat)
+extract_pred_feat = timed("predictor.extract_pred_feat")(utils.extract_pred_feat)
+extract_freq_feat = timed("predictor.extract_freq_feat")(utils.extract_freq_feat)
+extract_dect_feat = timed("predictor.extract_dect_feat")(utils.extract_dect_feat)
+estimate_cadence = timed("predictor.estimate_cadence")(estimate_cadence)
 
 #Publisher function setup
 def setupPub(pubAddr: str) -> zmq.Socket:
@@ -53,6 +82,16 @@ def setupPub(pubAddr: str) -> zmq.Socket:
 
     return publisher
 
+#Readiness replier (Answers the data publisher's handshake on PREDICT_READY_SOCK)
+def replyReady(replyAddr: str):
+    # Answers every readiness request, not just the first one, so a data publisher (re)started at any time gets through
+    context = zmq.Context()
+    readyReplier = context.socket(zmq.REP)
+    readyReplier.bind(replyAddr)
+    while True:
+        request = readyReplier.recv().decode()
+        readyReplier.send(("Yes" if request == "Ready?" else "No").encode())
+
 #Data Reading Thread (Reads IMU data from IMU topic)
 class readThread(threading.Thread):
     def __init__(self, sockAddr: str, topic: str):  
@@ -64,13 +103,32 @@ class readThread(threading.Thread):
         self.sub.connect(sockAddr)
         # Set socket options to subscribe
         self.sub.setsockopt_string(zmq.SUBSCRIBE, topic)
+        self.msgsIn = registry.counter("msgs_in." + topic)
 
     def run(self):
         while not self.shutdown.isSet():
+            beat("read")
+            #Wait for data with a timeout, so a shutdown request is noticed even when no data comes in
+            if self.sub.poll(100) == 0:
+                continue
+            if config.DATA_MSG_FORMAT == "binary":
+                #Binary messages carry packed samples (GAIT_DTYPE records), already in buffer order
+                topic, payload = self.sub.recv_multipart()
+                buffer.push_many(gaitToRows(decodeBlock(payload, GAIT_DTYPE)))
+                self.msgsIn.inc()
+                continue
+
             string = self.sub.recv_string()
-            topic,lwx,lwy,lwz,lax,lay,laz,rwx,rwy,rwz,rax,ray,raz,gt = string.split()
-            #Inserts incoming IMU data into buffer
-            buffer.put((lwx,lwy,lwz,lax,lay,laz,rwx,rwy,rwz,rax,ray,raz,gt))
+            fields = string.split()
+            values = [float(f) for f in fields[1:14]]
+            #Trace timestamps (acquired, published), taken as now if the DataProvider did not send them
+            tAcq, tPub, seq = parseSampleTail(fields[14:])
+            if tAcq is None:
+                tAcq = tPub = now()
+            #Inserts incoming IMU data into buffer, with no sequence number (NaN) from a publisher predating them
+            values += [tAcq, tPub, np.nan if seq is None else seq]
+            buffer.push(values)
+            self.msgsIn.inc()
 
 #FoG State Classification Thread (Predicts FoG state from IMU data)            
 class detectionThread(threading.Thread):
@@ -79,42 +137,94 @@ class detectionThread(threading.Thread):
         self.shutdown   = threading.Event()
         self.publisher  = setupPub(pubSock)
         self.pubTopic   = pubTopic
-        # Container for gait observation window
-        self.window     = []
+        # Container for gait observation window, the oldest step is dropped as a new one comes in
+        self.window     = DataBuffer(Win_Size, 12)
+        # Samples missing from the stream: short gaps are interpolated, the window starts over after a longer one
+        self.gaps       = GapDetector(SEQ_COL, TACQ_COL, config.GAP_INTERPOLATE_MAX, config.GAP_MAX_STALL)
+        self.brokenAt   = None
+        # Prediction rate, from the motion of the feet and the cycle time if ADAPTIVE_RATE is set, TEST_RATE otherwise
+        if config.ADAPTIVE_RATE:
+            self.rate   = RateController(Sample_Rate, Test_Rate, config.REST_RATE, config.ACTIVE_RATE, config.REST_ENERGY,
+                config.ACTIVE_ENERGY, config.RATE_HOLD, config.RATE_DEADLINE)
+        else:
+            self.rate   = RateController(Sample_Rate, Test_Rate, Test_Rate, Test_Rate, 0, math.inf, math.inf, math.inf)
+        self.motionSamples = int(config.MOTION_WINDOW * Sample_Rate)
+        # With CASCADE, the windows plainly walking skip the DWT features and the FoG model
+        self.gate       = CascadeGate(config.GATE_MAX_FI, config.GATE_MAX_ACC_FI, config.GATE_MIN_POWER) if config.CASCADE else None
         # Staging offline trained classifier and scaler function 
         self.scl_D    = load(config.SCL_D_JOBLIB_PATH)
         self.clf_D    = load(config.MLP_D_JOBLIB_PATH)
         self.scl_P    = load(config.SCL_P_JOBLIB_PATH)
         self.clf_P    = load(config.MLP_P_JOBLIB_PATH)
+        # Per cycle output is rate limited so the prediction loop never waits on the terminal
+        self.sampledLog = SampledLogger(log)
+        self.lastLabel  = None
+        # Per stage timings and throughput
+        self.featureTime    = registry.histogram("predictor.feature_time")
+        self.inferenceTime  = registry.histogram("predictor.inference_time")
+        self.cycleTime      = registry.histogram("predictor.cycle_time")
+        self.msgsOut        = registry.counter("msgs_out." + pubTopic)
+        self.gapDuration    = registry.histogram("predictor.gap_duration")
+        self.gapSamples     = registry.histogram("predictor.gap_samples", unit=1)
+        self.recoveryTime   = registry.histogram("predictor.gap_recovery_time")
+        for name in ("gaps", "missing", "interpolated", "breaks"):
+            registry.gauge("predictor.gap_" + name, lambda name=name: self.gaps.getStats()[name])
+        registry.gauge("predictor.rate", lambda: self.rate.rate)
+        registry.gauge("predictor.motion_energy", lambda: self.rate.energy)
+        self.rateChanges    = registry.counter("predictor.rate_changes")
+        if self.gate is not None:
+            for name in ("walking", "full"):
+                registry.gauge("predictor.cascade_" + name, lambda name=name: self.gate.getStats()[name])
         
+    @timed("predictor.predict_prefog")
+    def predictPreFoG(self, features: list):
+        sample = np.empty(shape=(1, 20))
+        sample[0] = np.array(features)
+        scaled_test = self.scl_P.transform(sample)
+        return self.clf_P.predict(scaled_test)
+
+    @timed("predictor.detect_fog")
+    def detectFoG(self, features: list):
+        sample = np.empty(shape=(1, 20))
+        sample[0] = np.array(features)
+        scaled_test = self.scl_D.transform(sample)
+        return self.clf_D.predict(scaled_test)
+
     def run(self):
         # Inform the data publisher that we are ready for data
-        context = zmq.Context()
-        readyReplier = context.socket(zmq.REP)
-        readyReplier.bind(config.PREDICT_READY_SOCK)
-        request = readyReplier.recv().decode()
-        if request == "Ready?":
-            readyReplier.send("Yes".encode())
+        threading.Thread(target=replyReady, args=(config.PREDICT_READY_SOCK,), daemon=True).start()
+        setReady()
 
-        print("Starting Predictor")
+        log.info("Starting Predictor")
         #Clock variable to maintain 0.1s cycle
         t = time.time()
         #Repeating prediction code
         while not self.shutdown.isSet():
-            #Running Prediction Cycle at 10Hz
-            if time.time() >= t and buffer.qsize() >= STEP_SIZE:
+            beat("detection")
+            #Running Prediction Cycle at the current rate, blocking (rather than spinning) until a step of new samples is in
+            step_size = self.rate.step
+            period = self.rate.period
+            delay = t - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if buffer.wait(step_size, 0.1):
                 #obtain start time of prediction cycle
                 k1 = time.time()
 
-                #Updating window with new values from buffer
-                for i in range(STEP_SIZE):
-                    lwx,lwy,lwz,lax,lay,laz,rwx,rwy,rwz,rax,ray,raz,gt = buffer.get()
-                    self.window.append([float(lwx),float(lwy),float(lwz),
-                                        float(lax),float(lay),float(laz),
-                                        float(rwx),float(rwy),float(rwz),
-                                        float(rax),float(ray),float(raz)])
-                    if i == (STEP_SIZE-1):
-                        truth = gt
+                #Updating window with new values from buffer, minding the samples missing
+                step = buffer.pop_many(step_size)
+                rows, broken = self.gaps.fill(step)
+                for missing, duration in self.gaps.lastGaps:
+                    self.gapDuration.record(duration)
+                    self.gapSamples.record(max(missing, 0))
+                if broken:
+                    #Samples from before the gap must not be analysed together with those after it, the window is filled again
+                    self.window.clear()
+                    self.brokenAt = k1
+                    log.info("Gap in the samples (%s), window restarted", ", ".join(
+                        "%d missing over %.2f s" % g if g[0] >= 0 else "stream restarted or stalled, %.2f s" % g[1] for g in self.gaps.lastGaps))
+                self.window.push_many(rows[:, :12])
+                truth, tAcq, tPub = step[-1, 12:15]
 
                 #Running Feature extraction and state prediction
                 if len(self.window) >= Win_Size:
@@ -122,19 +232,23 @@ class detectionThread(threading.Thread):
                     #Feature Extraction Step
                     Dect_features = []
                     Pred_features = []
-                    Pred_features, Dect_features = utils.extract_sepfeat(self.window)
-
-                    #Predicting Pre-FoG state
-                    sample = np.empty(shape=(1, 20))
-                    sample[0] = np.array(Pred_features)
-                    scaled_test = self.scl_P.transform(sample)
-                    PreFoG_Label = self.clf_P.predict(scaled_test)
+                    if self.gate is None:
+                        Pred_features, Dect_features = extract_sepfeat(self.window.peek(Win_Size))
+                        tFeat = now()
+                    else:
+                        #Cascade: the frequency features first, the rest of the FoG detection features only if not plainly walking
+                        columns = utils.window_columns(self.window.peek(Win_Size))
+                        Pred_features = extract_pred_feat(columns)
+                        Freq_features = extract_freq_feat(columns)
+                        walking = self.gate.isWalking(Freq_features)
+                        if not walking:
+                            Dect_features = extract_dect_feat(columns, Freq_features)
+                        tFeat = now()
 
-                    #Predicting FoG state
-                    sample = np.empty(shape=(1, 20))
-                    sample[0] = np.array(Dect_features)
-                    scaled_test = self.scl_D.transform(sample)
-                    Dect_Label = self.clf_D.predict(scaled_test)
+                    #Predicting Pre-FoG and FoG states
+                    PreFoG_Label = self.predictPreFoG(Pred_features)
+                    Dect_Label = 0 if self.gate is not None and walking else self.detectFoG(Dect_features)
+                    tInfer = now()
 
                     #Combining Prediction and Detection outputs into a Single Output
                     if PreFoG_Label == 0 and Dect_Label == 0: 
@@ -146,24 +260,52 @@ class detectionThread(threading.Thread):
                     else:
                         predicted_label = 0
 
-                    #Sending Predicted output to Feedback Module
-                    self.publisher.send_string("%s %f" % (self.pubTopic, predicted_label))
+                    #Sending Predicted output to Feedback Module, traced with the timestamps of the newest sample in the window
+                    self.publisher.send_string("%s %f" % (self.pubTopic, predicted_label) + formatTrace(tAcq, tPub, k1, tFeat, tInfer, now()))
+                    self.msgsOut.inc()
+                    if self.brokenAt is not None:
+                        #Time from the samples resuming after a gap to the first prediction on a whole window again
+                        self.recoveryTime.record(now() - self.brokenAt)
+                        log.info("First prediction %.2f s after the gap", now() - self.brokenAt)
+                        self.brokenAt = None
 
-                    #Cleaning up window for next computation cycle
-                    del self.window[:STEP_SIZE]
+                    #Sending the walking cadence, which sets the tempo of the cues during FoG
+                    if predicted_label == 0:
+                        cadence = estimate_cadence(self.window.peek(Win_Size), Sample_Rate)
+                        if cadence is not None:
+                            self.publisher.send_string("%s %f" % (config.CADENCE_TOPIC, cadence))
 
                     # Obtaining computational time performance  
                     Total_time = time.time() - k1
-                    # Print output and total computational time of prediction cycle                                    
-                    print(Total_time, 's : Predicted =', predicted_label, '| Actual =', truth )
+                    self.featureTime.record(tFeat - k1)
+                    self.inferenceTime.record(tInfer - tFeat)
+                    self.cycleTime.record(Total_time)
+                    # Log output and total computational time of prediction cycle
+                    self.sampledLog.debug("%f s : Predicted = %s | Actual = %s", Total_time, predicted_label, truth)
+                    if predicted_label != self.lastLabel:
+                        log.info("Predicted state changed to %s | Actual = %s", predicted_label, truth)
+                        self.lastLabel = predicted_label
+
+                    #Choosing the rate of the next cycles
+                    if self.rate.update(newest_rows(self.window, self.motionSamples), Total_time, k1):
+                        self.rateChanges.inc()
+                        log.info("Prediction rate changed to %.1f Hz (%s, motion energy %.0f, cycle time %.1f ms)", self.rate.rate,
+                            self.rate.reason, self.rate.energy, self.rate.cycleTime * 1e3)
 
-                t += (1/Test_Rate) #add 100ms for 10Hz detection rate
+                t += period #next cycle one period on, 100ms at the 10Hz default rate
 
 
 if __name__ == "__main__":
+    setupLogging("Predictor")
+    startMetrics("Predictor")
+    installProfiler("Predictor")
+    startHeartbeat("Predictor")
     try:
-        print("FoG Detection Started in", config.PREDICT_MODE, "Mode")
-        rt = readThread(config.DATA_SOCK, config.LOCAL_IMU_TOPIC)
+        log.info("FoG Detection Started in %s Mode", config.PREDICT_MODE)
+        if config.USE_FOOT_MERGE:
+            rt = readThread(config.GAIT_SOCK, config.GAIT_TOPIC)
+        else:
+            rt = readThread(config.DATA_SOCK, config.LOCAL_IMU_TOPIC)
         dt = detectionThread(config.PREDICT_MODE, config.PREDICT_SOCK, config.PREDICT_TOPIC)              
         rt.start()
         dt.start()
@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+
+class CascadeGate():
+    """
+    First stage of the cascade prediction: tells, from the frequency features of the FoG detection (see extract_freq_feat() in
+    lib/utils.py), the windows that are plainly walking, for which the DWT features and the FoG model can be skipped.
+
+    A window is walking when, on both legs, the freeze index of the angular speed is below 'maxFreezeIndex' and that of the
+    acceleration below 'maxAccFreezeIndex': the power is in the locomotion band (0.5-3 Hz), not the freeze band (3-8 Hz).
+    The locomotion band power of the angular speed must also be above 'minPower' on both legs, as the freeze index of a still
+    foot is noise, and the FoG model labels a still foot as a freeze.
+    """
+    def __init__(self, maxFreezeIndex: float, maxAccFreezeIndex: float, minPower: float):
+        """
+        Initialises CascadeGate
+
+        Args:
+            maxFreezeIndex (float): Largest freeze index of the angular speed of a walking leg.
+            maxAccFreezeIndex (float): Largest freeze index of the acceleration of a walking leg.
+            minPower (float): Smallest locomotion band power of the angular speed of a walking leg (sum of the 3 axes, raw units).
+        """
+        self.maxFreezeIndex = maxFreezeIndex
+        self.maxAccFreezeIndex = maxAccFreezeIndex
+        self.minPower = minPower
+        # Stats
+        self.walking = 0
+        self.full = 0
+
+    def isWalking(self, freq_feat: list) -> bool:
+        """
+        Args:
+            freq_feat (list): (w_fi, wx_lb, wy_lb, wz_lb, a_fi, ax_lb) of each leg, as returned by extract_freq_feat().
+
+        Returns:
+            bool: Whether the window is walking, without running the FoG model.
+        """
+        for w_fi, wx_lb, wy_lb, wz_lb, a_fi, ax_lb in freq_feat:
+            if not (w_fi < self.maxFreezeIndex and a_fi < self.maxAccFreezeIndex and wx_lb + wy_lb + wz_lb > self.minPower):
+                self.full += 1
+                return False
+        self.walking += 1
+        return True
+
+    def getStats(self) -> dict:
+        return {
+            "walking": self.walking,
+            "full": self.full,
+        }
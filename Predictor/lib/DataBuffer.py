@@ -1,60 +1,216 @@
 #!/usr/bin/python3
 
-from collections import deque
-# TODO: Protect with locks
+import queue
+import threading
+import numpy as np
+
+# Overflow policies
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
 class DataBuffer():
     """
-    Wrapper over collections.deque to allow specific data structure operations.
+    Bounded, thread-safe First-In-First-Out (FIFO) ring buffer of fixed width numeric items, backed by a NumPy array.
+
+    Items can be pushed to the back and popped from the front one at a time or in bulk, and the 'n' oldest items can be looked at without removing them.
 
-    This data structure allows you push items to the back and then pop them from the front again. Essentially behaving like a First-In-First-Out (FIFO) buffer.
+    Every item is stored twice, 'capacity' rows apart, so any run of up to 'capacity' consecutive items is contiguous in memory.
+    peek() therefore returns a NumPy view without copying, in O(n) for n pushed items and O(1) for reads.
+    The view stays valid until its slots are reused, i.e. until 'capacity - len(buffer)' more items have been pushed after the read.
+    Copy it (or hand it to something that copies, like push_many() of another buffer) if it must outlive that.
+    pop() and pop_many() return copies, made under the lock: the slots they free can be reused by the next push.
 
-    Additionally, it also provides you a way to look at 'n' number of oldest items without removing them.
+    When full, the buffer either drops its oldest items (DROP_OLDEST) or blocks the pushing thread until there is space (BLOCK).
     """
-    def __init__(self):
-        self.buffer = deque()
+    def __init__(self, capacity: int, width: int = None, dtype=float, overflow: str = DROP_OLDEST):
+        """
+        Initialises DataBuffer
+
+        Args:
+            capacity (int): Maximum number of items held.
+            width (int, optional): Number of values per item, or None for scalar items. Defaults to None.
+            dtype (optional): NumPy type of the values. Defaults to float.
+            overflow (str, optional): DROP_OLDEST or BLOCK. Defaults to DROP_OLDEST.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        if overflow not in (DROP_OLDEST, BLOCK):
+            raise ValueError("Unknown overflow policy '%s'" % overflow)
+        shape = (2 * capacity,) if width is None else (2 * capacity, width)
+        self.buffer = np.zeros(shape, dtype=dtype)
+        self.capacity = capacity
+        self.overflow = overflow
+        self.head = 0   # Slot of the oldest item, always < capacity
+        self.size = 0
+        self.lock = threading.Lock()
+        self.notEmpty = threading.Condition(self.lock)
+        self.notFull = threading.Condition(self.lock)
+        # Stats
+        self.highWater = 0
+        self.pushed = 0
+        self.popped = 0
+        self.dropped = 0
 
     def __len__(self):
-        return len(self.buffer)
+        return self.size
+
+    def _write(self, items: np.ndarray):
+        """
+        Stores items after the newest one, dropping the oldest ones if needed. Lock must be held.
+        """
+        n = len(items)
+        if n > self.capacity:
+            # Only the newest 'capacity' items can be kept.
+            self.dropped += n - self.capacity
+            self.pushed += n - self.capacity
+            items = items[n - self.capacity:]
+            n = self.capacity
+        overflow = self.size + n - self.capacity
+        if overflow > 0:
+            self.head = (self.head + overflow) % self.capacity
+            self.size -= overflow
+            self.dropped += overflow
+
+        start = (self.head + self.size) % self.capacity
+        first = min(n, self.capacity - start)
+        for offset in (0, self.capacity):
+            self.buffer[start + offset:start + offset + first] = items[:first]
+            self.buffer[offset:offset + n - first] = items[first:]
 
-    def push(self, item):
+        self.size += n
+        self.pushed += n
+        self.highWater = max(self.highWater, self.size)
+        self.notEmpty.notify_all()
+
+    def _waitForSpace(self, n: int, timeout: float):
+        """
+        Blocks until 'n' items fit, for the BLOCK policy. Lock must be held.
+        """
+        if not self.notFull.wait_for(lambda: self.capacity - self.size >= n, timeout):
+            raise queue.Full
+
+    def push(self, item, timeout: float = None):
         """
         Pushes an item in.
 
         Args:
-            item : Item to push
+            item : Item to push, a scalar or a sequence of 'width' values.
+            timeout (float, optional): For the BLOCK policy, seconds to wait for space. Defaults to None (wait forever).
+
+        Raises:
+            queue.Full: The BLOCK policy timed out.
+        """
+        with self.lock:
+            if self.overflow == BLOCK:
+                self._waitForSpace(1, timeout)
+            self._write(np.asarray(item, dtype=self.buffer.dtype)[np.newaxis])
+
+    def push_many(self, items, timeout: float = None):
+        """
+        Pushes items in, oldest first.
+
+        Args:
+            items : Sequence or array of items.
+            timeout (float, optional): For the BLOCK policy, seconds to wait for space for each chunk. Defaults to None (wait forever).
+
+        Raises:
+            queue.Full: The BLOCK policy timed out. The items before the chunk that did not fit were pushed.
         """
-        self.buffer.append(item)
+        items = np.asarray(items, dtype=self.buffer.dtype)
+        with self.lock:
+            if self.overflow == DROP_OLDEST:
+                self._write(items)
+                return
+            # Push as much as fits at a time, as the consumer frees space.
+            while len(items) > 0:
+                self._waitForSpace(1, timeout)
+                n = min(len(items), self.capacity - self.size)
+                self._write(items[:n])
+                items = items[n:]
 
     def pop(self):
         """
         Pops the oldest item.
 
         Returns:
-            Oldest item. If the buffer was empty to begin with, returns 'None'.
+            Oldest item (a copy of a row, or a scalar). If the buffer was empty to begin with, returns 'None'.
         """
+        with self.lock:
+            if self.size == 0:
+                return None
+            v = self.buffer[self.head].copy()
+            self._release(1)
+            return v
+
+    def pop_many(self, n: int) -> np.ndarray:
+        """
+        Pops up to 'n' of the oldest items.
 
-        try:
-            v = self.buffer.popleft()
+        Args:
+            n (int): Maximum number of items to pop.
+
+        Returns:
+            np.ndarray: Copy of the popped items, starting from the oldest. Empty if the buffer was empty.
+        """
+        with self.lock:
+            n = max(0, min(n, self.size))
+            v = self.buffer[self.head:self.head + n].copy()
+            self._release(n)
             return v
-        except IndexError:
-            return None
 
-    def peek(self, n=1) -> list:
+    def _release(self, n: int):
+        """
+        Frees the 'n' oldest slots. Lock must be held.
+        """
+        self.head = (self.head + n) % self.capacity
+        self.size -= n
+        self.popped += n
+        self.notFull.notify_all()
+
+    def peek(self, n: int = 1) -> np.ndarray:
         """
-        Peeks with removing the first 'n' items in the buffer, starting from the oldest item.
+        Peeks without removing the first 'n' items in the buffer, starting from the oldest item.
 
         Args:
             n (int, optional): Specifies the number of items to peek. Defaults to 1.
 
         Returns:
-            list: Contains all the peeked items, starting from the oldest, ending with the newest item.
+            np.ndarray: View of the peeked items, starting from the oldest, ending with the newest item. None if there are fewer than 'n' items.
         """
+        with self.lock:
+            if self.size >= n and n >= 1:
+                return self.buffer[self.head:self.head + n]
+            return None
+
+    def wait(self, n: int = 1, timeout: float = None) -> bool:
+        """
+        Blocks until at least 'n' items are buffered.
 
-        if len(self.buffer) >= n and n >= 1:
-            result = []
-            for i in range(0, n):
-                self.buffer.rotate(-i)
-                result.append(self.buffer[0])
+        Args:
+            n (int, optional): Number of items to wait for. Defaults to 1.
+            timeout (float, optional): Maximum seconds to wait. Defaults to None (wait forever).
 
-            self.buffer.rotate(n - 1)
-            return result
\ No newline at end of file
+        Returns:
+            bool: True if 'n' items are buffered, False on timeout.
+        """
+        with self.lock:
+            return self.notEmpty.wait_for(lambda: self.size >= n, timeout)
+
+    def clear(self):
+        with self.lock:
+            self._release(self.size)
+
+    def getStats(self) -> dict:
+        """
+        Returns:
+            dict: Current and highest number of items held, and the number of items pushed, popped and dropped on overflow.
+        """
+        with self.lock:
+            return {
+                "size": self.size,
+                "capacity": self.capacity,
+                "highWater": self.highWater,
+                "pushed": self.pushed,
+                "popped": self.popped,
+                "dropped": self.dropped,
+            }
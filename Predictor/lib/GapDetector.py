@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+class GapDetector():
+    """
+    Finds the samples missing from a stream of buffer rows from their sequence numbers.
+
+    A gap of up to 'maxInterpolate' samples is filled with rows interpolated linearly between the rows around it.
+    A longer gap, or a sequence number going back (the publisher restarted, or a replay moved on to its next trial), breaks the
+    stream: the rows before it must not share a window with the rows after it.
+    Rows without a sequence number (NaN, from a publisher predating them) only have their acquisition times, which cannot tell a
+    late sample from a missing one: publishers catch up after a stall. Between such rows nothing is ever interpolated, and only
+    more than 'maxStall' seconds without samples, or time going back, breaks the stream.
+    """
+    def __init__(self, seqColumn: int, timeColumn: int, maxInterpolate: int, maxStall: float = 1.0):
+        """
+        Initialises GapDetector
+
+        Args:
+            seqColumn (int): Column of the sequence numbers in the rows.
+            timeColumn (int): Column of the acquisition times in the rows.
+            maxInterpolate (int): Most samples missing in a row that are filled in, rather than breaking the stream.
+            maxStall (float, optional): Seconds between two acquisition times, of rows without sequence numbers, beyond which the
+                                        stream breaks. Defaults to 1.0.
+        """
+        self.seqColumn = seqColumn
+        self.timeColumn = timeColumn
+        self.maxInterpolate = maxInterpolate
+        self.maxStall = maxStall
+        self.last = None
+        # Gaps found by the last fill(): (samples missing, -1 if unknown, seconds between the rows around the gap)
+        self.lastGaps = []
+        # Stats
+        self.gaps = 0
+        self.missing = 0
+        self.interpolated = 0
+        self.breaks = 0
+
+    def _missing(self, prev: np.ndarray, row: np.ndarray) -> int:
+        """
+        Returns:
+            int: Samples missing between two rows, -1 if the stream went back or, without sequence numbers, stalled.
+        """
+        if not (np.isnan(prev[self.seqColumn]) or np.isnan(row[self.seqColumn])):
+            step = int(row[self.seqColumn] - prev[self.seqColumn])
+            return step - 1 if step > 0 else -1
+        dt = row[self.timeColumn] - prev[self.timeColumn]
+        return -1 if dt < 0 or dt > self.maxStall else 0
+
+    def fill(self, rows: np.ndarray) -> tuple:
+        """
+        Checks the rows following those of the previous calls, and fills in their short gaps.
+
+        Args:
+            rows (np.ndarray): Next rows of the stream, oldest first.
+
+        Returns:
+            tuple: (rows, broken). The rows with their short gaps filled in; if the stream broke, only the rows after the last break,
+                   and 'broken' is set: the window they go to must be emptied first.
+        """
+        self.lastGaps = []
+        seqs = rows[:, self.seqColumn]
+        if self.last is not None:
+            seqs = np.concatenate(([self.last[self.seqColumn]], seqs))
+        # Nothing missing, the usual case
+        if len(rows) == 0 or (not np.isnan(seqs).any() and (np.diff(seqs) == 1).all()):
+            if len(rows) > 0:
+                self.last = rows[-1].copy()
+            return rows, False
+
+        pieces = []
+        broken = False
+        prev = self.last
+        for row in rows:
+            if prev is not None:
+                missing = self._missing(prev, row)
+                if missing != 0:
+                    self.gaps += 1
+                    self.lastGaps.append((missing, row[self.timeColumn] - prev[self.timeColumn]))
+                if missing > 0:
+                    self.missing += missing
+                if missing < 0 or missing > self.maxInterpolate:
+                    self.breaks += 1
+                    broken = True
+                    pieces = []
+                elif missing > 0:
+                    weights = np.arange(1, missing + 1)[:, None] / (missing + 1)
+                    pieces.append(prev + weights * (row - prev))
+                    self.interpolated += missing
+            pieces.append(row[None])
+            prev = row
+        self.last = prev.copy()
+        return np.concatenate(pieces), broken
+
+    def getStats(self) -> dict:
+        return {
+            "gaps": self.gaps,
+            "missing": self.missing,
+            "interpolated": self.interpolated,
+            "breaks": self.breaks,
+        }
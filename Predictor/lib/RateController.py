@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+# Reasons of the rate changes
+REST = "rest"
+MOTION = "motion"
+ACTIVE = "active"
+DEADLINE = "deadline"
+
+def motion_energy(window: np.ndarray) -> float:
+    """
+    Spread of the angular speed of both feet: about the gyroscope noise at rest, far above it when walking or turning.
+    Freezing usually keeps the legs trembling, above the rest level.
+
+    Args:
+        window (np.ndarray): Rows of 12 IMU values (lwx lwy lwz lax lay laz rwx rwy rwz rax ray raz).
+
+    Returns:
+        float: Standard deviation of the summed gyroscope norms, in raw sensor units.
+    """
+    speed = np.linalg.norm(window[:, 0:3], axis=1) + np.linalg.norm(window[:, 6:9], axis=1)
+    return float(speed.std())
+
+def newest_rows(buffer, n: int) -> np.ndarray:
+    """
+    Args:
+        buffer (DataBuffer): Prediction window.
+        n (int): Number of rows wanted.
+
+    Returns:
+        np.ndarray: The newest 'n' rows of the window (all of them if it holds fewer), which update() takes the motion energy of.
+    """
+    rows = buffer.peek(len(buffer))
+    if rows is None:
+        return np.empty((0, 0))
+    return rows[-n:]
+
+class RateController():
+    """
+    Picks the prediction rate from the motion of the feet and the time the cycles take.
+
+    The rate is one of three levels: 'restRate' while the motion energy is below 'restEnergy' (seated or standing still),
+    'activeRate' while it is above 'activeEnergy' (walking or turning), and 'rate' otherwise.
+    The rate goes up at the first cycle that needs it, and down only once the motion has stayed lower for 'hold' seconds.
+    Whatever the motion, the rate is lowered at once while the average cycle takes more than 'deadline' of its period.
+    Rates are rounded to a whole number of samples per cycle.
+
+    The label predicted is not used: the models take a still sensor for a freeze, so the rest rate would never be reached.
+    A freeze starting from rest is still predicted within 1 / 'restRate' seconds, and trembling raises the rate.
+    """
+    def __init__(self, sampleRate: float, rate: float, restRate: float, activeRate: float, restEnergy: float, activeEnergy: float,
+            hold: float, deadline: float = 0.7, adapt: float = 0.2):
+        """
+        Initialises RateController
+
+        Args:
+            sampleRate (float): Samples per second of the stream.
+            rate (float): Predictions per second normally, also the starting rate.
+            restRate (float): Predictions per second at rest.
+            activeRate (float): Predictions per second when walking or turning.
+            restEnergy (float): Motion energy below which the feet are at rest.
+            activeEnergy (float): Motion energy above which the feet are walking or turning.
+            hold (float): Seconds the motion must stay lower before the rate is lowered.
+            deadline (float, optional): Share of the period the average cycle may take. Defaults to 0.7.
+            adapt (float, optional): Weight of each cycle time in the average. Defaults to 0.2.
+        """
+        self.sampleRate = sampleRate
+        self.levels = sorted(set((restRate, rate, activeRate)))
+        self.normalRate = rate
+        self.restRate = restRate
+        self.activeRate = activeRate
+        self.restEnergy = restEnergy
+        self.activeEnergy = activeEnergy
+        self.hold = hold
+        self.deadline = deadline
+        self.adapt = adapt
+        self.step = self._step(rate)
+        self.energy = None
+        self.cycleTime = None
+        self.lowerSince = None
+        self.reason = None
+
+    def _step(self, rate: float) -> int:
+        return max(1, int(round(self.sampleRate / rate)))
+
+    @property
+    def rate(self) -> float:
+        return self.sampleRate / self.step
+
+    @property
+    def period(self) -> float:
+        return self.step / self.sampleRate
+
+    def update(self, window: np.ndarray, cycleTime: float, t: float) -> bool:
+        """
+        Picks the rate of the next cycles after a prediction.
+
+        Args:
+            window (np.ndarray): Newest rows of the window, over which the motion energy is taken.
+            cycleTime (float): Seconds the cycle took.
+            t (float): Time of the cycle.
+
+        Returns:
+            bool: Whether the rate changed, the reason is then in 'reason'.
+        """
+        self.cycleTime = cycleTime if self.cycleTime is None else self.cycleTime + self.adapt * (cycleTime - self.cycleTime)
+        if len(window) > 1:
+            self.energy = motion_energy(window)
+
+        if self.energy is None:
+            wanted, reason = self.normalRate, MOTION
+        elif self.energy > self.activeEnergy:
+            wanted, reason = self.activeRate, ACTIVE
+        elif self.energy < self.restEnergy:
+            wanted, reason = self.restRate, REST
+        else:
+            wanted, reason = self.normalRate, MOTION
+
+        # Less motion lowers the rate only once it has lasted
+        if self._step(wanted) <= self.step:
+            self.lowerSince = None
+        else:
+            if self.lowerSince is None:
+                self.lowerSince = t
+            if t - self.lowerSince < self.hold:
+                wanted = self.rate
+
+        # The highest level at or below the one wanted that the cycles have time for
+        for level in reversed(self.levels):
+            if self._step(level) >= self._step(wanted) and (self.cycleTime <= self.deadline / level or level == self.levels[0]):
+                if self._step(level) > self._step(wanted):
+                    reason = DEADLINE
+                step = self._step(level)
+                break
+        if step == self.step:
+            return False
+        self.step = step
+        self.reason = reason
+        return True
@@ -0,0 +1,41 @@
+import numpy as np
+
+# Range of step cadences looked for, in steps per minute
+MIN_CADENCE = 60
+MAX_CADENCE = 180
+# Autocorrelation below which the window is not taken as rhythmic walking
+MIN_CORRELATION = 0.3
+
+def estimate_cadence(window, sample_rate, min_cadence=MIN_CADENCE, max_cadence=MAX_CADENCE, min_correlation=MIN_CORRELATION):
+    '''
+    Estimates the step cadence from a gait window, as the period of the autocorrelation peak of the angular speed of both feet.
+    Each step, of either foot, is one swing and so one peak of the summed angular speed.
+
+    window      : Rows of 12 IMU values (lwx lwy lwz lax lay laz rwx rwy rwz rax ray raz)
+    sample_rate : Sample rate of the window (Hz)
+
+    Returns the cadence in steps per minute, or None if the window shows no steady stepping in the range.
+    '''
+    window = np.asarray(window, dtype=float)
+    speed = np.linalg.norm(window[:, 0:3], axis=1) + np.linalg.norm(window[:, 6:9], axis=1)
+    speed -= speed.mean()
+    energy = np.dot(speed, speed)
+    if energy == 0:
+        return None
+
+    n = len(speed)
+    min_lag = max(1, int(sample_rate * 60 / max_cadence))
+    max_lag = min(n // 2, int(np.ceil(sample_rate * 60 / min_cadence)))
+    if max_lag <= min_lag + 1:
+        return None
+    # Autocorrelation normalised by the overlap of each lag, so longer lags are not penalised
+    lags = np.arange(min_lag - 1, max_lag + 2)
+    corr = np.array([np.dot(speed[:-lag], speed[lag:]) / (n - lag) for lag in lags]) * n / energy
+    i = int(np.argmax(corr[1:-1])) + 1
+    if corr[i] < min_correlation or corr[i] < corr[i - 1] or corr[i] < corr[i + 1]:
+        return None
+    # Parabolic interpolation of the peak, for a period finer than a sample
+    a, b, c = corr[i - 1], corr[i], corr[i + 1]
+    denominator = a - 2 * b + c
+    offset = 0.5 * (a - c) / denominator if denominator != 0 else 0.0
+    return 60 * sample_rate / (lags[i] + offset)
@@ -193,11 +193,10 @@ def extract_dwtfeat(wy, ay, az):
     return wy_cA_var, wy_var, ay_cA_mean, az_cD_Kurt
 
 
-def extract_sepfeat(window):
-
-    pred_feat = [] 
-    dect_feat = [] 
-
+def window_columns(window):
+    """
+    Splits a window of rows (lwx lwy lwz lax lay laz rwx rwy rwz rax ray raz) into the lists of its 12 columns, in that order.
+    """
     lax = []; lay = []; laz = []
     lwx = []; lwy = []; lwz = []
 
@@ -219,6 +218,13 @@ def extract_sepfeat(window):
         ray.append(window[i][10])
         raz.append(window[i][11])
 
+    return lwx, lwy, lwz, lax, lay, laz, rwx, rwy, rwz, rax, ray, raz
+
+def extract_pred_feat(columns):
+
+    pred_feat = [] 
+
+    lwx, lwy, lwz, lax, lay, laz, rwx, rwy, rwz, rax, ray, raz = columns
 
     #Extracting FoG Prediction Features
     #Left Leg
@@ -254,12 +260,34 @@ def extract_sepfeat(window):
     pred_feat.append(rax_max) 
     pred_feat.append(ray_min) 
     pred_feat.append(rwy_max) 
-    
+
+    return pred_feat
+
+def extract_freq_feat(columns):
+    """
+    The frequency features of the FoG detection, cheap next to its DWT features.
+
+    Returns:
+        list: (w_fi, wx_lb, wy_lb, wz_lb, a_fi, ax_lb) of the left leg, then of the right leg.
+    """
+    lwx, lwy, lwz, lax, lay, laz, rwx, rwy, rwz, rax, ray, raz = columns
+
+    freq_feat = []
+    freq_feat.append(extract_w_freq(lwx,lwy,lwz) + extract_a_freq(lax,lay,laz))
+    freq_feat.append(extract_w_freq(rwx,rwy,rwz) + extract_a_freq(rax,ray,raz))
+
+    return freq_feat
+
+def extract_dect_feat(columns, freq_feat):
+
+    dect_feat = [] 
+
+    lwx, lwy, lwz, lax, lay, laz, rwx, rwy, rwz, rax, ray, raz = columns
+
     #Extracting FoG Detetion Features
     #Left_Leg
-    w_fi, wx_lb, wy_lb, wz_lb = extract_w_freq(lwx,lwy,lwz)
+    w_fi, wx_lb, wy_lb, wz_lb, a_fi, ax_lb = freq_feat[0]
     wy_cA_var, wy_var, ay_cA_mean, az_cD_Kurt = extract_dwtfeat(lwy, lay, laz)
-    a_fi, ax_lb = extract_a_freq(lax,lay,laz)
     dect_feat.append(wy_lb)
     dect_feat.append(w_fi)
     dect_feat.append(wy_cA_var)
@@ -272,9 +300,8 @@ def extract_sepfeat(window):
     dect_feat.append(ax_lb)
     
     #Right_leg
-    w_fi, wx_lb, wy_lb, wz_lb = extract_w_freq(rwx,rwy,rwz)
+    w_fi, wx_lb, wy_lb, wz_lb, a_fi, ax_lb = freq_feat[1]
     wy_cA_var, wy_var, ay_cA_mean, az_cD_Kurt = extract_dwtfeat(rwy, ray, raz)
-    a_fi, ax_lb = extract_a_freq(rax,ray,raz)
     dect_feat.append(wy_lb)
     dect_feat.append(w_fi)
     dect_feat.append(wy_cA_var)
@@ -286,5 +313,12 @@ def extract_sepfeat(window):
     dect_feat.append(wx_lb)
     dect_feat.append(ax_lb)
 
+    return dect_feat
+
+def extract_sepfeat(window):
+
+    columns = window_columns(window)
+    pred_feat = extract_pred_feat(columns)
+    dect_feat = extract_dect_feat(columns, extract_freq_feat(columns))
 
-    return pred_feat, dect_feat
\ No newline at end of file
+    return pred_feat, dect_feat
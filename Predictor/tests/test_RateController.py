@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+
+#
+#   Tests of the adaptive prediction rate (lib/RateController.py)
+#
+#   Usage (from the repository root):
+#       python3 -m pytest Predictor/tests
+#
+
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.DataBuffer import DataBuffer
+from lib.RateController import RateController, newest_rows, ACTIVE
+
+SAMPLE_RATE = 50
+WIN_SIZE = 256
+MOTION_SAMPLES = 50
+
+def walkingStart() -> DataBuffer:
+    # A full window of still feet, then a second of walking
+    window = DataBuffer(WIN_SIZE, 12)
+    window.push_many(np.zeros((WIN_SIZE - MOTION_SAMPLES, 12)))
+    t = np.arange(MOTION_SAMPLES) / SAMPLE_RATE
+    walking = np.zeros((MOTION_SAMPLES, 12))
+    walking[:, 0] = walking[:, 6] = 3000 * np.sin(2 * np.pi * t)
+    window.push_many(walking)
+    return window
+
+def test_newest_rows():
+    window = DataBuffer(WIN_SIZE, 12)
+    window.push_many(np.arange(WIN_SIZE * 2 * 12).reshape(WIN_SIZE * 2, 12))
+    rows = newest_rows(window, MOTION_SAMPLES)
+    assert len(rows) == MOTION_SAMPLES
+    assert np.array_equal(rows, window.peek(WIN_SIZE)[-MOTION_SAMPLES:])
+    assert rows[-1, 0] == (WIN_SIZE * 2 - 1) * 12
+
+def test_newest_rows_short_window():
+    window = DataBuffer(WIN_SIZE, 12)
+    assert len(newest_rows(window, MOTION_SAMPLES)) == 0
+    window.push_many(np.ones((10, 12)))
+    assert len(newest_rows(window, MOTION_SAMPLES)) == 10
+
+def test_rate_follows_newest_motion():
+    # The walking start is in the newest rows only, the rate must rise at the first cycle
+    controller = RateController(SAMPLE_RATE, 10, 2, 25, 60.0, 600.0, 3.0)
+    assert controller.update(newest_rows(walkingStart(), MOTION_SAMPLES), 0.001, 0.0)
+    assert controller.reason == ACTIVE
+    assert controller.rate == 25
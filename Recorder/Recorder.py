@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+
+#
+#   Session recorder
+#   Connects SUB sockets to DATA_SOCK and REMOTE_DATA_SOCK, PREDICT_SOCK and BTN_SOCK
+#   Appends the IMU samples, and optionally the predictions and button presses, to chunked session files (see lib/SessionFile.py)
+#
+
+import zmq
+import sys
+import logging
+import numpy as np
+sys.path.append("..")
+import config
+from DataProvider.lib.IMUValue import IMU_DTYPE, GAIT_DTYPE, decodeBlock
+from common.log import setupLogging
+from common.tracing import now, parseSampleTail, PREDICT_TRACE_LEN
+from common.metrics import registry, startMetrics
+from common.profiler import installProfiler
+from common.heartbeat import startHeartbeat, setReady, beat
+from lib.SessionFile import SessionWriter
+
+# Records of the non-IMU streams. 'time' is when the recorder received the message.
+PREDICT_DTYPE = np.dtype([("time", "<f8"), ("state", "<f4")] + [(f, "<f8") for f in ("tAcq", "tPub", "tStart", "tFeat", "tInfer", "tPredPub")])
+BUTTON_DTYPE = np.dtype([("time", "<f8"), ("presses", "<i4")])
+
+POLL_TIMEOUT = 1000 # ms
+
+log = logging.getLogger("Recorder")
+
+def parseSample(fields: list, tRecv: float) -> np.ndarray:
+    """
+    Converts a text format sample to a record: 13 values (both feet and ground truth) to GAIT_DTYPE, 9 values (one IMU) to IMU_DTYPE.
+    The acquisition time is taken from the trace, or is the receive time if the sample carries none.
+
+    Args:
+        fields (list): Values of the sample, followed by the trace timestamps if any and the sequence number.
+        tRecv (float): Time the sample was received.
+
+    Returns:
+        np.ndarray: Single record.
+    """
+    # At most 9 values, 2 timestamps and the sequence number for a single IMU
+    n = 13 if len(fields) >= 13 else 9
+    values = [float(f) for f in fields[:n]]
+    tAcq, tPub, seq = parseSampleTail(fields[n:])
+    if tAcq is None:
+        tAcq = tPub = tRecv
+    seq = 0 if seq is None else seq
+    if n == 13:
+        return np.array([tuple(values) + (tAcq, tPub, seq)], dtype=GAIT_DTYPE)
+    return np.array([tuple(values) + (tAcq, seq)], dtype=IMU_DTYPE)
+
+def parseData(frames: list, tRecv: float) -> tuple:
+    """
+    Converts an IMU topic message to records, in either DATA_MSG_FORMAT:
+    text    : "<topic> <values...>", or multipart [topic, sample, sample, ...] from the RemoteIMU
+    binary  : multipart [topic, records]. A single GAIT_DTYPE record on the local IMU topic (FULLPublisher), IMU_DTYPE records otherwise.
+
+    Returns:
+        tuple: (topic, records)
+    """
+    if config.DATA_MSG_FORMAT == "binary":
+        topic, payload = frames[0].decode(), frames[1]
+        dtype = GAIT_DTYPE if topic == config.LOCAL_IMU_TOPIC and len(payload) == GAIT_DTYPE.itemsize else IMU_DTYPE
+        return topic, decodeBlock(payload, dtype)
+
+    if len(frames) == 1:
+        fields = frames[0].decode().split()
+        return fields[0], parseSample(fields[1:], tRecv)
+    return frames[0].decode(), np.concatenate([parseSample(f.decode().split(), tRecv) for f in frames[1:]])
+
+def parsePrediction(frames: list, tRecv: float) -> np.ndarray:
+    fields = frames[0].decode().split()
+    trace = [float(f) for f in fields[2:2 + PREDICT_TRACE_LEN]]
+    trace += [float("nan")] * (PREDICT_TRACE_LEN - len(trace))
+    return np.array([(tRecv, float(fields[1])) + tuple(trace)], dtype=PREDICT_DTYPE)
+
+def parseButton(frames: list, tRecv: float) -> np.ndarray:
+    fields = frames[0].decode().split()
+    return np.array([(tRecv, int(fields[1]))], dtype=BUTTON_DTYPE)
+
+def setupSub(context: zmq.Context, sockAddrs: list, topics: list) -> zmq.Socket:
+    sub = context.socket(zmq.SUB)
+    for addr in sockAddrs:
+        sub.connect(addr)
+    for topic in topics:
+        sub.setsockopt_string(zmq.SUBSCRIBE, topic)
+    return sub
+
+def record(writer: SessionWriter):
+    context = zmq.Context()
+    # Socket -> (parser, stream name or None to use the topic of the message)
+    subs = {setupSub(context, [config.DATA_SOCK, config.REMOTE_DATA_SOCK], [config.LOCAL_IMU_TOPIC, config.REMOTE_IMU_TOPIC]): (parseData, None)}
+    if config.RECORD_PREDICTIONS:
+        subs[setupSub(context, [config.PREDICT_SOCK], [config.PREDICT_TOPIC])] = (parsePrediction, config.PREDICT_TOPIC)
+    if config.RECORD_BUTTONS:
+        subs[setupSub(context, [config.BTN_SOCK], [config.BTN_TOPIC])] = (parseButton, config.BTN_TOPIC)
+
+    poller = zmq.Poller()
+    for sub in subs:
+        poller.register(sub, zmq.POLLIN)
+
+    registry.gauge("recorder.bytes_written", lambda: writer.bytesWritten)
+    registry.gauge("recorder.raw_bytes", lambda: writer.rawBytes)
+    registry.gauge("recorder.fsyncs", lambda: writer.fsyncs)
+    counters = {}
+    path = writer.path
+    log.info("Recording to %s", path)
+    setReady()
+
+    try:
+        while True:
+            beat("record")
+            for sub, _ in poller.poll(POLL_TIMEOUT):
+                frames = sub.recv_multipart()
+                parser, stream = subs[sub]
+                try:
+                    result = parser(frames, now())
+                except (ValueError, IndexError) as e:
+                    log.warning("Dropped malformed message %s: %s", frames[:2], e)
+                    continue
+                if stream is None:
+                    stream, records = result
+                else:
+                    records = result
+                writer.append(stream, records)
+                if stream not in counters:
+                    counters[stream] = registry.counter("msgs_in." + stream)
+                counters[stream].inc()
+
+            writer.poll()
+            if writer.path != path:
+                path = writer.path
+                log.info("Recording to %s", path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+        stats = writer.getStats()
+        log.info("Wrote %d records in %d chunks, %d bytes (%.1f%% of raw)", stats["rowsWritten"], stats["chunksWritten"],
+            stats["bytesWritten"], 100.0 * stats["bytesWritten"] / max(1, stats["rawBytes"]))
+        context.destroy()
+
+if __name__ == "__main__":
+    setupLogging("Recorder")
+    startMetrics("Recorder")
+    installProfiler("Recorder")
+    startHeartbeat("Recorder")
+    writer = SessionWriter(config.RECORDER_FOLDER, config.RECORDER_PREFIX, config.RECORDER_CHUNK_ROWS, config.RECORDER_FLUSH_INTERVAL,
+        config.RECORDER_FSYNC_INTERVAL, config.RECORDER_ROTATE_BYTES, config.RECORDER_ROTATE_SECONDS, config.RECORDER_COMPRESS_LEVEL)
+    record(writer)
@@ -0,0 +1,302 @@
+#!/usr/bin/python3
+
+"""
+Chunked columnar session file.
+
+File layout:
+    FILE_HEADER     magic, creation time
+    chunk*          CHUNK_HEADER, stream name, dtype (JSON), payload
+
+A chunk holds consecutive records of one stream (a NumPy structured array). The payload stores the array column by column,
+which keeps similar values together and lets zlib compress them well even at its fastest level.
+The chunk header holds the time range of its records, so a reader can find a time range by scanning the headers only.
+
+Chunks are only ever appended and each carries its own CRC, so a file cut short by a crash or power loss stays readable up to its last complete chunk.
+"""
+
+import json
+import os
+import struct
+import time
+import zlib
+import numpy as np
+
+MAGIC = b"FOGSESS1"
+FILE_HEADER = struct.Struct("<8sd")
+CHUNK_MAGIC = b"CHNK"
+# magic, flags, name length, dtype length, rows, payload length, first time, last time, payload CRC32
+CHUNK_HEADER = struct.Struct("<4sBxHIIIddI")
+FLAG_ZLIB = 0x01
+# Field used as the time of a record, the first one present in the stream's dtype.
+TIME_FIELDS = ("time", "timestamp", "tAcq")
+EXTENSION = ".fog"
+
+def timeField(dtype: np.dtype) -> str:
+    for f in TIME_FIELDS:
+        if dtype.names is not None and f in dtype.names:
+            return f
+    return None
+
+def encodeColumns(records: np.ndarray) -> bytes:
+    return b"".join(np.ascontiguousarray(records[name]).tobytes() for name in records.dtype.names)
+
+def decodeColumns(payload: bytes, dtype: np.dtype, rows: int) -> np.ndarray:
+    records = np.empty(rows, dtype=dtype)
+    offset = 0
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        size = field.itemsize * rows
+        records[name] = np.frombuffer(payload, dtype=field, count=rows, offset=offset)
+        offset += size
+    return records
+
+class SessionWriter():
+    """
+    Appends records of any number of streams to session files.
+
+    Records are collected per stream and written as one chunk once 'chunkRows' have been collected, or the oldest has waited 'flushInterval' seconds.
+    The file is fsync'ed at most once every 'fsyncInterval' seconds, so the SD card sees a few large writes instead of one per sample.
+    A new file is started once the current one is 'rotateBytes' large or 'rotateSeconds' old.
+    """
+    def __init__(self, folder: str, prefix: str, chunkRows: int = 500, flushInterval: float = 5.0, fsyncInterval: float = 30.0,
+            rotateBytes: int = 256 * 2**20, rotateSeconds: float = 3600.0, compressLevel: int = 1):
+        """
+        Initialises SessionWriter
+
+        Args:
+            folder (str): Folder the files are written to, created if needed.
+            prefix (str): File name prefix. Files are named "<prefix>_<start time>_<part>.fog".
+            chunkRows (int, optional): Records per chunk. Defaults to 500.
+            flushInterval (float, optional): Maximum seconds a record waits before its chunk is written. Defaults to 5.0.
+            fsyncInterval (float, optional): Minimum seconds between fsyncs. Defaults to 30.0.
+            rotateBytes (int, optional): File size after which a new file is started. Defaults to 256 MiB.
+            rotateSeconds (float, optional): File age after which a new file is started. Defaults to 3600.0.
+            compressLevel (int, optional): zlib level of the chunk payloads, 0 to store them uncompressed. Defaults to 1.
+        """
+        self.folder = folder
+        self.prefix = prefix
+        self.chunkRows = chunkRows
+        self.flushInterval = flushInterval
+        self.fsyncInterval = fsyncInterval
+        self.rotateBytes = rotateBytes
+        self.rotateSeconds = rotateSeconds
+        self.compressLevel = compressLevel
+        self.sessionStart = time.strftime("%d%m%Y_%H%M%S")
+        self.part = 0
+        self.file = None
+        self.path = None
+        # Per stream: list of pending record arrays, number of pending records, time the oldest arrived
+        self.pending = {}
+        # Statistics
+        self.chunksWritten = 0
+        self.rowsWritten = 0
+        self.rawBytes = 0
+        self.bytesWritten = 0
+        self.fsyncs = 0
+        self.files = []
+
+        os.makedirs(folder, exist_ok=True)
+        self._open()
+
+    def _open(self):
+        self.path = os.path.join(self.folder, "%s_%s_%03d%s" % (self.prefix, self.sessionStart, self.part, EXTENSION))
+        self.file = open(self.path, "wb")
+        self.file.write(FILE_HEADER.pack(MAGIC, time.time()))
+        self.fileSize = FILE_HEADER.size
+        self.opened = time.monotonic()
+        self.lastSync = time.monotonic()
+        self.files.append(self.path)
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.lastSync = time.monotonic()
+        self.fsyncs += 1
+
+    def _rotate(self):
+        self._sync()
+        self.file.close()
+        self.part += 1
+        self._open()
+
+    def append(self, stream: str, records: np.ndarray):
+        """
+        Adds records to a stream. All records of a stream must have the same dtype.
+
+        Args:
+            stream (str): Name of the stream, e.g. the topic the records came from.
+            records (np.ndarray): Structured array of records, or a single record.
+        """
+        records = np.atleast_1d(records)
+        if stream not in self.pending:
+            self.pending[stream] = [[], 0, time.monotonic()]
+        entry = self.pending[stream]
+        if entry[1] == 0:
+            entry[2] = time.monotonic()
+        entry[0].append(records)
+        entry[1] += len(records)
+        if entry[1] >= self.chunkRows:
+            self._flushStream(stream)
+
+    def poll(self):
+        """
+        Writes the chunks that have waited long enough, and fsyncs and rotates the file when due. Call this regularly, e.g. once a second.
+        """
+        now = time.monotonic()
+        for stream, entry in self.pending.items():
+            if entry[1] > 0 and now - entry[2] >= self.flushInterval:
+                self._flushStream(stream)
+        if now - self.lastSync >= self.fsyncInterval:
+            self._sync()
+        if self.fileSize >= self.rotateBytes or now - self.opened >= self.rotateSeconds:
+            self._rotate()
+
+    def _flushStream(self, stream: str):
+        entry = self.pending[stream]
+        records = np.concatenate(entry[0]) if len(entry[0]) > 1 else entry[0][0]
+        entry[0] = []
+        entry[1] = 0
+        self.writeChunk(stream, records)
+
+    def writeChunk(self, stream: str, records: np.ndarray):
+        """
+        Writes records as one chunk, bypassing the pending records of the stream.
+        """
+        payload = encodeColumns(records)
+        self.rawBytes += len(payload)
+        flags = 0
+        if self.compressLevel > 0:
+            payload = zlib.compress(payload, self.compressLevel)
+            flags |= FLAG_ZLIB
+
+        tField = timeField(records.dtype)
+        t0, t1 = (float(records[tField][0]), float(records[tField][-1])) if tField is not None else (float("nan"), float("nan"))
+        name = stream.encode()
+        descr = json.dumps(records.dtype.descr).encode()
+        header = CHUNK_HEADER.pack(CHUNK_MAGIC, flags, len(name), len(descr), len(records), len(payload), t0, t1, zlib.crc32(payload))
+        self.file.write(header + name + descr + payload)
+
+        size = len(header) + len(name) + len(descr) + len(payload)
+        self.fileSize += size
+        self.bytesWritten += size
+        self.chunksWritten += 1
+        self.rowsWritten += len(records)
+
+    def close(self):
+        for stream in self.pending:
+            if self.pending[stream][1] > 0:
+                self._flushStream(stream)
+        self._sync()
+        self.file.close()
+
+    def getStats(self) -> dict:
+        """
+        Returns:
+            dict: Chunks, records and bytes written, raw (uncompressed) bytes, fsyncs and the current file.
+        """
+        return {
+            "chunksWritten": self.chunksWritten,
+            "rowsWritten": self.rowsWritten,
+            "rawBytes": self.rawBytes,
+            "bytesWritten": self.bytesWritten,
+            "fsyncs": self.fsyncs,
+            "file": self.path,
+        }
+
+class ChunkInfo():
+    __slots__ = ("stream", "offset", "flags", "dtype", "rows", "length", "t0", "t1", "crc")
+
+    def __init__(self, stream, offset, flags, dtype, rows, length, t0, t1, crc):
+        self.stream = stream
+        self.offset = offset # Of the payload
+        self.flags = flags
+        self.dtype = dtype
+        self.rows = rows
+        self.length = length
+        self.t0 = t0
+        self.t1 = t1
+        self.crc = crc
+
+class SessionReader():
+    """
+    Reads back a session file written by SessionWriter.
+
+    Opening the file only scans the chunk headers, payloads are read when a stream is read.
+    A truncated last chunk (e.g. after a power loss) is ignored.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        magic, self.created = FILE_HEADER.unpack(self.file.read(FILE_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a session file" % path)
+        self.chunks = []
+        self.truncated = False
+        self._scan()
+
+    def _scan(self):
+        size = os.fstat(self.file.fileno()).st_size
+        offset = FILE_HEADER.size
+        while offset + CHUNK_HEADER.size <= size:
+            self.file.seek(offset)
+            magic, flags, nameLen, descrLen, rows, length, t0, t1, crc = CHUNK_HEADER.unpack(self.file.read(CHUNK_HEADER.size))
+            if magic != CHUNK_MAGIC:
+                self.truncated = True
+                return
+            end = offset + CHUNK_HEADER.size + nameLen + descrLen + length
+            if end > size:
+                self.truncated = True
+                return
+            name = self.file.read(nameLen).decode()
+            dtype = np.dtype([tuple(d) for d in json.loads(self.file.read(descrLen))])
+            self.chunks.append(ChunkInfo(name, end - length, flags, dtype, rows, length, t0, t1, crc))
+            offset = end
+
+    def streams(self) -> dict:
+        """
+        Returns:
+            dict: Number of records of every stream in the file.
+        """
+        counts = {}
+        for c in self.chunks:
+            counts[c.stream] = counts.get(c.stream, 0) + c.rows
+        return counts
+
+    def readChunk(self, chunk: ChunkInfo) -> np.ndarray:
+        self.file.seek(chunk.offset)
+        payload = self.file.read(chunk.length)
+        if zlib.crc32(payload) != chunk.crc:
+            raise ValueError("CRC mismatch in chunk of '%s' at offset %d of %s" % (chunk.stream, chunk.offset, self.path))
+        if chunk.flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        return decodeColumns(payload, chunk.dtype, chunk.rows)
+
+    def read(self, stream: str, t0: float = None, t1: float = None) -> np.ndarray:
+        """
+        Reads the records of a stream, optionally only those with a time between 't0' and 't1'.
+
+        Returns:
+            np.ndarray: Structured array of the records, oldest first. None if the stream is not in the file.
+        """
+        parts = []
+        for c in self.chunks:
+            if c.stream != stream:
+                continue
+            if (t0 is not None and c.t1 < t0) or (t1 is not None and c.t0 > t1):
+                continue
+            records = self.readChunk(c)
+            tField = timeField(records.dtype)
+            if tField is not None and (t0 is not None or t1 is not None):
+                keep = np.ones(len(records), dtype=bool)
+                if t0 is not None:
+                    keep &= records[tField] >= t0
+                if t1 is not None:
+                    keep &= records[tField] <= t1
+                records = records[keep]
+            parts.append(records)
+        if len(parts) == 0:
+            return None
+        return np.concatenate(parts)
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+
+#
+#   Session file reader
+#   Prints the streams of session files written by Recorder.py, and optionally exports one stream to CSV
+#
+#   Usage:
+#       python3 readSession.py <file.fog> [<file.fog> ...] [--export <stream> <out.csv>]
+#
+
+import argparse
+import numpy as np
+from lib.SessionFile import SessionReader
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise session files and export their streams.")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--export", nargs=2, metavar=("STREAM", "CSV"), help="Write the records of a stream (of all files, in order) to a CSV file.")
+    args = parser.parse_args()
+
+    exported = []
+    for path in args.files:
+        reader = SessionReader(path)
+        print("%s%s" % (path, " (truncated)" if reader.truncated else ""))
+        for stream, rows in reader.streams().items():
+            chunks = [c for c in reader.chunks if c.stream == stream]
+            stored = sum(c.length for c in chunks)
+            print("  %-12s %8d records %5d chunks %10d bytes stored (%.1f bytes/record)  %.3f -> %.3f" % (stream, rows, len(chunks), stored,
+                stored / max(1, rows), chunks[0].t0, chunks[-1].t1))
+        if args.export is not None:
+            records = reader.read(args.export[0])
+            if records is not None:
+                exported.append(records)
+        reader.close()
+
+    if args.export is not None:
+        if len(exported) == 0:
+            print("No '%s' records found" % args.export[0])
+        else:
+            records = np.concatenate(exported)
+            names = records.dtype.names
+            np.savetxt(args.export[1], np.column_stack([records[n] for n in names]), delimiter=",", header=",".join(names), comments="", fmt="%.6f")
+            print("Exported %d records to %s" % (len(records), args.export[1]))
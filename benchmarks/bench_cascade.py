@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+#
+#   Cascade prediction benchmark
+#   Predicts every window of recorded sessions at TEST_RATE through both paths of the Predictor: the full one (all features,
+#   both models) and the cascade one (Predictor/lib/CascadeGate.py first, skipping the DWT features and the FoG model for
+#   the windows it tells are walking), and compares their labels and the time of their cycles.
+#
+#   Usage (from the repository root):
+#       python3 benchmarks/bench_cascade.py [--sessions replay.npy ...] [--repeat 3] [--output results.json]
+#
+#   Without --sessions, the recorded trials in DataProvider/mock_data are replayed.
+#
+
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "Predictor"))
+import config
+from lib.CascadeGate import CascadeGate
+import lib.utils as utils
+from bench_rate import Models, loadSessions, GT
+
+def combine(preFoG: int, fog: int) -> float:
+    # As Predictor.py combines the outputs of its models
+    if fog == 1:
+        return 1
+    return 0.5 if preFoG == 2 else 0
+
+def fullPath(models: Models, window: np.ndarray) -> float:
+    pred, dect = utils.extract_sepfeat(window)
+    preFoG = models.clf_P.predict(models.scl_P.transform(np.array([pred])))[0]
+    fog = models.clf_D.predict(models.scl_D.transform(np.array([dect])))[0]
+    return combine(preFoG, fog)
+
+def cascadePath(models: Models, gate: CascadeGate, window: np.ndarray) -> tuple:
+    """
+    Returns:
+        tuple: (label, whether the gate told the window was walking).
+    """
+    columns = utils.window_columns(window)
+    pred = utils.extract_pred_feat(columns)
+    freq = utils.extract_freq_feat(columns)
+    walking = gate.isWalking(freq)
+    preFoG = models.clf_P.predict(models.scl_P.transform(np.array([pred])))[0]
+    if walking:
+        return combine(preFoG, 0), True
+    dect = utils.extract_dect_feat(columns, freq)
+    fog = models.clf_D.predict(models.scl_D.transform(np.array([dect])))[0]
+    return combine(preFoG, fog), False
+
+def timeCall(fn, repeat: int) -> tuple:
+    # Smallest time of the repeats, the others are slowed down by whatever else runs
+    best = None
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+    return result, best
+
+def run(rows: np.ndarray, models: Models, gate: CascadeGate, repeat: int) -> dict:
+    step = int(config.SAMPLE_RATE / config.TEST_RATE)
+    full, cascade, walking, gt, fullTimes, cascadeTimes = [], [], [], [], [], []
+    for end in range(config.WIN_SIZE, len(rows) + 1, step):
+        window = rows[end - config.WIN_SIZE:end, :12]
+        label, t = timeCall(lambda: fullPath(models, window), repeat)
+        full.append(label)
+        fullTimes.append(t)
+        (label, skipped), t = timeCall(lambda: cascadePath(models, gate, window), repeat)
+        cascade.append(label)
+        walking.append(skipped)
+        cascadeTimes.append(t)
+        gt.append(rows[end - 1, GT])
+    return {key: np.array(value) for key, value in (("full", full), ("cascade", cascade), ("walking", walking), ("gt", gt),
+        ("fullTimes", fullTimes), ("cascadeTimes", cascadeTimes))}
+
+def share(mask: np.ndarray, of: np.ndarray) -> float:
+    return float(np.mean(mask[of])) if np.any(of) else None
+
+def summary(r: dict) -> dict:
+    fog = r["gt"] > 0
+    return {
+        "cycles": len(r["full"]),
+        "walking": float(np.mean(r["walking"])),
+        "full_ms": float(np.mean(r["fullTimes"]) * 1e3),
+        "cascade_ms": float(np.mean(r["cascadeTimes"]) * 1e3),
+        "full_p99_ms": float(np.percentile(r["fullTimes"], 99) * 1e3),
+        "cascade_p99_ms": float(np.percentile(r["cascadeTimes"], 99) * 1e3),
+        "saving": float(1.0 - np.sum(r["cascadeTimes"]) / np.sum(r["fullTimes"])),
+        "walking_saving": float(1.0 - np.sum(r["cascadeTimes"][r["walking"]]) / np.sum(r["fullTimes"][r["walking"]]))
+            if np.any(r["walking"]) else None,
+        "agreement": float(np.mean(r["full"] == r["cascade"])),
+        # Sensitivity: FoG labels on the windows ending in FoG, and FoG labels of the full path kept
+        "fog_recall_full": share(r["full"] == 1, fog),
+        "fog_recall_cascade": share(r["cascade"] == 1, fog),
+        "fog_kept": share(r["cascade"] == 1, r["full"] == 1),
+        "prefog_kept": share(r["cascade"] == 0.5, r["full"] == 0.5),
+        "fog_walking": int(np.sum(r["walking"] & fog)),
+    }
+
+def percent(v: float) -> str:
+    return "-" if v is None else "%.1f%%" % (v * 100)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Labels and cycle time of the cascade prediction against the full one.")
+    parser.add_argument("--sessions", nargs="+", help="GAIT_DTYPE .npy files to replay (see DataProvider/convertReplay.py).")
+    parser.add_argument("--repeat", type=int, default=3, help="Times each path is timed on each window, the fastest is kept.")
+    parser.add_argument("--output", help="Write results to this JSON file.")
+    args = parser.parse_args()
+
+    models = Models()
+    results = []
+    print("Gate: freeze index < %g, acceleration freeze index < %g, locomotion power > %g" % (config.GATE_MAX_FI,
+        config.GATE_MAX_ACC_FI, config.GATE_MIN_POWER))
+    print("%-18s %7s %8s %8s %8s %8s %8s %9s %11s %11s %9s %9s %9s" % ("session", "cycles", "walking", "full ms", "casc ms",
+        "p99 full", "p99 casc", "saving", "agreement", "recall full", "recall", "fog kept", "pre kept"))
+    for name, rows in loadSessions(args.sessions):
+        gate = CascadeGate(config.GATE_MAX_FI, config.GATE_MAX_ACC_FI, config.GATE_MIN_POWER)
+        r = summary(run(rows, models, gate, args.repeat))
+        r["session"] = name
+        results.append(r)
+        print("%-18s %7d %8s %8.2f %8.2f %8.2f %8.2f %9s %11s %11s %9s %9s %9s" % (name[:18], r["cycles"], percent(r["walking"]),
+            r["full_ms"], r["cascade_ms"], r["full_p99_ms"], r["cascade_p99_ms"], percent(r["saving"]), percent(r["agreement"]),
+            percent(r["fog_recall_full"]), percent(r["fog_recall_cascade"]), percent(r["fog_kept"]), percent(r["prefog_kept"])))
+        print("    Cycles told walking: %s shorter" % percent(r["walking_saving"]))
+        if r["fog_walking"] > 0:
+            print("    %d windows ending in FoG told walking by the gate" % r["fog_walking"])
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"time": time.time(), "gate": [config.GATE_MAX_FI, config.GATE_MAX_ACC_FI, config.GATE_MIN_POWER],
+                "results": results}, f, indent=2)
+        print("Results written to", args.output)
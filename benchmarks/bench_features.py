@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+
+#
+#   Feature extraction micro-benchmark
+#   Times extract_sepfeat and the feature primitives of every Predictor variant
+#   on synthetic or recorded (WIN_SIZE x 12) windows.
+#
+#   Usage (from the repository root):
+#       python3 benchmarks/bench_features.py [--source synthetic|recorded] [--output results.json] [--compare baseline.json]
+#
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+import config
+from DataProvider.lib.IMUValue import gaitToRows
+from DataProvider.lib.DatasetCache import DatasetCache, findTrials
+
+VARIANTS = ["Predictor", "8Feat_Predictor", "9Feat_Predictor", "OptFeat_Predictor"]
+RECORDED_FOLDER = os.path.join(ROOT, "DataProvider", config.MOCK_DATA_FOLDER, "Test_data")
+
+# Column indices in a window, matching the order published by the DataProvider.
+LWX, LWY, LWZ, LAX, LAY, LAZ = range(6)
+
+def loadUtils(variant: str):
+    """
+    Imports lib/utils.py of a Predictor variant under a unique module name, as every variant names it the same.
+    """
+    path = os.path.join(ROOT, variant, "lib", "utils.py")
+    spec = importlib.util.spec_from_file_location(variant + "_utils", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def syntheticWindows(n: int, winSize: int, seed: int = 0) -> list:
+    """
+    Gait-like windows: a ~1 Hz stride plus a weaker ~5 Hz tremor and noise, at the scale of the raw sensor values.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(winSize) / config.SAMPLE_RATE
+    windows = []
+    for i in range(n):
+        phase = rng.uniform(0, 2 * np.pi, 12)
+        stride = np.sin(2 * np.pi * 1.0 * t[:, None] + phase)
+        tremor = 0.3 * np.sin(2 * np.pi * 5.0 * t[:, None] + phase)
+        scale = np.array([500.0] * 3 + [4000.0] * 3 + [500.0] * 3 + [4000.0] * 3)
+        windows.append((stride + tremor + 0.1 * rng.standard_normal((winSize, 12))) * scale)
+    return windows
+
+def recordedWindows(n: int, winSize: int, stepSize: int) -> list:
+    """
+    Sliding windows over the recorded left (s2) and right (s3) foot trials in the mock data.
+    """
+    trials = findTrials(RECORDED_FOLDER)
+    if len(trials) == 0:
+        raise FileNotFoundError("No s2/s3 trial in %s" % RECORDED_FOLDER)
+    cache = DatasetCache(os.path.join(ROOT, "DataProvider", config.DATASET_CACHE_FOLDER), config.DATASET_CACHE_HASH)
+    data = gaitToRows(cache.loadTrial(trials[0][1], trials[0][2]))[:, :12]
+    rows = len(data)
+    windows = []
+    for start in range(0, rows - winSize + 1, stepSize):
+        windows.append(data[start:start + winSize])
+        if len(windows) == n:
+            break
+    return windows
+
+def toInput(window: np.ndarray, kind: str):
+    # The Predictor hands extract_sepfeat a list of row lists.
+    return window.tolist() if kind == "list" else window
+
+def cases(utils, window) -> dict:
+    """
+    Builds the callables to time for one variant, all operating on the same window.
+    """
+    cols = list(zip(*window)) if isinstance(window, list) else window.T
+    wx, wy, wz, ax, ay, az = (list(cols[i]) if isinstance(window, list) else cols[i] for i in (LWX, LWY, LWZ, LAX, LAY, LAZ))
+    return {
+        "extract_sepfeat": lambda: utils.extract_sepfeat(window),
+        "extract_w_freq": lambda: utils.extract_w_freq(wx, wy, wz),
+        "extract_a_freq": lambda: utils.extract_a_freq(ax, ay, az),
+        "extract_dwtfeat": lambda: utils.extract_dwtfeat(wy, ay, az),
+        "extract_min_max": lambda: utils.extract_min_max(ay),
+        "extract_rms": lambda: utils.extract_rms(window, LAY),
+        "extract_std": lambda: utils.extract_std(window, LAY),
+        "extract_std_welford": lambda: utils.extract_std_welford(window, LAY),
+    }
+
+def percentile(sortedTimes: list, p: float) -> float:
+    return sortedTimes[min(len(sortedTimes) - 1, int(p / 100.0 * len(sortedTimes)))]
+
+def timeCase(fns: list, repeat: int, warmup: int) -> dict:
+    """
+    Times a case over every window, 'repeat' times, and measures its memory allocations in a separate traced pass.
+
+    Args:
+        fns (list): One callable per window.
+
+    Returns:
+        dict: Timing percentiles (seconds) and tracemalloc peak/retained bytes per call.
+    """
+    for fn in fns[:warmup]:
+        fn()
+
+    times = []
+    for r in range(repeat):
+        for fn in fns:
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+    times.sort()
+
+    # Allocation pass, kept separate as tracing slows every allocation down.
+    peaks = []
+    retained = []
+    tracemalloc.start()
+    for fn in fns[:min(len(fns), 20)]:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        result = fn()
+        current, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - base)
+        retained.append(current - base)
+        del result
+    tracemalloc.stop()
+
+    return {
+        "n": len(times),
+        "mean": sum(times) / len(times),
+        "min": times[0],
+        "p50": percentile(times, 50),
+        "p90": percentile(times, 90),
+        "p99": percentile(times, 99),
+        "max": times[-1],
+        "peak_bytes": int(np.median(peaks)),
+        "retained_bytes": int(np.median(retained)),
+    }
+
+def compare(results: dict, baselinePath: str, threshold: float) -> int:
+    """
+    Prints the p50 change of every case against a previous results file.
+
+    Returns:
+        int: Number of cases that got slower by more than 'threshold' (fraction).
+    """
+    with open(baselinePath) as f:
+        baseline = json.load(f)["results"]
+
+    regressions = 0
+    print("\n%-20s %-22s %10s %10s %8s" % ("variant", "case", "base p50", "p50", "change"))
+    for variant, caseResults in results.items():
+        for name, r in caseResults.items():
+            b = baseline.get(variant, {}).get(name)
+            if b is None:
+                continue
+            change = r["p50"] / b["p50"] - 1.0
+            flag = ""
+            if change > threshold:
+                flag = " REGRESSION"
+                regressions += 1
+            print("%-20s %-22s %8.1fus %8.1fus %+7.1f%%%s" % (variant, name, b["p50"] * 1e6, r["p50"] * 1e6, change * 100, flag))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Feature extraction micro-benchmark for every Predictor variant.")
+    parser.add_argument("--source", choices=["synthetic", "recorded"], default="synthetic", help="Where the windows come from.")
+    parser.add_argument("--input", choices=["list", "array"], default="list", help="Window type handed to the features (the Predictor uses lists of rows).")
+    parser.add_argument("--windows", type=int, default=50, help="Number of distinct windows.")
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over the windows per case.")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed calls before timing.")
+    parser.add_argument("--variants", nargs="+", default=VARIANTS, choices=VARIANTS)
+    parser.add_argument("--output", help="Write results to this JSON file.")
+    parser.add_argument("--compare", help="Compare against a previous JSON results file.")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Slowdown (fraction of p50) reported as a regression.")
+    args = parser.parse_args()
+
+    winSize = config.WIN_SIZE
+    stepSize = int(config.SAMPLE_RATE / config.TEST_RATE)
+    if args.source == "synthetic":
+        windows = syntheticWindows(args.windows, winSize)
+    else:
+        windows = recordedWindows(args.windows, winSize, stepSize)
+    windows = [toInput(w, args.input) for w in windows]
+
+    budget = 1.0 / config.TEST_RATE
+    print("%d %s windows of %d x 12 (%s), cycle budget %.0f ms" % (len(windows), args.source, winSize, args.input, budget * 1e3))
+
+    results = {}
+    for variant in args.variants:
+        utils = loadUtils(variant)
+        perWindow = [cases(utils, w) for w in windows]
+        results[variant] = {}
+        print("\n== %s" % variant)
+        print("%-22s %9s %9s %9s %9s %10s %8s" % ("case", "p50 us", "p90 us", "p99 us", "max us", "peak KiB", "budget"))
+        for name in perWindow[0]:
+            r = timeCase([c[name] for c in perWindow], args.repeat, args.warmup)
+            results[variant][name] = r
+            print("%-22s %9.1f %9.1f %9.1f %9.1f %10.1f %7.2f%%" % (name, r["p50"] * 1e6, r["p90"] * 1e6, r["p99"] * 1e6, r["max"] * 1e6, r["peak_bytes"] / 1024.0, r["p50"] / budget * 100))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({
+                "time": time.time(),
+                "machine": platform.machine(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "source": args.source,
+                "input": args.input,
+                "win_size": winSize,
+                "results": results,
+            }, f, indent=2)
+        print("\nResults written to", args.output)
+
+    if args.compare is not None:
+        if compare(results, args.compare, args.threshold) > 0:
+            sys.exit(1)
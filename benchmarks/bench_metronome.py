@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+#
+#   Metronome timing benchmark
+#   Runs the Feedback cue engine headless with the metronome ticking, and a plain sleep loop ticking at the same tempo,
+#   and reports how far the ticks are from a steady beat.
+#
+#   Usage (from the repository root):
+#       python3 benchmarks/bench_metronome.py [--tempo 100] [--duration 30] [--loads 0 1] [--output results.json]
+#
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "Feedback"))
+import config
+from AudioCue import CueEngine
+
+STOP_SOUND = os.path.join(ROOT, "Feedback", config.SOUNDS_FOLDER, config.STOP_SOUND_PATH)
+
+class CaptureSink():
+    """
+    Keeps the audio written to it, and the time each period was written.
+    """
+    def open(self, fmt):
+        self.chunks = []
+        self.times = []
+
+    def write(self, data: bytes):
+        self.times.append(time.monotonic())
+        self.chunks.append(data)
+
+    def close(self):
+        pass
+
+def busy(stop: threading.Event):
+    # Pure Python work, competing for the interpreter with the audio thread as the other Feedback threads do
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+def playTimes(writeTimes: np.ndarray, period: float) -> np.ndarray:
+    """
+    Models the audio device: each period is played once the previous one has been, or once it is written if the output ran dry.
+    """
+    played = np.empty(len(writeTimes))
+    played[0] = writeTimes[0]
+    for i in range(1, len(writeTimes)):
+        played[i] = max(played[i - 1] + period, writeTimes[i])
+    return played
+
+def tickOnsets(pcm: np.ndarray) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: Frames at which a tick starts in a stream that is silent between the ticks.
+    """
+    loud = np.abs(pcm).max(axis=1) > 0
+    frames = np.flatnonzero(loud)
+    if len(frames) == 0:
+        return frames
+    # A tick starts after a gap of silence longer than any zero crossing within it
+    return frames[np.concatenate(([True], np.diff(frames) > 50))]
+
+def stats(name: str, load: int, errors: np.ndarray, intervals: np.ndarray, interval: float, extra: dict = None) -> dict:
+    ioi = np.abs(intervals - interval)
+    r = {
+        "method": name,
+        "load": load,
+        "ticks": len(errors),
+        "jitter_std": float(np.std(intervals)),
+        "ioi_error_max": float(ioi.max()),
+        "deviation_max": float(np.abs(errors).max()),
+        "drift": float(errors[-1]),
+    }
+    r.update(extra or {})
+    return r
+
+def runEngine(tempo: float, duration: float, period: float, lead: int, load: int) -> dict:
+    sink = CaptureSink()
+    engine = CueEngine(sink, period, lead)
+    engine.load("stop", STOP_SOUND)
+    engine.loadClick("tick")
+    stop = threading.Event()
+    workers = [threading.Thread(target=busy, args=(stop,), daemon=True) for i in range(load)]
+    for w in workers:
+        w.start()
+    engine.start()
+    engine.startMetronome("tick", tempo)
+    time.sleep(duration)
+    engine.shutdown.set()
+    engine.join()
+    stop.set()
+
+    fmt = engine.format
+    pcm = np.frombuffer(b"".join(sink.chunks), dtype="<i2").reshape(-1, fmt.channels)
+    onsets = tickOnsets(pcm)
+    # Time each tick is heard: the time its period is played plus its offset in the period
+    framesPerPeriod = int(period * fmt.rate)
+    played = playTimes(np.array(sink.times), period)
+    heard = played[onsets // framesPerPeriod] + (onsets % framesPerPeriod) / fmt.rate
+    interval = 60.0 / tempo
+    errors = heard - (heard[0] + np.arange(len(heard)) * interval)
+    lateness = np.array(sink.times) - (sink.times[0] + (np.arange(len(sink.times)) - lead) * period)
+    lateness = lateness[lead:]
+    return stats("engine", load, errors, np.diff(heard), interval, {
+        "stream_error_max": float(np.abs(np.diff(onsets) / fmt.rate - interval).max()),
+        "lateness_p99": float(np.percentile(lateness, 99)),
+        "lateness_max": float(lateness.max()),
+        "underruns": int(np.sum(np.diff(played) > period + 1e-9)),
+    })
+
+def runSleepLoop(tempo: float, duration: float, load: int) -> dict:
+    # A tick every interval by sleeping between ticks, as a metronome without an audio clock would
+    stop = threading.Event()
+    workers = [threading.Thread(target=busy, args=(stop,), daemon=True) for i in range(load)]
+    for w in workers:
+        w.start()
+    interval = 60.0 / tempo
+    ticks = []
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        ticks.append(time.monotonic())
+        time.sleep(interval)
+    stop.set()
+    ticks = np.array(ticks)
+    errors = ticks - (ticks[0] + np.arange(len(ticks)) * interval)
+    return stats("sleep loop", load, errors, np.diff(ticks), interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Timing of the Feedback metronome against a sleep loop.")
+    parser.add_argument("--tempo", type=float, default=config.METRONOME_TEMPO, help="Beats per minute.")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per run.")
+    parser.add_argument("--loads", type=int, nargs="+", default=[0, 1], help="Busy threads running alongside, per run.")
+    parser.add_argument("--period", type=float, default=config.AUDIO_PERIOD)
+    parser.add_argument("--lead", type=int, default=config.AUDIO_LEAD)
+    parser.add_argument("--max-jitter", type=float, default=0.01, help="Largest deviation (s) of an engine tick from the beat allowed.")
+    parser.add_argument("--output", help="Write results to this JSON file.")
+    args = parser.parse_args()
+
+    results = []
+    print("%-10s %4s %6s %10s %11s %11s %10s %10s %9s" % ("method", "load", "ticks", "std ms", "ioi max ms", "dev max ms", "drift ms", "late p99", "underrun"))
+    for load in args.loads:
+        for r in (runEngine(args.tempo, args.duration, args.period, args.lead, load), runSleepLoop(args.tempo, args.duration, load)):
+            results.append(r)
+            late = "%8.1f" % (r["lateness_p99"] * 1e3) if "lateness_p99" in r else "%8s" % "-"
+            underruns = "%9d" % r["underruns"] if "underruns" in r else "%9s" % "-"
+            print("%-10s %4d %6d %10.3f %11.3f %11.3f %10.3f %s %s" % (r["method"], r["load"], r["ticks"], r["jitter_std"] * 1e3,
+                r["ioi_error_max"] * 1e3, r["deviation_max"] * 1e3, r["drift"] * 1e3, late, underruns))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"time": time.time(), "tempo": args.tempo, "results": results}, f, indent=2)
+        print("Results written to", args.output)
+
+    worst = max(r["deviation_max"] for r in results if r["method"] == "engine")
+    if worst > args.max_jitter:
+        print("Engine ticks deviated up to %.1f ms from the beat (limit %.1f ms)" % (worst * 1e3, args.max_jitter * 1e3))
+        sys.exit(1)
@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+
+#
+#   End-to-end pipeline throughput benchmark
+#   Runs the real Predictor between a synthetic DataProvider and a stub Feedback subscriber,
+#   on the sockets from config.py (DATA_SOCK, PREDICT_SOCK, PREDICT_READY_SOCK).
+#
+#   Usage (from the repository root):
+#       python3 benchmarks/bench_pipeline.py [--rates 50 200 800 0] [--win-sizes 100 200] [--test-rates 10] [--formats plain traced binary]
+#
+#   A rate of 0 publishes as fast as possible.
+#
+
+import argparse
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+import zmq
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+import config
+from DataProvider.lib.IMUValue import GAIT_DTYPE, GAIT_FIELDS, encodeBlock
+
+FORMATS = ["plain", "traced", "binary"]
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def procStats(pid: int) -> tuple:
+    """
+    Reads the CPU time and resident memory of a process from /proc.
+
+    Returns:
+        tuple: (cpu seconds, rss bytes), or (None, None) where /proc is not available.
+    """
+    try:
+        with open("/proc/%d/stat" % pid) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # Fields after the command name: utime and stime are the 12th and 13th, rss the 22nd.
+        cpu = (int(fields[11]) + int(fields[12])) / CLK_TCK
+        rss = int(fields[21]) * PAGE_SIZE
+        return cpu, rss
+    except (OSError, IndexError, ValueError):
+        return None, None
+
+class StubFeedback(threading.Thread):
+    """
+    Subscribes to the predictions and records the time each one arrived.
+    """
+    def __init__(self, context: zmq.Context):
+        threading.Thread.__init__(self, daemon=True)
+        self.shutdown = threading.Event()
+        self.sub = context.socket(zmq.SUB)
+        self.sub.connect(config.PREDICT_SOCK)
+        self.sub.setsockopt_string(zmq.SUBSCRIBE, config.PREDICT_TOPIC)
+        self.arrivals = []
+
+    def run(self):
+        while not self.shutdown.isSet():
+            if self.sub.poll(100, zmq.POLLIN) & zmq.POLLIN:
+                self.sub.recv()
+                self.arrivals.append(time.time())
+        self.sub.close()
+
+def startPredictor(overrides: dict) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["FOG_CONFIG"] = json.dumps(overrides)
+    return subprocess.Popen([sys.executable, "Predictor.py"], cwd=os.path.join(ROOT, "Predictor"), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def waitReady(context: zmq.Context, timeout: float) -> bool:
+    client = context.socket(zmq.REQ)
+    client.setsockopt(zmq.LINGER, 0)
+    client.connect(config.PREDICT_READY_SOCK)
+    client.send(b"Ready?")
+    ready = (client.poll(int(timeout * 1000), zmq.POLLIN) & zmq.POLLIN) != 0
+    if ready:
+        client.recv()
+    client.close()
+    return ready
+
+def syntheticSamples(n: int) -> np.ndarray:
+    t = np.arange(n) / config.SAMPLE_RATE
+    signal = np.sin(2 * np.pi * 1.0 * t)[:, None] * np.array([500] * 3 + [4000] * 3 + [500] * 3 + [4000] * 3)
+    return np.hstack((signal, np.zeros((n, 1)))).astype(int)
+
+def run(pub: zmq.Socket, context: zmq.Context, winSize: int, testRate: int, fmt: str, rate: float, duration: float, maxSamples: int) -> dict:
+    """
+    Runs a fresh Predictor with the given configuration and publishes synthetic samples to it at 'rate' Hz.
+
+    Returns:
+        dict: Throughput, latency percentiles (sample sent -> prediction received), drops and the CPU/RSS of the Predictor
+              and of this process (the stand-in DataProvider and Feedback).
+    """
+    overrides = {
+        "WIN_SIZE": winSize,
+        "TEST_RATE": testRate,
+        "TRACE_ENABLED": fmt == "traced",
+        "DATA_MSG_FORMAT": "binary" if fmt == "binary" else "text",
+        "METRICS_ENABLED": False,
+        "LOG_LEVELS": {"Predictor": "WARNING"},
+    }
+    stepSize = int(config.SAMPLE_RATE / testRate)
+    proc = startPredictor(overrides)
+    stub = StubFeedback(context)
+    stub.start()
+    try:
+        if not waitReady(context, 60):
+            raise RuntimeError("Predictor did not become ready")
+        time.sleep(0.5) # Let the SUB sockets finish connecting.
+
+        n = maxSamples if rate == 0 else min(maxSamples, int(rate * duration))
+        samples = syntheticSamples(n)
+        fields = " %i" * 13
+        if fmt == "binary":
+            records = np.zeros(n, dtype=GAIT_DTYPE)
+            for i, f in enumerate(GAIT_FIELDS + ("gt",)):
+                records[f] = samples[:, i]
+            records["seq"] = np.arange(n)
+        sendTimes = np.empty(n)
+        cpu0, _ = procStats(proc.pid)
+        benchCpu0, _ = procStats(os.getpid())
+        t0 = time.time()
+        for i in range(n):
+            if rate > 0:
+                # Absolute deadlines, so pacing errors do not accumulate.
+                delay = t0 + i / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            if fmt == "binary":
+                tSend = time.time()
+                records[i]["tAcq"] = records[i]["tPub"] = tSend
+                pub.send_multipart([config.LOCAL_IMU_TOPIC.encode(), encodeBlock(records[i:i + 1])])
+            else:
+                msg = config.LOCAL_IMU_TOPIC + fields % tuple(samples[i])
+                tSend = time.time()
+                if fmt == "traced":
+                    msg += " %.6f %.6f" % (tSend, tSend)
+                pub.send_string(msg + " %d" % i)
+            sendTimes[i] = tSend
+        tEnd = time.time()
+
+        # Give the Predictor time to drain what is still buffered.
+        expected = max(0, n // stepSize - math.ceil(winSize / stepSize) + 1)
+        deadline = time.time() + 5.0
+        while len(stub.arrivals) < expected and time.time() < deadline:
+            time.sleep(0.05)
+        cpu1, rss = procStats(proc.pid)
+        benchCpu1, benchRss = procStats(os.getpid())
+    finally:
+        stub.shutdown.set()
+        stub.join()
+        proc.kill()
+        proc.wait()
+
+    # Predictions are produced in order, prediction i is made on the window ending with sample (ceil(WIN/STEP) + i) * STEP - 1.
+    arrivals = np.array(stub.arrivals[:expected])
+    newest = (math.ceil(winSize / stepSize) + np.arange(len(arrivals))) * stepSize - 1
+    latency = np.sort(arrivals - sendTimes[newest]) if len(arrivals) > 0 else np.array([float("nan")])
+    elapsed = tEnd - t0
+    return {
+        "win_size": winSize,
+        "test_rate": testRate,
+        "format": fmt,
+        "target_rate": rate,
+        "samples": n,
+        "send_rate": n / elapsed,
+        "predictions": len(stub.arrivals),
+        "expected": expected,
+        "dropped": max(0, expected - len(stub.arrivals)),
+        "latency_p50": float(np.percentile(latency, 50)),
+        "latency_p90": float(np.percentile(latency, 90)),
+        "latency_p99": float(np.percentile(latency, 99)),
+        "latency_max": float(latency[-1]),
+        "predictor_cpu": None if cpu0 is None else (cpu1 - cpu0) / elapsed,
+        "predictor_rss": rss,
+        "bench_cpu": None if benchCpu0 is None else (benchCpu1 - benchCpu0) / elapsed,
+        "bench_rss": benchRss,
+    }
+
+def sustainable(r: dict, maxLatency: float, maxDropRatio: float) -> bool:
+    return r["expected"] > 0 and r["dropped"] <= maxDropRatio * r["expected"] and r["latency_p99"] <= maxLatency
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmark of the Predictor with stand-in DataProvider and Feedback.")
+    parser.add_argument("--rates", type=float, nargs="+", default=[50, 100, 200, 400, 800, 1600, 0], help="Sample rates (Hz) to try, 0 for as fast as possible.")
+    parser.add_argument("--win-sizes", type=int, nargs="+", default=[config.WIN_SIZE])
+    parser.add_argument("--test-rates", type=int, nargs="+", default=[config.TEST_RATE])
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=FORMATS)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of data to publish per rate.")
+    parser.add_argument("--max-samples", type=int, default=20000, help="Cap on samples per run (used as is for rate 0).")
+    parser.add_argument("--max-latency", type=float, default=0.5, help="p99 latency (s) above which a rate is not sustainable.")
+    parser.add_argument("--max-drop", type=float, default=0.01, help="Fraction of missing predictions above which a rate is not sustainable.")
+    parser.add_argument("--output", help="Write results to this JSON file.")
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    pub = context.socket(zmq.PUB)
+    pub.setsockopt(zmq.SNDHWM, 0) # Never drop on our side, backlog shows up as latency instead.
+    pub.bind(config.DATA_SOCK)
+
+    results = []
+    summary = []
+    print("%5s %5s %-7s %8s %9s %6s %7s %9s %9s %9s %6s %8s" % ("win", "rate", "format", "target", "sent Hz", "preds", "dropped", "p50 ms", "p99 ms", "max ms", "cpu", "rss MiB"))
+    for winSize, testRate, fmt in itertools.product(args.win_sizes, args.test_rates, args.formats):
+        best = None
+        for rate in args.rates:
+            r = run(pub, context, winSize, testRate, fmt, rate, args.duration, args.max_samples)
+            results.append(r)
+            print("%5d %5d %-7s %8s %9.1f %6d %7d %9.1f %9.1f %9.1f %5.0f%% %8.1f" % (winSize, testRate, fmt, "max" if rate == 0 else "%g" % rate,
+                r["send_rate"], r["predictions"], r["dropped"], r["latency_p50"] * 1e3, r["latency_p99"] * 1e3, r["latency_max"] * 1e3,
+                (r["predictor_cpu"] or 0) * 100, (r["predictor_rss"] or 0) / 2**20))
+            if sustainable(r, args.max_latency, args.max_drop) and (best is None or r["send_rate"] > best):
+                best = r["send_rate"]
+        summary.append({"win_size": winSize, "test_rate": testRate, "format": fmt, "max_sustainable_rate": best})
+
+    print()
+    for s in summary:
+        rate = "none" if s["max_sustainable_rate"] is None else "%.0f Hz" % s["max_sustainable_rate"]
+        print("WIN_SIZE=%d TEST_RATE=%d %s: max sustainable sample rate %s (deployed SAMPLE_RATE is %d Hz)" % (s["win_size"], s["test_rate"], s["format"], rate, config.SAMPLE_RATE))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"time": time.time(), "results": results, "summary": summary}, f, indent=2)
+        print("Results written to", args.output)
+
+    pub.close()
+    context.term()
@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+
+#
+#   Adaptive prediction rate benchmark
+#   Replays recorded sessions through the Predictor's feature extraction and models, once at the fixed TEST_RATE and once at the
+#   rate picked by Predictor/lib/RateController.py, and compares their CPU time, labels and FoG detection.
+#
+#   Usage (from the repository root):
+#       python3 benchmarks/bench_rate.py [--sessions replay.npy ...] [--rest 30] [--output results.json]
+#
+#   Without --sessions, the recorded trials in DataProvider/mock_data are replayed.
+#
+
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from joblib import load
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "Predictor"))
+import config
+from DataProvider.lib.IMUValue import gaitToRows
+from DataProvider.lib.DatasetCache import DatasetCache, findTrials
+from DataProvider.lib.ReplaySource import ReplaySource
+from lib.RateController import RateController
+import lib.utils as utils
+
+RECORDED_FOLDER = os.path.join(ROOT, "DataProvider", config.MOCK_DATA_FOLDER, "Test_data")
+GT = 12
+
+class Models():
+    """
+    The Pre-FoG and FoG models of the Predictor, combined into one label as Predictor.py does.
+    """
+    def __init__(self):
+        path = lambda p: os.path.join(ROOT, "Predictor", p)
+        self.scl_D = load(path(config.SCL_D_JOBLIB_PATH))
+        self.clf_D = load(path(config.MLP_D_JOBLIB_PATH))
+        self.scl_P = load(path(config.SCL_P_JOBLIB_PATH))
+        self.clf_P = load(path(config.MLP_P_JOBLIB_PATH))
+
+    def predict(self, window: np.ndarray) -> float:
+        pred, dect = utils.extract_sepfeat(window)
+        preFoG = self.clf_P.predict(self.scl_P.transform(np.array([pred])))[0]
+        fog = self.clf_D.predict(self.scl_D.transform(np.array([dect])))[0]
+        if fog == 1:
+            return 1
+        return 0.5 if preFoG == 2 else 0
+
+def loadSessions(paths: list) -> list:
+    """
+    Returns:
+        list: (name, rows) of every session, rows as returned by gaitToRows().
+    """
+    if paths:
+        return [(os.path.basename(p), gaitToRows(ReplaySource(p).read(len(ReplaySource(p))))) for p in paths]
+    cache = DatasetCache(os.path.join(ROOT, "DataProvider", config.DATASET_CACHE_FOLDER), config.DATASET_CACHE_HASH)
+    trials = findTrials(RECORDED_FOLDER)
+    if len(trials) == 0:
+        raise FileNotFoundError("No s2/s3 trial in %s" % RECORDED_FOLDER)
+    return [(name, gaitToRows(cache.loadTrial(left, right))) for name, left, right in trials]
+
+def withRest(rows: np.ndarray, seconds: float, seed: int = 0) -> np.ndarray:
+    """
+    Prepends a still period, e.g. seated: the first sample held with sensor noise, labelled Walk.
+    """
+    n = int(seconds * config.SAMPLE_RATE)
+    if n == 0:
+        return rows
+    rng = np.random.default_rng(seed)
+    rest = np.repeat(rows[:1], n, axis=0)
+    for c in range(12):
+        # Gyroscope noise around zero, accelerometer noise around the posture held
+        rest[:, c] = (0 if c % 6 < 3 else rest[0, c]) + rng.normal(0, 5 if c % 6 < 3 else 20, n)
+    rest[:, GT] = 0
+    return np.vstack((rest, rows))
+
+def replay(rows: np.ndarray, models: Models, controller: RateController) -> dict:
+    """
+    Runs the prediction cycles over a session as the Predictor would, the samples arriving at SAMPLE_RATE.
+
+    Returns:
+        dict: Time of the newest sample (s), label and rate of every cycle, and the CPU time of the cycles.
+    """
+    winSize = config.WIN_SIZE
+    motionSamples = int(config.MOTION_WINDOW * config.SAMPLE_RATE)
+    times, labels, rates = [], [], []
+    cpu = 0.0
+    changes = []
+    end = controller.step
+    while end <= len(rows):
+        if end >= winSize:
+            window = rows[end - winSize:end, :12]
+            t = end / config.SAMPLE_RATE
+            c0 = time.process_time()
+            t0 = time.perf_counter()
+            label = models.predict(window)
+            cycleTime = time.perf_counter() - t0
+            rate = controller.rate
+            if controller.update(window[-motionSamples:], cycleTime, t):
+                changes.append((t, controller.rate, controller.reason))
+            cpu += time.process_time() - c0
+            times.append(t)
+            labels.append(label)
+            rates.append(rate)
+        end += controller.step
+    return {"times": np.array(times), "labels": np.array(labels), "rates": np.array(rates), "cpu": cpu, "changes": changes}
+
+def labelsAt(run: dict, ticks: np.ndarray) -> np.ndarray:
+    # Label in force at each tick: the last one predicted at or before it
+    i = np.searchsorted(run["times"], ticks, side="right") - 1
+    return np.where(i >= 0, run["labels"][np.maximum(i, 0)], 0)
+
+def onsetDelays(gt: np.ndarray, labels: np.ndarray, ticks: np.ndarray) -> list:
+    """
+    Returns:
+        list: Seconds from each FoG onset of the ground truth to the first FoG label during that episode, None if missed.
+    """
+    delays = []
+    fog = gt > 0
+    starts = np.flatnonzero(fog & ~np.concatenate(([False], fog[:-1])))
+    for s in starts:
+        e = s
+        while e < len(fog) and fog[e]:
+            e += 1
+        hits = np.flatnonzero(labels[s:e] == 1)
+        delays.append(float(ticks[s + hits[0]] - ticks[s]) if len(hits) > 0 else None)
+    return delays
+
+def summary(name: str, rows: np.ndarray, run: dict, reference: dict, ticks: np.ndarray) -> dict:
+    duration = len(rows) / config.SAMPLE_RATE
+    labels = labelsAt(run, ticks)
+    refLabels = labelsAt(reference, ticks)
+    gt = rows[np.minimum((ticks * config.SAMPLE_RATE).astype(int) - 1, len(rows) - 1), GT]
+    delays = onsetDelays(gt, labels, ticks)
+    detected = [d for d in delays if d is not None]
+    # Share of the session spent at each rate: cycles at that rate times their period
+    shares = {"%g" % r: float(np.sum(run["rates"] == r) / r / duration) for r in np.unique(run["rates"])}
+    return {
+        "run": name,
+        "cycles": len(run["times"]),
+        "cpu": run["cpu"],
+        "cpu_per_min": run["cpu"] / duration * 60,
+        "saving": 1.0 - run["cpu"] / reference["cpu"],
+        "agreement": float(np.mean(labels == refLabels)),
+        "fog_recall": float(np.mean(labels[gt > 0] == 1)) if np.any(gt > 0) else None,
+        "fog_kept": float(np.mean(labels[refLabels == 1] == 1)) if np.any(refLabels == 1) else None,
+        "onsets_detected": "%d/%d" % (len(detected), len(delays)),
+        "onset_delay": float(np.mean(detected)) if detected else None,
+        "rate_changes": len(run["changes"]),
+        "time_at_rate": shares,
+    }
+
+def percent(v: float) -> str:
+    return "-" if v is None else "%.1f%%" % (v * 100)
+
+def fixedController() -> RateController:
+    return RateController(config.SAMPLE_RATE, config.TEST_RATE, config.TEST_RATE, config.TEST_RATE, 0, np.inf, np.inf, np.inf)
+
+def adaptiveController() -> RateController:
+    return RateController(config.SAMPLE_RATE, config.TEST_RATE, config.REST_RATE, config.ACTIVE_RATE, config.REST_ENERGY,
+        config.ACTIVE_ENERGY, config.RATE_HOLD, config.RATE_DEADLINE)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPU time and labels of the adaptive prediction rate against the fixed TEST_RATE.")
+    parser.add_argument("--sessions", nargs="+", help="GAIT_DTYPE .npy files to replay (see DataProvider/convertReplay.py).")
+    parser.add_argument("--rest", type=float, default=30.0, help="Seconds of stillness prepended to each session, as the trials have none.")
+    parser.add_argument("--verbose", action="store_true", help="Print every rate change.")
+    parser.add_argument("--output", help="Write results to this JSON file.")
+    args = parser.parse_args()
+
+    models = Models()
+    results = []
+    print("%-18s %-9s %7s %9s %8s %9s %9s %9s %8s %10s  %s" % ("session", "run", "cycles", "cpu s/min", "saving", "agreement", "fog recall",
+        "fog kept", "onsets", "delay s", "time at rate (Hz: share)"))
+    for name, rows in loadSessions(args.sessions):
+        rows = withRest(rows, args.rest)
+        fixed = replay(rows, models, fixedController())
+        adaptive = replay(rows, models, adaptiveController())
+        ticks = np.arange(1, int(len(rows) / config.SAMPLE_RATE * config.TEST_RATE) + 1) / config.TEST_RATE
+        ticks = ticks[ticks >= config.WIN_SIZE / config.SAMPLE_RATE]
+        for runName, run in (("fixed", fixed), ("adaptive", adaptive)):
+            r = summary(runName, rows, run, fixed, ticks)
+            r["session"] = name
+            results.append(r)
+            print("%-18s %-9s %7d %9.3f %7.1f%% %8.1f%% %9s %9s %8s %10s  %s" % (name[:18], runName, r["cycles"], r["cpu_per_min"],
+                r["saving"] * 100, r["agreement"] * 100, percent(r["fog_recall"]), percent(r["fog_kept"]), r["onsets_detected"],
+                "-" if r["onset_delay"] is None else "%.2f" % r["onset_delay"],
+                ", ".join("%s: %.0f%%" % (k, v * 100) for k, v in r["time_at_rate"].items())))
+            if args.verbose and runName == "adaptive":
+                for t, rate, reason in run["changes"]:
+                    print("    %7.2f s  -> %5.1f Hz (%s)" % (t, rate, reason))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"time": time.time(), "rest": args.rest, "results": results}, f, indent=2)
+        print("Results written to", args.output)
@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+
+import logging
+import threading
+import sys
+import zmq
+sys.path.append("..")
+import config
+
+POLL_TIMEOUT = 100 # ms
+
+# Kinds of the messages published by the BLE manager, second frame after the role
+NOTIFICATION = b"n"
+STATE = b"s"
+
+class BleClient(threading.Thread):
+    """
+    Consumer side of the BLE manager (BleManager/BleManager.py) for one peripheral: receives its notifications and
+    connection state from BLE_NOTIFY_SOCK, and sends it writes through BLE_WRITE_SOCK.
+
+    Message formats:
+        BLE_NOTIFY_SOCK : [role, NOTIFICATION, data, tRecv] and [role, STATE, b"1" | b"0"]
+        BLE_WRITE_SOCK  : [role, key, value], key naming a characteristic of the peripheral (e.g. "vib")
+    """
+    def __init__(self, role: str, onNotification, connectedEvent: threading.Event = None):
+        """
+        Initialises BleClient
+
+        Args:
+            role (str): Role of the peripheral in BLE_DEVICES, e.g. "wrist".
+            onNotification (callable): Called with the data of each notification and the time the manager received it.
+            connectedEvent (threading.Event, optional): Set while the manager is connected to the peripheral.
+        """
+        threading.Thread.__init__(self)
+        self.role = role
+        self.onNotification = onNotification
+        self.connectedEvent = connectedEvent
+        self.shutdown = threading.Event()
+        self.log = logging.getLogger("ble." + role)
+        self.context = zmq.Context()
+        self.sub = self.context.socket(zmq.SUB)
+        self.sub.connect(config.BLE_NOTIFY_SOCK)
+        self.sub.setsockopt(zmq.SUBSCRIBE, role.encode())
+        self.push = self.context.socket(zmq.PUSH)
+        self.push.connect(config.BLE_WRITE_SOCK)
+        self.pushLock = threading.Lock()
+
+    def run(self):
+        while not self.shutdown.isSet():
+            if self.sub.poll(POLL_TIMEOUT, zmq.POLLIN) == 0:
+                continue
+            frames = self.sub.recv_multipart()
+            # The subscription matches on a prefix, other roles may start with this one
+            if frames[0] != self.role.encode():
+                continue
+            if frames[1] == NOTIFICATION:
+                self.onNotification(frames[2], float(frames[3]))
+            elif frames[1] == STATE and self.connectedEvent is not None:
+                if frames[2] == b"1":
+                    self.connectedEvent.set()
+                else:
+                    self.connectedEvent.clear()
+
+        self.sub.close()
+        self.push.close(linger=0)
+
+    def write(self, key: str, value: bytes):
+        """
+        Sets the value wanted for a characteristic. The manager coalesces the writes and writes them again after a reconnection.
+        """
+        with self.pushLock:
+            try:
+                self.push.send_multipart([self.role.encode(), key.encode(), value], zmq.NOBLOCK)
+            except zmq.Again:
+                self.log.warning("BLE manager not reachable, %s write dropped", key)
@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+
+import json
+import logging
+import os
+import threading
+import time
+import sys
+from bluepy.btle import Peripheral, Scanner, BTLEException
+sys.path.append("..")
+from common.metrics import registry
+
+ADT_COMPLETE_NAME = 0x09
+SCAN_STEP = 0.1 # seconds, between checks of the devices found while scanning
+
+class PeripheralCache():
+    """
+    Last known address, address type and GATT handles of BLE peripherals, kept in a JSON file so they survive restarts.
+
+    Entries are keyed on the role of the peripheral (e.g. "remote_imu", "wrist"), as several may advertise the same name.
+    The file can be shared by several processes, each entry is updated on the latest content of the file.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = self._read()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, role: str) -> dict:
+        """
+        Returns:
+            dict: {"addr", "addrType", "handles", "updated"} of the peripheral, None if unknown.
+        """
+        with self.lock:
+            self.entries = self._read()
+            return self.entries.get(role)
+
+    def otherAddresses(self, role: str) -> set:
+        """
+        Returns:
+            set: Addresses of the peripherals of the other roles, not to be taken for this one when scanning.
+        """
+        with self.lock:
+            return {e["addr"] for r, e in self.entries.items() if r != role}
+
+    def put(self, role: str, addr: str, addrType: str, handles: dict):
+        with self.lock:
+            self.entries = self._read()
+            self.entries[role] = {"addr": addr, "addrType": addrType, "handles": handles, "updated": time.time()}
+            self._write()
+
+    def forget(self, role: str):
+        with self.lock:
+            self.entries = self._read()
+            if self.entries.pop(role, None) is not None:
+                self._write()
+
+    def _write(self):
+        # Written aside then renamed, so a crash never leaves a truncated file
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp, self.path)
+
+def scanFor(name: str, timeout: float, exclude: set = ()):
+    """
+    Scans for a device advertising 'name', stopping as soon as it is found.
+
+    Args:
+        exclude (set, optional): Addresses to ignore, e.g. of other devices advertising the same name.
+
+    Returns:
+        ScanEntry: The device found, None if not found within 'timeout' seconds.
+    """
+    scanner = Scanner()
+    scanner.clear()
+    scanner.start()
+    try:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            scanner.process(SCAN_STEP)
+            for d in scanner.getDevices():
+                if d.getValueText(ADT_COMPLETE_NAME) == name and d.addr not in exclude:
+                    return d
+        return None
+    finally:
+        scanner.stop()
+
+class BleConnector():
+    """
+    Connects to a peripheral: directly at its cached address with its cached GATT handles first, by scanning for its name and
+    discovering its handles only if that fails. A reconnection after a dropout then skips the scan and the GATT discovery.
+
+    The time taken goes to the "<role>.connect_time" histogram, the connections made each way to "<role>.direct_connects"
+    and "<role>.scan_connects".
+    """
+    def __init__(self, role: str, name: str, cache: PeripheralCache, scanTimeout: float, connectAttempts: int = 1, retryInterval: float = 1.0):
+        """
+        Initialises BleConnector
+
+        Args:
+            role (str): Key of the peripheral in the cache, and prefix of the metrics.
+            name (str): Name the peripheral advertises.
+            cache (PeripheralCache): Cache of the addresses and handles.
+            scanTimeout (float): Seconds to scan for the peripheral at most.
+            connectAttempts (int, optional): Attempts to connect to the peripheral once found by scanning. Defaults to 1.
+            retryInterval (float, optional): Seconds between these attempts. Defaults to 1.0.
+        """
+        self.role = role
+        self.name = name
+        self.cache = cache
+        self.scanTimeout = scanTimeout
+        self.connectAttempts = connectAttempts
+        self.retryInterval = retryInterval
+        self.log = logging.getLogger("ble." + role)
+        # Addresses found by scanning that turned out not to be this peripheral, e.g. the other device advertising the same name
+        self.rejected = set()
+        self.connectTime = registry.histogram(role + ".connect_time")
+        self.directConnects = registry.counter(role + ".direct_connects")
+        self.scanConnects = registry.counter(role + ".scan_connects")
+
+    def connect(self, discover, setup) -> tuple:
+        """
+        Makes one connection attempt.
+
+        Args:
+            discover (callable): Called with the Peripheral, returns the dict of GATT handles to cache. Raises BTLEException
+                                 if the peripheral is not the one wanted.
+            setup (callable): Called with the Peripheral and the handles, e.g. to subscribe to notifications.
+
+        Returns:
+            tuple: (Peripheral, handles), or (None, None) if the peripheral was neither reachable directly nor found by scanning.
+        """
+        t0 = time.monotonic()
+        entry = self.cache.get(self.role)
+        if entry is not None:
+            device = None
+            try:
+                device = Peripheral(entry["addr"], entry["addrType"])
+                setup(device, entry["handles"])
+                self.directConnects.inc()
+                self.connectTime.record(time.monotonic() - t0)
+                self.log.info("Reconnected to %s at its cached address %s in %.2f s", self.name, entry["addr"], time.monotonic() - t0)
+                return device, entry["handles"]
+            except BTLEException as e:
+                self.log.info("Direct connection to %s failed (%s), scanning", entry["addr"], e)
+                if device is not None:
+                    # Reachable but the handles did not work, e.g. new firmware: discover them again
+                    try:
+                        handles = discover(device)
+                        setup(device, handles)
+                        self.cache.put(self.role, entry["addr"], entry["addrType"], handles)
+                        self.directConnects.inc()
+                        self.connectTime.record(time.monotonic() - t0)
+                        return device, handles
+                    except BTLEException:
+                        device.disconnect()
+
+        self.log.info("Scanning for %s", self.name)
+        scanEntry = scanFor(self.name, self.scanTimeout, self.cache.otherAddresses(self.role) | self.rejected)
+        if scanEntry is None:
+            # Gives the devices rejected another chance, in case their discovery only failed once
+            self.rejected.clear()
+            return None, None
+        for attempt in range(self.connectAttempts):
+            try:
+                device = Peripheral(scanEntry.addr, scanEntry.addrType)
+                break
+            except BTLEException:
+                if attempt == self.connectAttempts - 1:
+                    raise
+                self.log.info("Connection to %s failed, retrying in %.2f seconds", scanEntry.addr, self.retryInterval)
+                time.sleep(self.retryInterval)
+        try:
+            handles = discover(device)
+        except BTLEException:
+            device.disconnect()
+            self.rejected.add(scanEntry.addr)
+            raise
+        try:
+            setup(device, handles)
+        except BTLEException:
+            device.disconnect()
+            raise
+        self.cache.put(self.role, scanEntry.addr, scanEntry.addrType, handles)
+        self.scanConnects.inc()
+        self.connectTime.record(time.monotonic() - t0)
+        self.log.info("Connected to %s at %s in %.2f s", self.name, scanEntry.addr, time.monotonic() - t0)
+        return device, handles
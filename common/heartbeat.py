@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+
+import logging
+import os
+import threading
+import time
+import sys
+import zmq
+sys.path.append("..")
+import config
+
+# States reported in the heartbeats.
+STARTING = "starting"
+READY = "ready"
+STALLED = "stalled"     # A worker loop has not reported progress for HEARTBEAT_TIMEOUT seconds, see beat()
+
+class HeartbeatPublisher(threading.Thread):
+    """
+    Publishes the state of this process on the heartbeat topic at a fixed interval, and at once when the state changes.
+
+    The heartbeats come from a thread of their own, so on their own they only tell that the process exists. The worker loops of
+    the process report their progress with beat(), and once one of them has not for 'timeout' seconds (dead or hung) the
+    process is reported STALLED, for the supervisor to restart it.
+
+    The PUB socket connects to HEARTBEAT_SOCK, bound by supervisor.py. Without a supervisor the heartbeats are simply dropped.
+    Message format: "<topic> <process> <pid> <state> <time>"
+    """
+    def __init__(self, process: str, sockAddr: str, topic: str, interval: float, timeout: float):
+        threading.Thread.__init__(self, daemon=True)
+        self.shutdown = threading.Event()
+        self.changed = threading.Event()
+        self.process = process
+        self.sockAddr = sockAddr
+        self.topic = topic
+        self.interval = interval
+        self.timeout = timeout
+        self.state = STARTING
+        self.log = logging.getLogger(process + ".heartbeat")
+        # Last progress of each worker loop watched (time.monotonic())
+        self.progress = {}
+        self.progressLock = threading.Lock()
+
+    def beat(self, loop: str):
+        with self.progressLock:
+            self.progress[loop] = time.monotonic()
+
+    def idle(self, loop: str):
+        with self.progressLock:
+            self.progress.pop(loop, None)
+
+    def stalled(self) -> list:
+        """
+        Returns:
+            list: Worker loops that have not reported progress for 'timeout' seconds.
+        """
+        t = time.monotonic()
+        with self.progressLock:
+            return [loop for loop, last in self.progress.items() if t - last > self.timeout]
+
+    def setState(self, state: str):
+        if state != self.state:
+            self.state = state
+            self.changed.set()
+
+    def run(self):
+        context = zmq.Context()
+        publisher = context.socket(zmq.PUB)
+        publisher.setsockopt(zmq.LINGER, 0)
+        publisher.connect(self.sockAddr)
+
+        reported = []
+        while not self.shutdown.is_set():
+            stalled = self.stalled()
+            if stalled != reported:
+                if stalled:
+                    self.log.warning("No progress for %.1f s from %s", self.timeout, ", ".join(stalled))
+                reported = stalled
+            state = STALLED if stalled else self.state
+            publisher.send_string("%s %s %d %s %f" % (self.topic, self.process, os.getpid(), state, time.time()))
+            self.changed.wait(self.interval)
+            self.changed.clear()
+
+        publisher.close()
+
+_heartbeat = None
+
+def startHeartbeat(process: str):
+    """
+    Starts publishing this process' heartbeats, if enabled in config. The process is reported as STARTING until setReady() is called.
+
+    Args:
+        process (str): Name the heartbeats are published under, the component name in SUPERVISOR_COMPONENTS.
+    """
+    global _heartbeat
+    if config.HEARTBEAT_ENABLED and _heartbeat is None:
+        _heartbeat = HeartbeatPublisher(process, config.HEARTBEAT_SOCK, config.HEARTBEAT_TOPIC, config.HEARTBEAT_INTERVAL,
+            config.HEARTBEAT_TIMEOUT)
+        _heartbeat.start()
+        logging.getLogger(process).debug("Publishing heartbeats to %s every %.1f seconds", config.HEARTBEAT_SOCK, config.HEARTBEAT_INTERVAL)
+
+def setReady():
+    """
+    Reports this process as READY: initialised and doing its job, so the components depending on it can be started.
+    """
+    if _heartbeat is not None:
+        _heartbeat.setState(READY)
+
+def beat(loop: str):
+    """
+    Reports progress of a worker loop, to be called at every pass. From its first call on the loop is watched: if it is not
+    called again within HEARTBEAT_TIMEOUT seconds, the process is reported STALLED.
+
+    Args:
+        loop (str): Name of the loop, e.g. "detection".
+    """
+    if _heartbeat is not None:
+        _heartbeat.beat(loop)
+
+def idle(loop: str):
+    """
+    Stops watching a worker loop, until its next beat(): before it blocks for long on purpose, or once it has ended.
+    """
+    if _heartbeat is not None:
+        _heartbeat.idle(loop)
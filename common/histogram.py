@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+
+import threading
+
+class Histogram():
+    """
+    Log-linear bucketed histogram in the style of HdrHistogram.
+
+    Values are recorded as integers in 'unit' (e.g. microseconds for a latency recorded in seconds with unit=1e-6).
+    Each power of two is split into SUB_BUCKETS linear buckets, so any percentile is reported within about 1/SUB_BUCKETS of its true value,
+    while recording stays O(1) and memory stays fixed no matter how many values are recorded.
+    """
+    SUB_BITS = 4
+    SUB_BUCKETS = 1 << SUB_BITS
+    MAX_BITS = 40 # Values above 2^40 units are clamped.
+
+    def __init__(self, unit: float = 1e-6):
+        """
+        Initialises Histogram
+
+        Args:
+            unit (float, optional): Resolution of recorded values. Defaults to 1e-6 (microseconds when recording seconds).
+        """
+        self.unit = unit
+        self.counts = [0] * ((self.MAX_BITS + 1) * self.SUB_BUCKETS)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            for i in range(len(self.counts)):
+                self.counts[i] = 0
+            self.count = 0
+            self.total = 0.0
+            self.min = None
+            self.max = None
+
+    def record(self, value: float):
+        """
+        Records a single value.
+
+        Args:
+            value (float): Value to record, in the same units as 'unit' (negative values are recorded as 0).
+        """
+        if value < 0:
+            value = 0.0
+        index = self._index(int(value / self.unit))
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentile(self, p: float) -> float:
+        """
+        Estimates a percentile of the recorded values.
+
+        Args:
+            p (float): Percentile between 0 and 100.
+
+        Returns:
+            float: Estimated value (upper edge of the bucket the percentile falls in, clamped to the recorded max). None if nothing was recorded.
+        """
+        with self.lock:
+            if self.count == 0:
+                return None
+            target = max(1, int(round(p / 100.0 * self.count)))
+            seen = 0
+            for i, c in enumerate(self.counts):
+                seen += c
+                if seen >= target:
+                    return min(self._upper(i) * self.unit, self.max)
+            return self.max
+
+    def mean(self) -> float:
+        with self.lock:
+            return self.total / self.count if self.count > 0 else None
+
+    def snapshot(self, percentiles: tuple = (50, 90, 99, 99.9)) -> dict:
+        """
+        Summarises the recorded values.
+
+        Args:
+            percentiles (tuple, optional): Percentiles to report. Defaults to (50, 90, 99, 99.9).
+
+        Returns:
+            dict: Count, min, mean, max, the requested percentiles (keyed as "p50", "p99.9", ...) and the unit.
+        """
+        snap = {"count": self.count, "min": self.min, "mean": self.mean(), "max": self.max, "unit": self.unit}
+        for p in percentiles:
+            snap["p%g" % p] = self.percentile(p)
+        return snap
+
+    def _index(self, v: int) -> int:
+        if v < self.SUB_BUCKETS:
+            return v
+        v = min(v, (1 << self.MAX_BITS) - 1)
+        # Keep the top SUB_BITS + 1 bits, the leading one selects the bucket and the rest the linear sub-bucket.
+        shift = v.bit_length() - self.SUB_BITS - 1
+        return (shift + 1) * self.SUB_BUCKETS + (v >> shift) - self.SUB_BUCKETS
+
+    def _upper(self, index: int) -> int:
+        bucket, sub = divmod(index, self.SUB_BUCKETS)
+        if bucket == 0:
+            return sub
+        shift = bucket - 1
+        return ((self.SUB_BUCKETS + sub + 1) << shift) - 1
@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+sys.path.append("..")
+import config
+
+LOG_FORMAT = "%(asctime)s [%(name)s] %(levelname)s: %(message)s"
+
+# Background writer shared by every logger in the process.
+_listener = None
+_handler = None
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks the calling thread.
+
+    If the background writer falls behind and the queue is full, the record is dropped and counted instead.
+    """
+    def __init__(self, q: queue.Queue):
+        logging.handlers.QueueHandler.__init__(self, q)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def getLevel(component: str) -> int:
+    """
+    Looks up the configured log level of a component.
+
+    Args:
+        component (str): Name of the component, e.g. "Predictor".
+
+    Returns:
+        int: Logging level from config.LOG_LEVELS, falling back to config.LOG_LEVEL.
+    """
+    level = config.LOG_LEVELS.get(component, config.LOG_LEVEL)
+    return logging.getLevelName(level) if isinstance(level, str) else level
+
+def setupLogging(component: str, logFile: str = None) -> logging.Logger:
+    """
+    Routes all logging of this process through a queue to a background writer thread and returns the component's logger.
+
+    Hot paths only pay for putting a record on the queue; the terminal (and log file) writes happen on the writer thread.
+    Calling this more than once only adds the component's logger, the writer is set up once.
+
+    Args:
+        component (str): Name of the component, used as the logger name and to look up its level in config.LOG_LEVELS.
+        logFile (str, optional): Also write records to this file. Defaults to None.
+
+    Returns:
+        logging.Logger: Logger for the component. Child loggers ("<component>.<name>") inherit its level.
+    """
+    global _listener, _handler
+
+    if _listener is None:
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers = [logging.StreamHandler(sys.stdout)]
+        if logFile is not None:
+            handlers.append(logging.FileHandler(logFile))
+        for h in handlers:
+            h.setFormatter(formatter)
+
+        q = queue.Queue(config.LOG_QUEUE_SIZE)
+        _handler = DroppingQueueHandler(q)
+        _listener = logging.handlers.QueueListener(q, *handlers)
+        _listener.start()
+
+        root = logging.getLogger()
+        for h in root.handlers[:]:
+            root.removeHandler(h)
+        root.addHandler(_handler)
+        root.setLevel(logging.DEBUG) # Filtering is done on the component loggers.
+        atexit.register(stopLogging)
+
+    logger = logging.getLogger(component)
+    logger.setLevel(getLevel(component))
+    return logger
+
+def stopLogging():
+    """
+    Flushes any queued records and stops the background writer.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        if _handler.dropped > 0:
+            sys.stderr.write("%i log records were dropped\n" % _handler.dropped)
+
+class SampledLogger():
+    """
+    Wrapper over a logger that emits at most one record per interval.
+
+    Meant for per-sample or per-cycle output in hot paths. Records in between are counted and the count is appended to the next emitted record.
+    When the level is disabled, the cost is a single level check.
+    """
+    def __init__(self, logger: logging.Logger, interval: float = None):
+        """
+        Initialises SampledLogger
+
+        Args:
+            logger (logging.Logger): Logger to emit records to.
+            interval (float, optional): Minimum number of seconds between records. Defaults to config.LOG_SAMPLE_INTERVAL.
+        """
+        self.logger = logger
+        self.interval = config.LOG_SAMPLE_INTERVAL if interval is None else interval
+        self.nextTime = 0.0
+        self.suppressed = 0
+
+    def debug(self, msg: str, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg: str, *args):
+        self.log(logging.INFO, msg, *args)
+
+    def log(self, level: int, msg: str, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+
+        now = time.monotonic()
+        if now < self.nextTime:
+            self.suppressed += 1
+            return
+
+        self.nextTime = now + self.interval
+        if self.suppressed > 0:
+            msg = msg + " (%i suppressed)" % self.suppressed
+            self.suppressed = 0
+        self.logger.log(level, msg, *args)
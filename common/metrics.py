@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+
+import json
+import logging
+import threading
+import time
+import sys
+import zmq
+sys.path.append("..")
+import config
+from common.histogram import Histogram
+
+class Counter():
+    """
+    Monotonically increasing count, e.g. messages published.
+    """
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n: int = 1):
+        with self.lock:
+            self.value += n
+
+class Gauge():
+    """
+    Point in time value, e.g. a queue depth.
+
+    Either set explicitly, or computed from a callback whenever a snapshot is taken.
+    """
+    def __init__(self, fn=None):
+        self.fn = fn
+        self._value = None
+
+    def set(self, value: float):
+        self._value = value
+
+    @property
+    def value(self):
+        if self.fn is not None:
+            try:
+                return self.fn()
+            except Exception:
+                return None
+        return self._value
+
+class MetricsRegistry():
+    """
+    Collection of the named counters, gauges and histograms of one process.
+
+    Metrics are created on first use, so instrumented code only needs the name.
+    Names are dotted, e.g. "msgs_out.local_imu" or "predictor.feature_time".
+    """
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def counter(self, name: str) -> Counter:
+        with self.lock:
+            if name not in self.counters:
+                self.counters[name] = Counter()
+            return self.counters[name]
+
+    def gauge(self, name: str, fn=None) -> Gauge:
+        with self.lock:
+            if name not in self.gauges:
+                self.gauges[name] = Gauge(fn)
+            elif fn is not None:
+                self.gauges[name].fn = fn
+            return self.gauges[name]
+
+    def histogram(self, name: str, unit: float = 1e-6) -> Histogram:
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(unit)
+            return self.histograms[name]
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: Current value of every counter and gauge and a summary of every histogram.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = dict(self.histograms)
+        return {
+            "counters": {k: c.value for k, c in counters.items()},
+            "gauges": {k: g.value for k, g in gauges.items()},
+            "histograms": {k: h.snapshot() for k, h in histograms.items()},
+        }
+
+# Registry of this process.
+registry = MetricsRegistry()
+
+class MetricsPublisher(threading.Thread):
+    """
+    Publishes snapshots of a registry on the metrics topic at a fixed interval.
+
+    The PUB socket connects (rather than binds) to METRICS_SOCK, so any number of processes can report to the one monitor bound there.
+    Message format: "<topic> <json>", where the json holds the process name, the time and the snapshot.
+    """
+    def __init__(self, process: str, reg: MetricsRegistry, sockAddr: str, topic: str, interval: float):
+        threading.Thread.__init__(self, daemon=True)
+        self.shutdown = threading.Event()
+        self.process = process
+        self.registry = reg
+        self.sockAddr = sockAddr
+        self.topic = topic
+        self.interval = interval
+        self.startTime = time.time()
+
+    def run(self):
+        context = zmq.Context()
+        publisher = context.socket(zmq.PUB)
+        publisher.setsockopt(zmq.LINGER, 0)
+        publisher.connect(self.sockAddr)
+
+        while not self.shutdown.wait(self.interval):
+            snap = self.registry.snapshot()
+            snap["process"] = self.process
+            snap["time"] = time.time()
+            snap["uptime"] = snap["time"] - self.startTime
+            publisher.send_string("%s %s" % (self.topic, json.dumps(snap)))
+
+        publisher.close()
+
+_publisher = None
+
+def startMetrics(process: str) -> MetricsRegistry:
+    """
+    Starts publishing this process' metrics, if enabled in config.
+
+    Args:
+        process (str): Name the snapshots are published under, e.g. "Predictor".
+
+    Returns:
+        MetricsRegistry: Registry of this process.
+    """
+    global _publisher
+    if config.METRICS_ENABLED and _publisher is None:
+        _publisher = MetricsPublisher(process, registry, config.METRICS_SOCK, config.METRICS_TOPIC, config.METRICS_INTERVAL)
+        _publisher.start()
+        logging.getLogger(process).info("Publishing metrics to %s every %.1f seconds", config.METRICS_SOCK, config.METRICS_INTERVAL)
+    return registry
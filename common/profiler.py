@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+
+import cProfile
+import functools
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+sys.path.append("..")
+import config
+from common.metrics import registry
+
+# cProfile capture in progress, used by the functions wrapped with timed().
+_cprofile = None
+_cprofileLock = threading.Lock()
+# Capture in progress, only one at a time per process.
+_capture = None
+
+def timed(name: str):
+    """
+    Decorator recording the run time of every call into the "timed.<name>" histogram of the metrics registry.
+
+    When config.PROFILE_ENABLED is off the function is returned as is, so there is no overhead at all.
+    While a cProfile capture is running, calls are also run under the profiler.
+
+    Args:
+        name (str): Name of the histogram, e.g. "predictor.extract_sepfeat".
+    """
+    def decorator(fn):
+        if not config.PROFILE_ENABLED:
+            return fn
+        hist = registry.histogram("timed." + name)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            # A Profile object can only be active in one thread at a time, concurrent calls run unprofiled.
+            # Read once: the capture thread clears it without the lock, once its duration is over.
+            profile = _cprofile
+            if profile is not None and _cprofileLock.acquire(blocking=False):
+                try:
+                    result = profile.runcall(fn, *args, **kwargs)
+                finally:
+                    _cprofileLock.release()
+            else:
+                result = fn(*args, **kwargs)
+            hist.record(time.perf_counter() - t0)
+            return result
+        return wrapper
+    return decorator
+
+def collapseStack(frame, threadName: str) -> str:
+    """
+    Returns:
+        str: Stack of a frame in collapsed format, "<thread>;<outermost>;...;<innermost>", each entry "<function> (<file>:<line>)".
+    """
+    entries = []
+    while frame is not None:
+        code = frame.f_code
+        entries.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+        frame = frame.f_back
+    entries.append(threadName)
+    return ";".join(reversed(entries))
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stacks of all other threads of the process at a fixed interval for a fixed duration.
+
+    The result is written in collapsed stack format ("<stack> <count>" per line), which flamegraph.pl and speedscope read directly.
+    """
+    def __init__(self, process: str, duration: float, interval: float):
+        threading.Thread.__init__(self, daemon=True)
+        self.process = process
+        self.duration = duration
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+
+    def run(self):
+        global _capture
+        try:
+            own = threading.get_ident()
+            end = time.monotonic() + self.duration
+            t = time.monotonic()
+            while t < end:
+                names = {th.ident: th.name for th in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    stack = collapseStack(frame, names.get(ident, "thread-%d" % ident))
+                    self.counts[stack] = self.counts.get(stack, 0) + 1
+                self.samples += 1
+                # Absolute deadlines, so the sampling rate does not drift with the time spent sampling.
+                t += self.interval
+                delay = t - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            path = outputPath(self.process, "collapsed")
+            with open(path, "w") as f:
+                for stack, count in sorted(self.counts.items()):
+                    f.write("%s %d\n" % (stack, count))
+            logging.getLogger(self.process + ".profiler").info("Wrote %d stack samples to %s", self.samples, path)
+        finally:
+            _capture = None
+
+class CProfileCapture(threading.Thread):
+    """
+    Runs the functions wrapped with timed() under cProfile for a fixed duration and writes the stats (pstats format).
+    """
+    def __init__(self, process: str, duration: float):
+        threading.Thread.__init__(self, daemon=True)
+        self.process = process
+        self.duration = duration
+
+    def run(self):
+        global _capture, _cprofile
+        try:
+            profile = cProfile.Profile()
+            _cprofile = profile
+            time.sleep(self.duration)
+            _cprofile = None
+            # Wait for a profiled call still in progress.
+            with _cprofileLock:
+                path = outputPath(self.process, "prof")
+                profile.dump_stats(path)
+            logging.getLogger(self.process + ".profiler").info("Wrote cProfile stats to %s", path)
+        finally:
+            _capture = None
+
+def outputPath(process: str, extension: str) -> str:
+    os.makedirs(config.PROFILE_FOLDER, exist_ok=True)
+    name = "%s_%d_%s.%s" % (process, os.getpid(), time.strftime("%d%m%Y_%H%M%S"), extension)
+    return os.path.join(config.PROFILE_FOLDER, name)
+
+def startCapture(process: str, mode: str = "stack", duration: float = None) -> bool:
+    """
+    Starts a profile capture in the background.
+
+    Args:
+        process (str): Name of the process, used in the output file name.
+        mode (str, optional): "stack" for sampled stacks of all threads, "cprofile" for cProfile stats of the timed() functions. Defaults to "stack".
+        duration (float, optional): Seconds to capture. Defaults to config.PROFILE_DURATION.
+
+    Returns:
+        bool: False if a capture is already running.
+    """
+    global _capture
+    if _capture is not None:
+        return False
+    duration = config.PROFILE_DURATION if duration is None else duration
+    if mode == "stack":
+        _capture = StackSampler(process, duration, config.PROFILE_SAMPLE_INTERVAL)
+    else:
+        _capture = CProfileCapture(process, duration)
+    logging.getLogger(process + ".profiler").info("Capturing %s profile for %.1f seconds", mode, duration)
+    _capture.start()
+    return True
+
+def installProfiler(process: str):
+    """
+    Lets a running process be profiled on demand, if config.PROFILE_ENABLED is set:
+        kill -USR1 <pid>   captures sampled stacks of all threads
+        kill -USR2 <pid>   captures cProfile stats of the timed() functions
+    Must be called from the main thread.
+
+    Args:
+        process (str): Name of the process, used in the output file names.
+    """
+    if not config.PROFILE_ENABLED or not hasattr(signal, "SIGUSR1"):
+        return
+    # The handlers only start the capture thread, the sampling itself never runs in the signal handler.
+    signal.signal(signal.SIGUSR1, lambda signum, frame: startCapture(process, "stack"))
+    signal.signal(signal.SIGUSR2, lambda signum, frame: startCapture(process, "cprofile"))
+    logging.getLogger(process).info("Profiling on SIGUSR1 (stacks) / SIGUSR2 (cProfile) of pid %d, written to %s", os.getpid(), config.PROFILE_FOLDER)
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+
+"""
+Trace metadata carried on the wire messages.
+
+IMU sample messages end with:   <tAcq> <tPub> <seq>
+Prediction messages end with:   <tAcq> <tPub> <tStart> <tFeat> <tInfer> <tPredPub>
+
+tAcq     : Time the (newest) sample was acquired from the sensor.
+tPub     : Time the sample was published by the DataProvider.
+tStart   : Time the Predictor started the cycle on the window containing the sample.
+tFeat    : Time feature extraction ended.
+tInfer   : Time inference ended.
+tPredPub : Time the prediction was published.
+seq      : Sequence number of the sample, sent whether tracing is enabled or not.
+
+All times are wall-clock (time.time()) seconds, all components are expected to run on the same host.
+"""
+
+import logging
+import sys
+import time
+sys.path.append("..")
+import config
+from common.metrics import registry
+
+SAMPLE_TRACE_LEN = 2
+PREDICT_TRACE_LEN = 6
+TRACE_FMT = " %.6f"
+
+# Stages reported by the LatencyCollector, in pipeline order.
+STAGES = [
+    "acquire->publish",
+    "publish->window",
+    "feature",
+    "inference",
+    "publish->actuate",
+    "freeze->cue",
+]
+
+def now() -> float:
+    return time.time()
+
+def formatTrace(*times: float) -> str:
+    """
+    Formats timestamps to be appended to a wire message.
+
+    Args:
+        times (float): Timestamps, in wire order.
+
+    Returns:
+        str: Timestamps with a leading space each. Empty if tracing is disabled.
+    """
+    if not config.TRACE_ENABLED:
+        return ""
+    return (TRACE_FMT * len(times)) % times
+
+def formatSampleTail(tAcq: float, tPub: float, seq: int) -> str:
+    """
+    Formats the end of an IMU sample message: its trace timestamps, if tracing is enabled, then its sequence number.
+    """
+    return formatTrace(tAcq, tPub) + " %d" % seq
+
+def parseSampleTail(fields: list) -> tuple:
+    """
+    Extracts the trace and sequence number from the fields of an IMU sample message following its values.
+    Messages from publishers predating the sequence numbers end with the trace only.
+
+    Args:
+        fields (list): Remaining fields of the message after the values.
+
+    Returns:
+        tuple: (tAcq, tPub, seq), each None if the message does not carry it.
+    """
+    if len(fields) == SAMPLE_TRACE_LEN + 1:
+        return float(fields[0]), float(fields[1]), int(fields[2])
+    if len(fields) == SAMPLE_TRACE_LEN:
+        return float(fields[0]), float(fields[1]), None
+    if len(fields) == 1:
+        return None, None, int(fields[0])
+    return None, None, None
+
+def parsePredictTrace(fields: list) -> tuple:
+    """
+    Extracts the trace from the fields of a prediction message following the predicted state.
+
+    Args:
+        fields (list): Remaining fields of the message after the topic and state.
+
+    Returns:
+        tuple: (tAcq, tPub, tStart, tFeat, tInfer, tPredPub), or None if the message carries no trace.
+    """
+    if len(fields) < PREDICT_TRACE_LEN:
+        return None
+    return tuple(float(f) for f in fields[:PREDICT_TRACE_LEN])
+
+class LatencyCollector():
+    """
+    Computes per-stage latency histograms from prediction traces and the time feedback was actuated.
+
+    The histograms live in the process' metrics registry as "latency.<stage>", so they are also published with the metrics.
+    """
+    def __init__(self, name: str, reportInterval: float = None):
+        """
+        Initialises LatencyCollector
+
+        Args:
+            name (str): Name used in the logged summaries, e.g. the actuator.
+            reportInterval (float, optional): Seconds between logged summaries. Defaults to config.TRACE_REPORT_INTERVAL.
+        """
+        self.name = name
+        self.histograms = {s: registry.histogram("latency." + s) for s in STAGES}
+        self.reportInterval = config.TRACE_REPORT_INTERVAL if reportInterval is None else reportInterval
+        self.nextReport = time.monotonic() + self.reportInterval
+        self.log = logging.getLogger(name + ".latency")
+
+    def record(self, trace: tuple, tActuate: float):
+        """
+        Records the latencies of one prediction that led to feedback being actuated.
+
+        Args:
+            trace (tuple): Trace parsed with parsePredictTrace().
+            tActuate (float): Time the feedback was dispatched to the actuator.
+        """
+        tAcq, tPub, tStart, tFeat, tInfer, tPredPub = trace
+        h = self.histograms
+        h["acquire->publish"].record(tPub - tAcq)
+        h["publish->window"].record(tStart - tPub)
+        h["feature"].record(tFeat - tStart)
+        h["inference"].record(tInfer - tFeat)
+        h["publish->actuate"].record(tActuate - tPredPub)
+        h["freeze->cue"].record(tActuate - tAcq)
+
+        if time.monotonic() >= self.nextReport:
+            self.nextReport = time.monotonic() + self.reportInterval
+            self.logSummary()
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: Histogram snapshot of every stage.
+        """
+        return {s: self.histograms[s].snapshot() for s in STAGES}
+
+    def logSummary(self):
+        for stage, snap in self.summary().items():
+            if snap["count"] == 0:
+                continue
+            self.log.info("%-16s n=%-6i p50=%7.1fms p90=%7.1fms p99=%7.1fms max=%7.1fms",
+                stage, snap["count"], snap["p50"] * 1e3, snap["p90"] * 1e3, snap["p99"] * 1e3, snap["max"] * 1e3)
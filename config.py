@@ -4,8 +4,15 @@
 DATA_SOCK           = "tcp://127.0.0.1:5556"
 LOCAL_IMU_TOPIC     = "local_imu"
 REMOTE_IMU_TOPIC    = "remote_imu"
+REMOTE_DATA_SOCK    = "tcp://127.0.0.1:5561" # Bound by RemoteIMU.py, so it can run alongside DataPublisher.py
+DATA_MSG_FORMAT     = "text"    # "text", or "binary" to send samples as packed records (see DataProvider/lib/IMUValue.py)
 WAIT_FOR_USER       = True
 USE_MOCK_DATA       = True # Set to False to read and use actual IMU data.
+REPLAY_PATH         = None # .npy file of recorded samples to replay instead (see DataProvider/convertReplay.py), takes precedence over USE_MOCK_DATA
+REPLAY_START        = None # Recorded time (s) to start the replay from, None for the beginning
+REPLAY_BLOCK_SIZE   = 1    # Samples per block; with DATA_MSG_FORMAT = "binary" each block is sent as one message
+DATASET_CACHE_FOLDER = "dataset_cache/" # Converted trials used as mock data (see DataProvider/lib/DatasetCache.py)
+DATASET_CACHE_HASH  = False # Detect changed trials by content instead of modification time and size
 MOCK_DATA_FOLDER    = "mock_data"
 MOCK_DATA_PATHS     = [
                         "FoG-T-141_2_t1_s1.csv",
@@ -24,6 +31,17 @@ REMOTE_MOCK_PATHS   = [
                         "sample_1.csv"
                         ]
                         
+# Foot merge stage (see DataProvider/FootMerger.py)
+USE_FOOT_MERGE      = False # Predictor reads the merged left and right foot samples from GAIT_SOCK instead of LOCAL_IMU_TOPIC on DATA_SOCK
+GAIT_SOCK           = "tcp://127.0.0.1:5562"
+GAIT_TOPIC          = "gait"
+LEFT_FOOT_TOPIC     = LOCAL_IMU_TOPIC
+RIGHT_FOOT_TOPIC    = REMOTE_IMU_TOPIC
+MERGE_MODE          = "linear"  # "linear" interpolates the right foot at the time of each left foot sample, "nearest" takes the closest sample
+MERGE_MAX_DELAY     = 0.1       # Seconds a left foot sample waits for the right foot before the last right foot sample is reused
+MERGE_MAX_HOLD      = 0.2       # Seconds a right foot sample is reused for at most, the left foot samples are dropped past that (e.g. BLE dropout)
+MERGE_BUFFER_SIZE   = 50        # Samples buffered per foot
+
 # Remote IMU BLE configuration parameters
 BLE_DEV_NAME        = "Adafruit Bluefruit LE"   # Name of device of interest
 BLE_DATA_SVC_UUID   = "abc0"    # UUID for data stream service
@@ -32,15 +50,34 @@ BLE_SCAN_TIMEOUT    = 3     # Scan duration (seconds)
 BLE_RESCAN_INTS     = 1.0   # Seconds between scan attempts
 BLE_CONN_ATTEMPTS   = 5     # Number of connection attempts before rescanning
 BLE_RECONN_INTS     = 1.0   # Seconds between connection attempts
+BLE_CACHE_PATH      = "../ble_cache.json" # Last known addresses and GATT handles of the BLE devices, in the repository root, shared by the components
 
 # Predictor
 PREDICT_SOCK        = "tcp://127.0.0.1:5557"
 PREDICT_READY_SOCK  = "tcp://127.0.0.1:5559"
+READY_RETRY_INTERVAL = 2.0      # Seconds a data publisher waits for the Predictor's ready reply before asking again
 PREDICT_TOPIC       = "ps"
+CADENCE_TOPIC       = "cadence" # Step cadence (steps/min) of the windows predicted as Walk, also published on PREDICT_SOCK
 PREDICT_MODE        = "MLP"
 WIN_SIZE            = 100
 SAMPLE_RATE         = 50
 TEST_RATE           = 10
+BUFFER_SIZE         = 500       # Samples buffered between reading and prediction (10 s at 50 Hz)
+BUFFER_OVERFLOW     = "drop_oldest" # When the buffer is full: "drop_oldest" keeps the newest samples, "block" holds up the reader
+ADAPTIVE_RATE       = False     # Predict at REST_RATE while the feet are still, at ACTIVE_RATE while walking or turning, at TEST_RATE otherwise
+REST_RATE           = 2         # Predictions per second at rest
+ACTIVE_RATE         = 10        # Predictions per second while walking or turning, if the cycles have time for it. Above TEST_RATE it costs more CPU than the fixed rate, see benchmarks/README.md
+REST_ENERGY         = 60.0      # Motion energy (std of the summed gyroscope norms of both feet, raw units) below which the feet are still
+ACTIVE_ENERGY       = 600.0     # Motion energy above which the feet are walking or turning
+RATE_HOLD           = 3.0       # Seconds the motion must stay lower before the rate is lowered, it is raised at once
+MOTION_WINDOW       = 1.0       # Seconds of samples the motion energy is taken over
+RATE_DEADLINE       = 0.7       # Share of the period the average prediction cycle may take before the rate is lowered
+CASCADE             = False     # Skip the DWT features and the FoG model for the windows the gate below tells are walking
+GATE_MAX_FI         = 0.25      # Walking: freeze index of the angular speed of both legs below this...
+GATE_MAX_ACC_FI     = 1.0       # ...freeze index of their acceleration below this...
+GATE_MIN_POWER      = 1e9       # ...and locomotion band power of their angular speed (raw units, 3 axes summed) above this
+GAP_INTERPOLATE_MAX = 5         # Missing samples in a row (by sequence number) the Predictor interpolates, its window starts over after a longer gap
+GAP_MAX_STALL       = 1.0       # Seconds without samples after which the window starts over, for publishers sending no sequence number
 LDA_JOBLIB_PATH     = "./lib/lda_all.joblib"
 RF_JOBLIB_PATH      = "./lib/rf_all.joblib"
 SCL_D_JOBLIB_PATH   = "./lib/SCL_D.bin"
@@ -53,7 +90,109 @@ BTN_SOCK            = "tcp://127.0.0.1:5558"
 BTN_TOPIC           = "button"
 SOUNDS_FOLDER       = "sounds/"
 STOP_SOUND_PATH     = "stop.wav"
+AUDIO_SINK          = "aplay"   # "aplay" plays on the connected audio device, "null" discards the audio, any other value is a .wav file to write it to
+AUDIO_PERIOD        = 0.02      # Seconds of audio written to the output at a time
+AUDIO_LEAD          = 2         # Periods written ahead of the output: a cue starts or stops within about AUDIO_LEAD * AUDIO_PERIOD seconds
+AUDIO_BUFFER_TIME   = 0.1       # ALSA buffer of the aplay output (s)
+CUE_REPEAT_INTERVAL = 1.0       # Seconds of silence between repetitions of the cue while FoG lasts
+FOG_CUES            = ["stop"]  # Cues played while FoG lasts: "stop" (STOP_SOUND_PATH every CUE_REPEAT_INTERVAL) and/or "metronome"
+METRONOME_SOUND_PATH = None     # Tick of the metronome, in the folder SOUNDS_FOLDER. None for a synthesised click
+METRONOME_TEMPO     = 100.0     # Beats per minute until a walking cadence has been received from the Predictor
+METRONOME_TEMPO_SCALE = 1.0     # Tempo as a share of the recent walking cadence
+METRONOME_MIN_TEMPO = 60.0      # Bounds of the tempo (beats per minute)
+METRONOME_MAX_TEMPO = 150.0
+METRONOME_ADAPT     = 0.1       # Weight of each cadence estimate in the tempo, an exponential average over the recent windows
 SPEAKER_MAC         = "D8:37:3B:1C:74:AD" # JBL Go 3 speaker
 HEADPHONE_MAC       = "20:74:CF:5E:9F:76" # AfterShokz Titanium headphone
 AUDIO_MACS          = [HEADPHONE_MAC, SPEAKER_MAC] # The ealrlier items have higher priority
+BT_CONNECT_TIMEOUT  = 10.0      # Seconds to wait for an audio device to connect
+BT_USE_MOCK         = False     # Simulate the audio devices instead of using bluetoothctl (see Feedback/BluetoothState.py)
+WRIST_POLL_INTERVAL = 0.02      # Seconds WristFeedback waits for button notifications between writes, bounds how long a vibration command waits
+WRIST_KEEPALIVE_INTERVAL = 2.0  # Seconds after which the vibration state is written again although unchanged, 0 to never
+WRIST_WRITE_NO_RESPONSE = True  # Write vibration commands without response where the characteristic allows it
+WRIST_USE_MOCK      = False     # Simulate the wrist device instead of using BLE (see Feedback/BleCommandQueue.py)
+
+# BLE manager (see BleManager/BleManager.py)
+BLE_USE_MANAGER     = False     # RemoteIMU.py and WristFeedback.py go through BleManager.py instead of connecting to their devices themselves
+BLE_NOTIFY_SOCK     = "tcp://127.0.0.1:5564" # Bound by BleManager.py, notifications and connection states of the devices
+BLE_WRITE_SOCK      = "tcp://127.0.0.1:5565" # Bound by BleManager.py, writes to the devices
+BLE_POLL_INTERVAL   = 0.02      # Seconds each connection waits for notifications between writes
+BLE_STATS_INTERVAL  = 1.0       # Seconds over which the throughput and connection interval of each device are measured
+BLE_DEVICES         = [         # "role" names the device on the sockets, in the metrics and in BLE_CACHE_PATH. "write" and "notify" map
+                                # the names of the characteristics to their UUIDs, only one is notified.
+                        {"role": "remote_imu", "name": BLE_DEV_NAME, "service": BLE_DATA_SVC_UUID, "notify": {"data": BLE_DATA_CHAR_UUID},
+                         "write": {}},
+                        {"role": "wrist", "name": "Adafruit Bluefruit LE", "service": "abd0", "notify": {"button": "abd2"},
+                         "write": {"vib": "abd1"}, "writeNoResponse": WRIST_WRITE_NO_RESPONSE, "keepAlive": WRIST_KEEPALIVE_INTERVAL,
+                         "mock": WRIST_USE_MOCK},
+                        ]
+
+# Recorder
+RECORDER_FOLDER     = "recordings/"
+RECORDER_PREFIX     = "session"
+RECORD_PREDICTIONS  = True
+RECORD_BUTTONS      = True
+RECORDER_CHUNK_ROWS = 500       # Records per chunk, 10 s of samples at 50 Hz
+RECORDER_FLUSH_INTERVAL = 5.0   # Maximum seconds a record is held before its chunk is written
+RECORDER_FSYNC_INTERVAL = 30.0  # Minimum seconds between fsyncs, bounds what a power loss can lose
+RECORDER_ROTATE_BYTES   = 256 * 2**20 # Start a new file past this size...
+RECORDER_ROTATE_SECONDS = 3600.0      # ...or this age
+RECORDER_COMPRESS_LEVEL = 1     # zlib level of the chunks, 0 to store them uncompressed
+
+# Logging
+LOG_LEVEL           = "INFO"    # Default level of every component
+LOG_LEVELS          = {         # Per component levels, overrides LOG_LEVEL
+                        "DataProvider"  : "INFO",
+                        "RemoteIMU"     : "INFO",
+                        "Predictor"     : "INFO",
+                        "Feedback"      : "INFO",
+                        "WristFeedback" : "INFO",
+                        "Recorder"      : "INFO",
+                        "FootMerger"    : "INFO",
+                        "Supervisor"    : "INFO",
+                        "BleManager"    : "INFO",
+                        }
+LOG_QUEUE_SIZE      = 10000     # Records queued for the background writer; beyond this they are dropped instead of blocking
+LOG_SAMPLE_INTERVAL = 1.0       # Minimum seconds between sampled (per sample/per cycle) log lines
+
+# Latency tracing
+TRACE_ENABLED       = True      # Append trace timestamps to the IMU and prediction messages
+TRACE_REPORT_INTERVAL = 30.0    # Seconds between latency summaries logged by the Feedback components
+
+# Metrics
+METRICS_ENABLED     = True
+METRICS_SOCK        = "tcp://127.0.0.1:5560" # Bound by metrics_monitor.py, every component connects to it
+METRICS_TOPIC       = "metrics"
+METRICS_INTERVAL    = 5.0       # Seconds between published snapshots
+
+# Profiling (see common/profiler.py)
+PROFILE_ENABLED     = True      # Record timed() functions and capture profiles on SIGUSR1/SIGUSR2
+PROFILE_FOLDER      = "profiles/"
+PROFILE_DURATION    = 10.0      # Seconds captured per request
+PROFILE_SAMPLE_INTERVAL = 0.005 # Seconds between stack samples
+
+# Supervisor (see supervisor.py)
+HEARTBEAT_ENABLED   = True
+HEARTBEAT_SOCK      = "tcp://127.0.0.1:5563" # Bound by supervisor.py, every component connects to it
+HEARTBEAT_TOPIC     = "hb"
+HEARTBEAT_INTERVAL  = 1.0       # Seconds between heartbeats
+HEARTBEAT_TIMEOUT   = 5.0       # Seconds without a heartbeat, or without progress of a worker loop, after which a component is restarted
+SUPERVISOR_START_TIMEOUT = 60.0 # Seconds a component may take to report ready (e.g. loading its models) before it is restarted
+SUPERVISOR_BACKOFF  = 1.0       # Seconds before the first restart, doubled on every restart in a row...
+SUPERVISOR_MAX_BACKOFF = 60.0   # ...up to this
+SUPERVISOR_STABLE_TIME = 60.0   # Seconds a component must stay up for its backoff to be reset
+SUPERVISOR_STOP_TIMEOUT = 5.0   # Seconds a component is given to exit on SIGINT before it is killed
+SUPERVISOR_COMPONENTS = [       # Started in order, each once the components in "after" are ready. "name" is the name its heartbeats are sent under.
+                                # With "when", only run if that setting is true; a component that does not run is not waited for.
+                        {"name": "Predictor",     "folder": "Predictor",    "script": "Predictor.py",     "after": []},
+                        {"name": "BleManager",    "folder": "BleManager",   "script": "BleManager.py",    "after": [], "when": "BLE_USE_MANAGER"},
+                        {"name": "DataProvider",  "folder": "DataProvider", "script": "FULLPublisher.py", "after": ["Predictor"]},
+                        {"name": "RemoteIMU",     "folder": "DataProvider", "script": "RemoteIMU.py",     "after": ["Predictor", "BleManager"], "when": "USE_FOOT_MERGE"},
+                        {"name": "Feedback",      "folder": "Feedback",     "script": "Feedback.py",      "after": ["Predictor"]},
+                        {"name": "WristFeedback", "folder": "Feedback",     "script": "WristFeedback.py", "after": ["Predictor", "BleManager"]},
+                        ]
 
+# Overrides of any of the values above for a single run, given as JSON in the FOG_CONFIG environment variable.
+# e.g. FOG_CONFIG='{"WIN_SIZE": 200, "TEST_RATE": 5}' python3 Predictor.py
+import os as _os, json as _json
+globals().update(_json.loads(_os.environ.get("FOG_CONFIG", "{}")))
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+
+#
+#   Metrics monitor
+#   Binds SUB socket to config.METRICS_SOCK
+#   Prints the metrics snapshots published by every component (see common/metrics.py)
+#
+
+import json
+import sys
+import zmq
+import config
+
+def printSnapshot(snap: dict):
+    print("==== %s (up %.0f s) ====" % (snap["process"], snap["uptime"]))
+    for name, value in sorted(snap["counters"].items()):
+        print("  %-40s %d" % (name, value))
+    for name, value in sorted(snap["gauges"].items()):
+        print("  %-40s %s" % (name, value))
+    for name, h in sorted(snap["histograms"].items()):
+        if h["count"] == 0:
+            continue
+        # Histograms of times (in seconds, recorded to a fraction of a second) are shown in ms, those of counts as they are
+        if h.get("unit", 1e-6) < 1:
+            print("  %-40s n=%d p50=%.2fms p99=%.2fms max=%.2fms" % (name, h["count"], h["p50"] * 1e3, h["p99"] * 1e3, h["max"] * 1e3))
+        else:
+            print("  %-40s n=%d p50=%g p99=%g max=%g" % (name, h["count"], h["p50"], h["p99"], h["max"]))
+
+if __name__ == "__main__":
+    # Only show these processes, if given.
+    processes = sys.argv[1:]
+
+    context = zmq.Context()
+    sub = context.socket(zmq.SUB)
+    sub.bind(config.METRICS_SOCK)
+    sub.setsockopt_string(zmq.SUBSCRIBE, config.METRICS_TOPIC)
+
+    while True:
+        try:
+            topic, payload = sub.recv_string().split(" ", 1)
+            snap = json.loads(payload)
+            if len(processes) == 0 or snap["process"] in processes:
+                printSnapshot(snap)
+        except KeyboardInterrupt:
+            break
+
+    context.destroy()
@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+
+#
+#   Pipeline supervisor
+#   Starts the components listed in SUPERVISOR_COMPONENTS, each once the components it depends on report ready
+#   Binds a SUB socket to HEARTBEAT_SOCK (see common/heartbeat.py) and restarts, with exponential backoff,
+#   the components that exit, stop sending heartbeats or report a worker loop stalled
+#   Reports the time from start to the first prediction on PREDICT_SOCK
+#
+#   Usage (from the repository root):
+#       python3 supervisor.py [<component> ...]     All components of SUPERVISOR_COMPONENTS by default
+#
+
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import zmq
+import config
+from common.log import setupLogging
+from common.metrics import registry, startMetrics
+from common.heartbeat import READY, STALLED
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+POLL_TIMEOUT = 200 # ms
+# Component whose (re)start is timed up to the next prediction
+PREDICTOR = "Predictor"
+
+# States of a component, as seen by the supervisor
+STOPPED = "stopped"     # Not running: waiting for its dependencies, or for its restart time
+STARTING = "starting"   # Running, not reported ready yet
+
+log = logging.getLogger("Supervisor")
+
+class Component():
+    """
+    A supervised process, started as "python3 <script>" from its folder.
+    """
+    def __init__(self, name: str, folder: str, script: str, after: list):
+        self.name = name
+        self.folder = folder
+        self.script = script
+        self.after = after
+        self.process = None
+        self.state = STOPPED
+        self.startedAt = None
+        self.readyAt = None
+        self.lastHeartbeat = None
+        self.failures = 0 # In a row, sets the backoff
+        self.restartAt = 0.0
+        self.restarts = registry.counter("supervisor.restarts." + name)
+        self.readyTime = registry.gauge("supervisor.ready_time." + name)
+
+    def start(self, env: dict):
+        # In a session of its own, so a Ctrl-C in the terminal only reaches the supervisor, which then stops the components in order
+        self.process = subprocess.Popen([sys.executable, self.script], cwd=os.path.join(ROOT, self.folder), env=env, stdin=subprocess.DEVNULL,
+            start_new_session=True)
+        self.state = STARTING
+        self.startedAt = time.time()
+        self.readyAt = None
+        self.lastHeartbeat = None
+        log.info("Started %s (pid %d)", self.name, self.process.pid)
+
+    def stop(self, timeout: float):
+        """
+        Asks the process to exit with SIGINT, as Ctrl-C would, and kills it if it has not after 'timeout' seconds.
+        """
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                log.warning("%s did not exit, killing it", self.name)
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+        self.state = STOPPED
+
+    def fail(self):
+        """
+        Schedules a restart after the current backoff, which doubles with every failure in a row.
+        """
+        self.stop(config.SUPERVISOR_STOP_TIMEOUT)
+        self.failures += 1
+        backoff = min(config.SUPERVISOR_MAX_BACKOFF, config.SUPERVISOR_BACKOFF * 2 ** (self.failures - 1))
+        self.restartAt = time.time() + backoff
+        self.restarts.inc()
+        log.info("Restarting %s in %.1f s", self.name, backoff)
+
+class Supervisor():
+    def __init__(self, components: list):
+        self.components = {c.name: c for c in components}
+        self.env = self.childEnv()
+        self.startTime = time.time()
+        # Time the Predictor was last (re)started, until the prediction following it arrives
+        self.awaitingPrediction = None
+        self.booted = False
+        self.firstPrediction = registry.gauge("supervisor.first_prediction")
+        self.recoveryTime = registry.gauge("supervisor.recovery_time")
+
+    def childEnv(self) -> dict:
+        # Nobody is there to press a key, and the components must see the same FOG_CONFIG overrides as the supervisor
+        overrides = json.loads(os.environ.get("FOG_CONFIG", "{}"))
+        overrides["WAIT_FOR_USER"] = False
+        return dict(os.environ, FOG_CONFIG=json.dumps(overrides))
+
+    def handleHeartbeat(self, message: str, now: float):
+        _, name, pid, state, _ = message.split()
+        c = self.components.get(name)
+        # Heartbeats still queued from an instance that has been replaced are ignored
+        if c is None or c.process is None or int(pid) != c.process.pid:
+            return
+        c.lastHeartbeat = now
+        if state == STALLED:
+            log.warning("%s reports a stalled worker loop", c.name)
+            c.fail()
+            return
+        if state == READY and c.state != READY:
+            c.state = READY
+            c.readyAt = now
+            c.readyTime.set(now - c.startedAt)
+            log.info("%s ready after %.2f s", c.name, now - c.startedAt)
+
+    def handlePrediction(self, now: float):
+        if self.awaitingPrediction is None:
+            return
+        if not self.booted:
+            self.booted = True
+            self.firstPrediction.set(now - self.startTime)
+            log.info("Startup to first prediction: %.2f s (%s)", now - self.startTime,
+                ", ".join("%s ready after %.2f s" % (c.name, c.readyAt - self.startTime) for c in self.components.values() if c.readyAt is not None))
+        else:
+            self.recoveryTime.set(now - self.awaitingPrediction)
+            log.info("%s restart to first prediction: %.2f s", PREDICTOR, now - self.awaitingPrediction)
+        self.awaitingPrediction = None
+
+    def check(self, now: float):
+        for c in self.components.values():
+            if c.process is None:
+                if now >= c.restartAt and all(self.components[d].state == READY for d in c.after if d in self.components):
+                    c.start(self.env)
+                    if c.name == PREDICTOR:
+                        self.awaitingPrediction = now
+                continue
+
+            code = c.process.poll()
+            if code is not None:
+                log.warning("%s exited with code %d", c.name, code)
+                c.fail()
+            elif c.state == STARTING and now - c.startedAt > config.SUPERVISOR_START_TIMEOUT:
+                log.warning("%s not ready after %.0f s", c.name, config.SUPERVISOR_START_TIMEOUT)
+                c.fail()
+            elif c.lastHeartbeat is not None and now - c.lastHeartbeat > config.HEARTBEAT_TIMEOUT:
+                log.warning("No heartbeat from %s for %.1f s", c.name, now - c.lastHeartbeat)
+                c.fail()
+            elif c.state == READY and c.failures > 0 and now - c.readyAt > config.SUPERVISOR_STABLE_TIME:
+                c.failures = 0
+
+    def run(self):
+        context = zmq.Context()
+        heartbeats = context.socket(zmq.SUB)
+        heartbeats.bind(config.HEARTBEAT_SOCK)
+        heartbeats.setsockopt_string(zmq.SUBSCRIBE, config.HEARTBEAT_TOPIC)
+        predictions = context.socket(zmq.SUB)
+        predictions.connect(config.PREDICT_SOCK)
+        predictions.setsockopt_string(zmq.SUBSCRIBE, config.PREDICT_TOPIC)
+        poller = zmq.Poller()
+        poller.register(heartbeats, zmq.POLLIN)
+        poller.register(predictions, zmq.POLLIN)
+
+        log.info("Supervising %s", ", ".join(self.components))
+        try:
+            while True:
+                events = dict(poller.poll(POLL_TIMEOUT))
+                now = time.time()
+                while heartbeats in events and heartbeats.poll(0):
+                    self.handleHeartbeat(heartbeats.recv_string(), now)
+                while predictions in events and predictions.poll(0):
+                    predictions.recv()
+                    self.handlePrediction(now)
+                self.check(now)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            log.info("Stopping components")
+            for c in reversed(list(self.components.values())):
+                c.stop(config.SUPERVISOR_STOP_TIMEOUT)
+            context.destroy()
+
+def selectComponents(names: list) -> list:
+    """
+    Args:
+        names (list): Names of the components to run, all of them if empty.
+
+    Returns:
+        list: Components of SUPERVISOR_COMPONENTS to run: those named, whose "when" setting is true.
+
+    Raises:
+        ValueError: If a component, or a dependency of one, is not in SUPERVISOR_COMPONENTS.
+    """
+    defined = [c["name"] for c in config.SUPERVISOR_COMPONENTS]
+    for name in names:
+        if name not in defined:
+            raise ValueError("Unknown component %s, SUPERVISOR_COMPONENTS has %s" % (name, ", ".join(defined)))
+    for c in config.SUPERVISOR_COMPONENTS:
+        for d in c["after"]:
+            if d not in defined:
+                raise ValueError("%s starts after %s, which is not in SUPERVISOR_COMPONENTS" % (c["name"], d))
+    # Dependencies left out are not waited for
+    return [Component(c["name"], c["folder"], c["script"], c["after"]) for c in config.SUPERVISOR_COMPONENTS
+        if (len(names) == 0 or c["name"] in names) and ("when" not in c or getattr(config, c["when"]))]
+
+def stopOnTerm(signum, frame):
+    # Stop the components on SIGTERM as on Ctrl-C, they run in sessions of their own and would be left behind otherwise
+    raise KeyboardInterrupt()
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, stopOnTerm)
+    setupLogging("Supervisor")
+    startMetrics("Supervisor")
+    Supervisor(selectComponents(sys.argv[1:])).run()